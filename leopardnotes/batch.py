@@ -0,0 +1,369 @@
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+
+from profiles.models import OCRBatch, OCRImage
+
+from .classify import classify_region
+from .metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+OCR_QUEUE_DEPTH = gauge(
+    "ocr_queue_depth", "Pages of running OCR batches that are not processed yet.", labelnames=("queue",),
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+PDF_DPI = 200
+
+
+class BatchError(Exception):
+    """
+        Raised when an uploaded batch file cannot be processed at all.
+    """
+
+
+def get_batch_kind(path, filename):
+    """
+        Tell whether an uploaded batch file is a PDF or a zip of images.
+
+        Args:
+            path (str): Path of the spooled upload.
+            filename (str): The name of the uploaded file.
+
+        Returns:
+            str: 'pdf' or 'zip'.
+    """
+    with open(path, "rb") as f:
+        if f.read(5) == b"%PDF-":
+            return "pdf"
+    if zipfile.is_zipfile(path):
+        return "zip"
+    raise BatchError(f"{filename} is neither a PDF nor a zip of images.")
+
+
+def count_pages(path, kind):
+    """
+        Count the pages of a batch file without rasterizing or extracting them.
+    """
+    if kind == "pdf":
+        fitz = import_fitz()
+        with fitz.open(path) as document:
+            return document.page_count
+
+    with zipfile.ZipFile(path) as archive:
+        return len(get_zip_image_names(archive))
+
+
+def import_fitz():
+    try:
+        import fitz
+    except ImportError:
+        raise BatchError("PDF uploads require PyMuPDF, install it with 'pip install PyMuPDF'.")
+    return fitz
+
+
+def get_zip_image_names(archive):
+    return sorted(
+        info.filename for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def read_zip_image(archive, name):
+    """
+        Extract one image of a zip batch, refusing images larger than OCR_BATCH_MAX_IMAGE_MB uncompressed.
+
+        The size is checked against the size recorded in the archive before anything is inflated. zipfile never
+        inflates a member past its recorded size, so a member lying about it cannot exceed the limit either.
+
+        Raises:
+            ValueError: If the image is too large.
+    """
+    info = archive.getinfo(name)
+    max_bytes = settings.OCR_BATCH_MAX_IMAGE_MB * 1024 * 1024
+    if info.file_size > max_bytes:
+        raise ValueError(
+            f"{name} is {info.file_size / 1024 / 1024:.0f} MB uncompressed, over the limit of "
+            f"{settings.OCR_BATCH_MAX_IMAGE_MB} MB."
+        )
+    return archive.read(info)
+
+
+def get_page_dpi(page):
+    """
+        Get the DPI to rasterize a PDF page at: PDF_DPI, lowered so the page has at most OCR_BATCH_MAX_PAGE_PIXELS.
+
+        Args:
+            page (fitz.Page): The page.
+
+        Returns:
+            int: The DPI.
+    """
+    # The page rectangle is in points, 72 per inch
+    area_at_dpi = page.rect.width * page.rect.height * (PDF_DPI / 72) ** 2
+    if area_at_dpi <= settings.OCR_BATCH_MAX_PAGE_PIXELS:
+        return PDF_DPI
+    return max(int(PDF_DPI * (settings.OCR_BATCH_MAX_PAGE_PIXELS / area_at_dpi) ** 0.5), 1)
+
+
+def iter_pages(path, kind):
+    """
+        Lazily yield the pages of a batch file one at a time, so only the pages being processed are in memory.
+
+        A page that cannot be rasterized or extracted is yielded with its exception instead of its bytes, so it fails
+        on its own without ending the batch.
+
+        Yields:
+            tuple: (1-based page number, image bytes or the exception raised while reading the page).
+    """
+    if kind == "pdf":
+        fitz = import_fitz()
+        with fitz.open(path) as document:
+            for index in range(document.page_count):
+                try:
+                    page = document.load_page(index)
+                    yield index + 1, page.get_pixmap(dpi=get_page_dpi(page)).tobytes("png")
+                except Exception as e:
+                    yield index + 1, e
+    else:
+        with zipfile.ZipFile(path) as archive:
+            for index, name in enumerate(get_zip_image_names(archive)):
+                try:
+                    yield index + 1, read_zip_image(archive, name)
+                except Exception as e:
+                    yield index + 1, e
+
+
+def process_page(page_bytes):
+    """
+        Segment one page and OCR its regions. Runs in a pipeline worker thread and never touches the database.
+
+        Args:
+            page_bytes (bytes): The encoded page image.
+
+        Returns:
+            dict: The OCR results and boxes of the regions and the encoded segmented preview.
+    """
+    from .views import run_ocr_engine, segment_array
+
+    img = cv2.imdecode(np.frombuffer(page_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("The page is not a readable image.")
+
+    boxes, img_copy = segment_array(img)
+
+    ocr_results = []
+    for x, y, w, h in boxes:
+        region = Image.fromarray(cv2.cvtColor(img[y:y+h, x:x+w], cv2.COLOR_BGR2RGB))
+        ocr_type = classify_region(region)
+        ocr_result, engine_version, elapsed_ms = run_ocr_engine(region, ocr_type)
+        ocr_results.append({
+            'ocr_type': ocr_type,
+            'text': ocr_result,
+            'engine_version': engine_version,
+            'elapsed_ms': elapsed_ms,
+        })
+
+    _, preview = cv2.imencode('.jpg', img_copy)
+
+    return {
+        'ocr_results': ocr_results,
+        'boxes': boxes,
+        'preview': preview.tobytes(),
+    }
+
+
+def save_page(batch, page_number, page_bytes, result):
+    """
+        Store the OCR image and segments of one processed page of a batch.
+    """
+    from .views import create_ocr_segments
+
+    filename = f"{slugify(batch.title) or 'batch'}-p{page_number}"
+    with transaction.atomic():
+        ocr_image = OCRImage.objects.create(
+            profile_id=batch.profile_id,
+            title=f"{batch.title} - page {page_number}"[:100],
+            ocr_text='\n'.join(ocr_result['text'] for ocr_result in result['ocr_results']),
+            uploaded_image=ContentFile(page_bytes, name=f"{filename}.png"),
+            fully_segmented_image=ContentFile(result['preview'], name=f"{filename}.jpg"),
+            isSnipped=False,
+            batch=batch,
+            page_number=page_number,
+        )
+        create_ocr_segments(ocr_image, result['ocr_results'], result['boxes'])
+        OCRBatch.objects.filter(pk=batch.pk).update(processed_pages=F('processed_pages') + 1, updated=timezone.now())
+
+
+def fail_page(batch, page_number, error):
+    logger.warning("OCR batch %s: page %s failed: %s", batch.pk, page_number, error)
+    batch.errors.append({'page': page_number, 'error': str(error)})
+    OCRBatch.objects.filter(pk=batch.pk).update(
+        failed_pages=F('failed_pages') + 1, errors=batch.errors, updated=timezone.now(),
+    )
+
+
+def run_batch(batch_id, path, kind):
+    """
+        Process every page of a batch file through segmentation and OCR with bounded parallelism.
+
+        Pages are read lazily and at most twice as many pages as there are workers are in flight, which bounds the
+        memory used by a batch regardless of its page count. Results are written by this coordinating thread only.
+
+        Args:
+            batch_id (int): The primary key of the OCRBatch.
+            path (str): Path of the spooled batch file, removed when the batch is done.
+            kind (str): 'pdf' or 'zip'.
+    """
+    workers = settings.OCR_BATCH_WORKERS
+    batch = OCRBatch.objects.get(pk=batch_id)
+    queued = batch.total_pages
+    OCR_QUEUE_DEPTH.inc(queued, queue='batch_pages')
+
+    def collect(futures):
+        nonlocal queued
+        for future in futures:
+            page_number, page_bytes = pending.pop(future)
+            try:
+                save_page(batch, page_number, page_bytes, future.result())
+            except Exception as e:
+                fail_page(batch, page_number, e)
+            queued -= 1
+            OCR_QUEUE_DEPTH.dec(queue='batch_pages')
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for page_number, page in iter_pages(path, kind):
+                if isinstance(page, Exception):
+                    fail_page(batch, page_number, page)
+                    queued -= 1
+                    OCR_QUEUE_DEPTH.dec(queue='batch_pages')
+                    continue
+
+                pending[pool.submit(process_page, page)] = (page_number, page)
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            collect(list(pending))
+
+        batch.refresh_from_db(fields=['processed_pages'])
+        status = 'done' if batch.processed_pages or not batch.total_pages else 'failed'
+        OCRBatch.objects.filter(pk=batch.pk).update(status=status, updated=timezone.now())
+
+    except Exception as e:
+        logger.exception("OCR batch %s failed", batch_id)
+        batch.errors.append({'page': None, 'error': str(e)})
+        OCRBatch.objects.filter(pk=batch.pk).update(status='failed', errors=batch.errors, updated=timezone.now())
+
+    finally:
+        # Pages never reached, e.g. after the file turned out to be unreadable
+        OCR_QUEUE_DEPTH.dec(queued, queue='batch_pages')
+        os.remove(path)
+        connection.close()
+
+
+def start_batch(profile, title, upload):
+    """
+        Create an OCRBatch for an uploaded PDF or zip of images and process it in a background thread.
+
+        The upload is copied to a temporary file first, Django removes its own temporary upload file when the request
+        ends. Uploads over OCR_BATCH_MAX_UPLOAD_MB and batches over OCR_BATCH_MAX_PAGES pages are rejected.
+
+        Args:
+            profile (Profile): The profile the OCR images are created for.
+            title (str): The title of the batch, pages are titled '<title> - page <n>'.
+            upload (UploadedFile): The uploaded PDF or zip file.
+
+        Returns:
+            OCRBatch: The created batch.
+
+        Raises:
+            BatchError: If the upload is too large, is not a PDF or zip of images, or has too many pages.
+    """
+    if upload.size > settings.OCR_BATCH_MAX_UPLOAD_MB * 1024 * 1024:
+        raise BatchError(f"{upload.name} is larger than {settings.OCR_BATCH_MAX_UPLOAD_MB} MB.")
+
+    fd, path = tempfile.mkstemp(suffix=".batch")
+    with os.fdopen(fd, "wb") as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+
+    try:
+        kind = get_batch_kind(path, upload.name)
+        total_pages = count_pages(path, kind)
+    except BatchError:
+        os.remove(path)
+        raise
+    except Exception:
+        os.remove(path)
+        raise BatchError(f"{upload.name} could not be read.")
+
+    if total_pages > settings.OCR_BATCH_MAX_PAGES:
+        os.remove(path)
+        raise BatchError(
+            f"{upload.name} has {total_pages} pages, batches are limited to {settings.OCR_BATCH_MAX_PAGES}."
+        )
+
+    batch = OCRBatch.objects.create(
+        profile=profile,
+        title=(title or os.path.splitext(upload.name)[0])[:OCRBatch._meta.get_field("title").max_length] or "Untitled",
+        source_name=upload.name[:OCRBatch._meta.get_field("source_name").max_length],
+        total_pages=total_pages,
+    )
+
+    transaction.on_commit(lambda: threading.Thread(
+        target=run_batch,
+        args=(batch.pk, path, kind),
+        daemon=True,
+    ).start())
+
+    return batch
+
+
+def fail_if_stale(batch):
+    """
+        Mark a batch whose processing stopped without finishing as failed.
+
+        Pages are processed by a thread of the process that received the upload, which is lost when that process
+        dies or is restarted. Every processed or failed page updates the batch, so a batch still processing without
+        an update for OCR_BATCH_STALE_MINUTES has lost its thread. Its processed pages are kept.
+
+        Args:
+            batch (OCRBatch): The batch.
+
+        Returns:
+            OCRBatch: The batch, refreshed if it was marked failed.
+    """
+    cutoff = timezone.now() - timedelta(minutes=settings.OCR_BATCH_STALE_MINUTES)
+    if batch.status != 'processing' or batch.updated >= cutoff:
+        return batch
+
+    remaining = batch.total_pages - batch.processed_pages - batch.failed_pages
+    errors = batch.errors + [{
+        'page': None,
+        'error': f"Processing stopped with {remaining} pages left, e.g. because the server restarted. "
+                 f"Upload the file again to process them.",
+    }]
+    # Only if the batch is still stale, its thread may have updated it in the meantime
+    OCRBatch.objects.filter(pk=batch.pk, status='processing', updated__lt=cutoff).update(
+        status='failed', errors=errors, updated=timezone.now(),
+    )
+    batch.refresh_from_db()
+    return batch
@@ -0,0 +1,178 @@
+import cv2
+import numpy as np
+import pytesseract
+from django.conf import settings
+
+from .timing import timed_stage
+
+# Characters tesseract produces for mathematical notation
+MATH_CHARACTERS = set("=+-*/^_\\{}()[]<>|~√∑∫∞±×÷≤≥≠≈πθλμσΣΔ∂")
+
+# Image feature scores at or above this label the region as math without the tesseract pre-pass
+MATH_FEATURE_CUTOFF = 0.6
+
+
+def binarize_region(pil_image):
+    """
+        Binarize a region so that ink pixels are 255 and the background is 0.
+
+        Args:
+            pil_image (PIL.Image.Image): The region to binarize.
+
+        Returns:
+            numpy.ndarray: The binary image.
+    """
+    gray = np.asarray(pil_image.convert('L'))
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary
+
+
+def get_image_features(binary):
+    """
+        Measure layout features that separate typeset or handwritten math from running text.
+
+        Math lines stack glyphs vertically (fraction bars, limits), raise or lower small glyphs (exponents, indices)
+        and span a taller ink band relative to their glyph height than a line of text does.
+
+        Args:
+            binary (numpy.ndarray): The binarized region as returned by binarize_region.
+
+        Returns:
+            dict: The 'fraction_bars', 'off_baseline_ratio' and 'vertical_extent' features, or None if the region has
+            no ink.
+    """
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    # Label 0 is the background, tiny components are noise
+    components = [
+        (stats[label], centroids[label]) for label in range(1, count)
+        if stats[label][cv2.CC_STAT_AREA] >= 4
+    ]
+    if not components:
+        return None
+
+    heights = np.array([stat[cv2.CC_STAT_HEIGHT] for stat, _ in components])
+    centers = np.array([centroid[1] for _, centroid in components])
+    glyph_height = max(float(np.median(heights)), 1.0)
+    baseline_center = float(np.median(centers))
+
+    fraction_bars = 0
+    off_baseline = 0
+    for stat, centroid in components:
+        left, top, width, height = (stat[cv2.CC_STAT_LEFT], stat[cv2.CC_STAT_TOP],
+                                    stat[cv2.CC_STAT_WIDTH], stat[cv2.CC_STAT_HEIGHT])
+
+        # A flat, wide stroke with ink both above and below it is a fraction bar
+        if width >= 2 * glyph_height and height <= max(2, 0.25 * glyph_height):
+            columns = binary[:, left:left + width]
+            if columns[:top].any() and columns[top + height:].any():
+                fraction_bars += 1
+            continue
+
+        # Smaller glyphs well above or below the line are exponents and indices. Dots and commas are even smaller
+        if 0.35 * glyph_height <= height < 0.75 * glyph_height \
+                and abs(centroid[1] - baseline_center) > 0.35 * glyph_height:
+            off_baseline += 1
+
+    ink_rows = np.count_nonzero(binary.any(axis=1))
+
+    return {
+        'fraction_bars': fraction_bars,
+        'off_baseline_ratio': off_baseline / len(components),
+        'vertical_extent': ink_rows / glyph_height,
+    }
+
+
+def get_feature_score(features):
+    """
+        Combine the image features into a math score between 0 and 1.
+
+        Args:
+            features (dict): The features returned by get_image_features.
+
+        Returns:
+            float: The score, higher meaning more likely math.
+    """
+    return (
+        0.5 * min(1.0, features['fraction_bars'])
+        + 0.3 * min(1.0, features['off_baseline_ratio'] * 4)
+        + 0.2 * min(1.0, max(0.0, (features['vertical_extent'] - 2) / 2))
+    )
+
+
+def get_prepass_score(binary):
+    """
+        Score a region from a single-line tesseract pass.
+
+        Text lines come back as confident dictionary-like words. Math comes back with low confidences, few plain words
+        and a high share of operator and bracket characters.
+
+        Args:
+            binary (numpy.ndarray): The binarized region as returned by binarize_region.
+
+        Returns:
+            float: The score between 0 and 1, higher meaning more likely math.
+    """
+    # Tesseract expects dark text on a light background
+    data = pytesseract.image_to_data(
+        cv2.bitwise_not(binary), config='--psm 7', output_type=pytesseract.Output.DICT
+    )
+    words = [
+        (word.strip(), float(conf)) for word, conf in zip(data['text'], data['conf'])
+        if word.strip() and float(conf) >= 0
+    ]
+    if not words:
+        return 0.6
+
+    mean_confidence = sum(conf for _, conf in words) / len(words)
+    characters = ''.join(word for word, _ in words)
+    symbol_ratio = sum(1 for character in characters if character in MATH_CHARACTERS) / len(characters)
+    word_ratio = sum(1 for word, _ in words if len(word) >= 3 and word.isalpha()) / len(words)
+
+    return (
+        0.4 * (1 - mean_confidence / 100)
+        + 0.4 * min(1.0, symbol_ratio * 3)
+        + 0.2 * (1 - word_ratio)
+    )
+
+
+def get_math_score(pil_image):
+    """
+        Score how likely a region is math, running the tesseract pre-pass only when the image features are not
+        decisive.
+
+        Args:
+            pil_image (PIL.Image.Image): The region to score.
+
+        Returns:
+            tuple: (score, used_prepass). The score is between 0 and 1, higher meaning more likely math.
+    """
+    binary = binarize_region(pil_image)
+    features = get_image_features(binary)
+    if features is None:
+        return 0.0, False
+
+    feature_score = get_feature_score(features)
+    if feature_score >= MATH_FEATURE_CUTOFF:
+        return feature_score, False
+
+    return (feature_score + get_prepass_score(binary)) / 2, True
+
+
+def classify_region(pil_image, threshold=None):
+    """
+        Label a segmented region as 'text' or 'math'.
+
+        Args:
+            pil_image (PIL.Image.Image): The region to classify.
+            threshold (float, optional): The math score from which a region is math. Defaults to the
+                OCR_MATH_THRESHOLD setting.
+
+        Returns:
+            str: 'math' or 'text'.
+    """
+    if threshold is None:
+        threshold = settings.OCR_MATH_THRESHOLD
+
+    with timed_stage('classify'):
+        score, _ = get_math_score(pil_image)
+    return 'math' if score >= threshold else 'text'
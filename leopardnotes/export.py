@@ -0,0 +1,180 @@
+import csv
+import io
+import json
+import logging
+import os
+import zipfile
+
+from django.db.models.functions import Length
+from django.utils.text import slugify
+
+from profiles.models import OCRImage
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMATS = ("json", "csv")
+MANIFEST_FIELDS = (
+    "id", "title", "created", "snipped", "text_length", "text_path", "uploaded_image_path", "segmented_image_path",
+)
+# Size of the pieces image files are copied into the archive in
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class ZipStream:
+    """
+        Write-only, unseekable file object collecting what zipfile writes until it is handed to the response.
+
+        Without seek and tell, zipfile writes sizes and checksums in data descriptors after each entry instead of
+        going back to patch the local headers, so the archive can be sent while it is being built.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """
+            Yield the bytes written since the last call, if there are any.
+        """
+        if self.chunks:
+            data = b"".join(self.chunks)
+            self.chunks.clear()
+            yield data
+
+
+def get_note_paths(note, include_images):
+    """
+        Get the archive paths of a note's files.
+
+        Args:
+            note (dict): The note's 'id', 'title', 'uploaded_image' and 'fully_segmented_image' values.
+            include_images (bool): Whether the images are exported.
+
+        Returns:
+            dict: The 'text_path', 'uploaded_image_path' and 'segmented_image_path' of the note, image paths are empty
+            when the images are not exported or the note has none.
+    """
+    stem = f"{note['id']}-{slugify(note['title'] or '')}".rstrip("-")
+    paths = {"text_path": f"notes/{stem}.txt", "uploaded_image_path": "", "segmented_image_path": ""}
+    if include_images:
+        for key, field, name in (
+            ("uploaded_image_path", "uploaded_image", "uploaded"),
+            ("segmented_image_path", "fully_segmented_image", "segmented"),
+        ):
+            if note[field]:
+                paths[key] = f"images/{stem}/{name}{os.path.splitext(note[field])[1]}"
+    return paths
+
+
+def iter_manifest_lines(rows, manifest_format):
+    """
+        Serialize manifest rows one line at a time.
+
+        Args:
+            rows (iterable): Manifest rows as dictionaries with the MANIFEST_FIELDS keys.
+            manifest_format (str): 'json' or 'csv'.
+
+        Yields:
+            str: The next piece of the manifest.
+    """
+    if manifest_format == "csv":
+        line = io.StringIO()
+        writer = csv.DictWriter(line, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        yield line.getvalue()
+        for row in rows:
+            line.seek(0)
+            line.truncate()
+            writer.writerow(row)
+            yield line.getvalue()
+        return
+
+    separator = "[\n"
+    for row in rows:
+        yield separator + json.dumps(row)
+        separator = ",\n"
+    yield "[]\n" if separator == "[\n" else "\n]\n"
+
+
+def stream_notes_zip(queryset, include_images=False, manifest_format="json"):
+    """
+        Build a zip archive of OCR notes incrementally, yielding the archive bytes as they are produced.
+
+        The notes are read twice with server-side iteration. The first pass only reads the small columns and writes
+        the manifest, the second pass writes each note's text and copies its images in chunks. Memory use does not
+        grow with the number of notes or the size of the images.
+
+        Args:
+            queryset (QuerySet): The OCRImage rows to export.
+            include_images (bool): Whether to add the uploaded and segmented images.
+            manifest_format (str): 'json' or 'csv'.
+
+        Yields:
+            bytes: The next piece of the zip archive.
+    """
+    # Notes created while the archive is being streamed are left out of both passes
+    last_pk = queryset.order_by("-pk").values_list("pk", flat=True).first() or 0
+    notes = queryset.filter(pk__lte=last_pk).order_by("created", "pk")
+    storage = OCRImage._meta.get_field("uploaded_image").storage
+
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED)
+
+    def manifest_rows():
+        for note in notes.values(
+            "id", "title", "created", "isSnipped", "uploaded_image", "fully_segmented_image",
+        ).annotate(text_length=Length("ocr_text")).iterator(chunk_size=500):
+            yield {
+                "id": note["id"],
+                "title": note["title"],
+                "created": note["created"].isoformat(),
+                "snipped": note["isSnipped"],
+                "text_length": note["text_length"],
+                **get_note_paths(note, include_images),
+            }
+
+    with archive.open(f"manifest.{manifest_format}", mode="w") as manifest:
+        for line in iter_manifest_lines(manifest_rows(), manifest_format):
+            manifest.write(line.encode("utf-8"))
+            yield from stream.drain()
+
+    for note in notes.values(
+        "id", "title", "created", "ocr_text", "uploaded_image", "fully_segmented_image",
+    ).iterator(chunk_size=100):
+        paths = get_note_paths(note, include_images)
+
+        text_info = zipfile.ZipInfo(paths["text_path"], date_time=note["created"].timetuple()[:6])
+        text_info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(text_info, note["ocr_text"] or "")
+        yield from stream.drain()
+
+        for path_key, field in (
+            ("uploaded_image_path", "uploaded_image"),
+            ("segmented_image_path", "fully_segmented_image"),
+        ):
+            if not paths[path_key]:
+                continue
+            try:
+                size = storage.size(note[field])
+                source = storage.open(note[field], "rb")
+            except OSError as e:
+                logger.warning("Skipping %s of note %s in the export: %s", field, note["id"], e)
+                continue
+
+            # Images are already compressed, store them as they are
+            image_info = zipfile.ZipInfo(paths[path_key], date_time=note["created"].timetuple()[:6])
+            image_info.compress_type = zipfile.ZIP_STORED
+            image_info.file_size = size
+            with source, archive.open(image_info, mode="w") as destination:
+                for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                    destination.write(chunk)
+                    yield from stream.drain()
+
+    archive.close()
+    yield from stream.drain()
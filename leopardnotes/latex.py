@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+LATEX_BACKENDS = ("fp32", "int8")
+
+logger = logging.getLogger(__name__)
+
+# The process-wide model of get_latex_model, loaded once under the lock
+_latex_model = None
+_latex_model_lock = threading.Lock()
+
+
+def quantize_latex_model(latex_model):
+    """
+        Apply dynamic int8 quantization to the linear layers of a loaded pix2tex model.
+
+        The transformer layers of the encoder and the decoder are almost all linear layers, their weights are stored
+        as int8 and their activations are quantized on the fly. The convolutional backbone stays in fp32.
+
+        Args:
+            latex_model (pix2tex.cli.LatexOCR): The loaded fp32 model.
+
+        Returns:
+            pix2tex.cli.LatexOCR: The same model with its networks replaced by quantized copies.
+    """
+    import torch
+
+    latex_model.model = torch.quantization.quantize_dynamic(latex_model.model, {torch.nn.Linear}, dtype=torch.qint8)
+    if getattr(latex_model, "image_resizer", None) is not None:
+        latex_model.image_resizer = torch.quantization.quantize_dynamic(
+            latex_model.image_resizer, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return latex_model
+
+
+def export_quantized_latex_model(path):
+    """
+        Load the fp32 pix2tex model, quantize it and save the whole quantized model to a file.
+
+        This is the only step that needs the memory of the fp32 model, the int8 backend loads the saved file without
+        building the fp32 model again.
+
+        Args:
+            path (str): The file to write.
+
+        Returns:
+            pix2tex.cli.LatexOCR: The quantized model.
+    """
+    import torch
+    from pix2tex.cli import LatexOCR
+
+    latex_model = quantize_latex_model(LatexOCR())
+    # Written next to the target and renamed, a process loading the file never reads a partial one
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(latex_model, temporary_path)
+    os.replace(temporary_path, path)
+    return latex_model
+
+
+def load_latex_model(backend):
+    """
+        Load the pix2tex model for the given inference backend.
+
+        The int8 backend loads the quantized model saved by export_quantized_latex_model at OCR_LATEX_INT8_PATH, so
+        only the int8 weights are ever allocated. When the file does not exist yet it is exported first, which peaks
+        at the fp32 memory once.
+
+        Args:
+            backend (str): 'fp32' for the full precision model or 'int8' for the dynamically quantized model.
+
+        Returns:
+            pix2tex.cli.LatexOCR: The loaded model.
+
+        Raises:
+            ValueError: If the backend is not one of LATEX_BACKENDS.
+    """
+    if backend not in LATEX_BACKENDS:
+        raise ValueError(f"Unknown LaTeX OCR backend {backend!r}, expected one of {', '.join(LATEX_BACKENDS)}.")
+
+    if backend == "fp32":
+        from pix2tex.cli import LatexOCR
+
+        return LatexOCR()
+
+    import torch
+
+    path = str(settings.OCR_LATEX_INT8_PATH)
+    if not os.path.exists(path):
+        logger.warning("No quantized LaTeX OCR model at %s, exporting it from the fp32 model", path)
+        return export_quantized_latex_model(path)
+    return torch.load(path, map_location="cpu")
+
+
+def get_latex_model():
+    """
+        Get the process-wide LaTeX OCR model for the OCR_LATEX_BACKEND setting, loading it on first use.
+
+        Processes that never recognize math, e.g. web workers only serving pages, never load the model. Concurrent
+        first calls, e.g. from the pages of a batch, wait for a single load instead of each loading a model.
+
+        Returns:
+            pix2tex.cli.LatexOCR: The loaded model.
+    """
+    global _latex_model
+    if _latex_model is None:
+        with _latex_model_lock:
+            if _latex_model is None:
+                _latex_model = load_latex_model(settings.OCR_LATEX_BACKEND)
+    return _latex_model
+
+
+def _reset_lock_after_fork():
+    # Another thread of the parent may have held the lock, mid-load, at the time of the fork
+    global _latex_model_lock
+    _latex_model_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock_after_fork)
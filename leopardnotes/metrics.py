@@ -0,0 +1,501 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds in seconds, the implicit last bucket is +Inf
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+# Process identity of the metric state file, renewed in forked children
+_process = {"pid": os.getpid(), "started": time.time(), "flushed": 0.0}
+
+# Counters and histograms of exited processes, merged into one file of the multiprocess directory
+ARCHIVE_NAME = "archive.json"
+# Held exclusively while archiving and shared while reading the state files
+ARCHIVE_LOCK_NAME = "archive.lock"
+
+
+class Metric:
+    """
+        Base class of the metric types, one series per combination of label values.
+
+        Attributes:
+            name (str): The metric name.
+            documentation (str): A one-line description of the metric.
+            labelnames (tuple): The names of the labels every update has.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[labelname]) for labelname in self.labelnames)
+
+    def snapshot(self):
+        """
+            Get a JSON-serializable copy of the metric and its series.
+        """
+        with self._lock:
+            series = [[list(key), json.loads(json.dumps(value))] for key, value in self._series.items()]
+        return {
+            "type": self.type,
+            "documentation": self.documentation,
+            "labelnames": list(self.labelnames),
+            "series": series,
+        }
+
+
+class Counter(Metric):
+    """
+        Monotonically increasing count, e.g. cache hits.
+    """
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+            Add to the count of the series with the given label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+        maybe_flush()
+
+
+class Gauge(Metric):
+    """
+        Value that goes up and down, e.g. the number of queued pages. Gauges of exited processes are dropped.
+    """
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        """
+            Add to the value of the series with the given label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+        maybe_flush()
+
+    def dec(self, amount=1, **labels):
+        """
+            Subtract from the value of the series with the given label values.
+        """
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+        Cumulative histogram of observed values.
+
+        Attributes:
+            buckets (tuple): The sorted bucket upper bounds.
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+            Record one observation.
+
+            Args:
+                value (float): The observed value.
+                **labels: A value for each of the histogram's label names.
+        """
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+        maybe_flush()
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+
+def _register(cls, name, documentation, labelnames, **kwargs):
+    with _registry_lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = cls(name, documentation, labelnames, **kwargs)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    """
+        Get the registered counter with the given name, registering it on first use.
+    """
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    """
+        Get the registered gauge with the given name, registering it on first use.
+    """
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """
+        Get the registered histogram with the given name, registering it on first use.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): A one-line description of the metric.
+            labelnames (tuple): The names of the labels every observation has.
+            buckets (tuple): The bucket upper bounds.
+
+        Returns:
+            Histogram: The registered histogram.
+    """
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+# Shared by every cache, e.g. the post card fragments and the image derivatives, labelled with the cache's name
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups by cache and result.", labelnames=("cache", "result"))
+
+
+def get_multiprocess_dir():
+    """
+        Get the directory the worker processes share their metrics through, or None when metrics are per process.
+    """
+    return getattr(settings, "METRICS_MULTIPROCESS_DIR", None) or None
+
+
+def get_state_path(directory):
+    """
+        Get the path of this process's state file in the multiprocess directory.
+    """
+    # The start time keeps a process from overwriting the counts of an exited process with a reused pid
+    return os.path.join(directory, f"{_process['pid']}-{int(_process['started'] * 1000)}.json")
+
+
+def flush():
+    """
+        Write the metrics of this process to its file in the multiprocess directory.
+
+        The file is written next to its final name and renamed over it, so readers never see a partial file.
+    """
+    directory = get_multiprocess_dir()
+    if directory is None:
+        return
+    _process["flushed"] = time.monotonic()
+
+    state = {
+        "pid": _process["pid"],
+        "metrics": {name: metric.snapshot() for name, metric in list(REGISTRY.items())},
+    }
+    os.makedirs(directory, exist_ok=True)
+    write_state(directory, get_state_path(directory), state)
+
+
+def maybe_flush():
+    """
+        Flush the metrics of this process if the last flush is older than METRICS_FLUSH_INTERVAL seconds.
+    """
+    if get_multiprocess_dir() is None:
+        return
+    if time.monotonic() - _process["flushed"] >= getattr(settings, "METRICS_FLUSH_INTERVAL", 1.0):
+        flush()
+
+
+def _reset_after_fork():
+    # A forked child starts with a copy of its parent's counts, which the parent keeps reporting. The locks are
+    # replaced as well, another thread of the parent may have held one at the time of the fork.
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    _process.update(pid=os.getpid(), started=time.time(), flushed=0.0)
+    for metric in list(REGISTRY.values()):
+        metric._lock = threading.Lock()
+        metric._series = {}
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_flush_at_exit)
+
+
+def is_process_alive(pid):
+    """
+        Check whether a process with the given pid is still running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_series(metric_type, target, key, value):
+    """
+        Add the value of one process's series to the merged series.
+    """
+    if metric_type == "histogram":
+        existing = target.get(key)
+        if existing is None:
+            target[key] = {"counts": list(value["counts"]), "sum": value["sum"], "count": value["count"]}
+        else:
+            existing["counts"] = [a + b for a, b in zip(existing["counts"], value["counts"])]
+            existing["sum"] += value["sum"]
+            existing["count"] += value["count"]
+    else:
+        target[key] = target.get(key, 0) + value
+
+
+def merge_state(families, state, include_gauges=True):
+    """
+        Add the metrics of one state file to merged metric families.
+
+        Args:
+            families (dict): The merged families, as returned by collect.
+            state (dict): A state file's content.
+            include_gauges (bool): Whether to merge gauges, which only count for running processes.
+    """
+    for name, snapshot in state["metrics"].items():
+        if snapshot["type"] == "gauge" and not include_gauges:
+            continue
+        family = families.setdefault(name, {
+            "type": snapshot["type"],
+            "documentation": snapshot["documentation"],
+            "labelnames": snapshot["labelnames"],
+            "buckets": snapshot.get("buckets"),
+            "series": {},
+        })
+        for key, value in snapshot["series"]:
+            merge_series(snapshot["type"], family["series"], tuple(key), value)
+
+
+def read_state(path):
+    """
+        Read a state file, None if it is gone or unreadable.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_state(directory, path, state):
+    """
+        Write a state file next to its final name and rename it over it, so readers never see a partial file.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def archive_exited_processes(directory):
+    """
+        Merge the counters and histograms of exited processes into the archive file and delete their state files, so
+        that restarting workers does not grow the multiprocess directory.
+
+        The archive lists the state files it merged until they are deleted, an archival interrupted between writing
+        the archive and deleting them neither loses nor double counts them. Skipped while another process archives.
+
+        Args:
+            directory (str): The multiprocess directory.
+    """
+    archive_path = os.path.join(directory, ARCHIVE_NAME)
+    with open(os.path.join(directory, ARCHIVE_LOCK_NAME), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+
+        archive = read_state(archive_path) or {"pid": None, "metrics": {}, "archived": []}
+        for name in archive["archived"]:
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+
+        families = {}
+        merge_state(families, archive)
+        exited = []
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            name = os.path.basename(path)
+            if name == ARCHIVE_NAME or path == get_state_path(directory):
+                continue
+            state = read_state(path)
+            if state is None or is_process_alive(state["pid"]):
+                continue
+            merge_state(families, state, include_gauges=False)
+            exited.append(name)
+
+        if not exited and not archive["archived"]:
+            return
+
+        metrics = {}
+        for name, family in families.items():
+            snapshot = {key: family[key] for key in ("type", "documentation", "labelnames")}
+            if family["buckets"] is not None:
+                snapshot["buckets"] = family["buckets"]
+            snapshot["series"] = [[list(key), value] for key, value in family["series"].items()]
+            metrics[name] = snapshot
+        write_state(directory, archive_path, {"pid": None, "metrics": metrics, "archived": exited})
+
+        for name in exited:
+            os.remove(os.path.join(directory, name))
+        write_state(directory, archive_path, {"pid": None, "metrics": metrics, "archived": []})
+
+
+def collect():
+    """
+        Collect the metrics of this process and, in multiprocess mode, of every other process that wrote a state
+        file and of the archive of exited processes. Counters and histograms are summed over all processes, gauges
+        over the running ones only.
+
+        Returns:
+            dict: {name: {'type', 'documentation', 'labelnames', 'buckets' (histograms only), 'series'}} where
+            'series' maps label value tuples to a number or, for histograms, to per-bucket 'counts', 'sum' and
+            'count'.
+    """
+    states = [{"pid": _process["pid"], "metrics": {name: metric.snapshot() for name, metric in list(REGISTRY.items())}}]
+
+    directory = get_multiprocess_dir()
+    if directory is not None and os.path.isdir(directory):
+        archive_exited_processes(directory)
+
+        own_path = get_state_path(directory)
+        archived = set()
+        # Shared with other readers, an archival in between would move the counts of a file already read
+        with open(os.path.join(directory, ARCHIVE_LOCK_NAME), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            paths = glob.glob(os.path.join(directory, "*.json"))
+            # The archive first, the state files it already merged are skipped
+            paths.sort(key=lambda path: os.path.basename(path) != ARCHIVE_NAME)
+            for path in paths:
+                if path == own_path or os.path.basename(path) in archived:
+                    continue
+                state = read_state(path)
+                if state is not None:
+                    archived.update(state.get("archived", ()))
+                    states.append(state)
+
+    families = {}
+    for state in states:
+        alive = state["pid"] is not None and (state["pid"] == _process["pid"] or is_process_alive(state["pid"]))
+        merge_state(families, state, include_gauges=alive)
+    return families
+
+
+def get_cumulative_buckets(family, value):
+    """
+        Turn the per-bucket counts of a histogram series into cumulative (upper bound, count) pairs.
+    """
+    cumulative = 0
+    buckets = []
+    for bound, count in zip(list(family["buckets"]) + [float("inf")], value["counts"]):
+        cumulative += count
+        buckets.append((bound, cumulative))
+    return buckets
+
+
+def estimate_quantile(buckets, quantile):
+    """
+        Estimate a quantile from cumulative histogram buckets by linear interpolation inside the bucket it falls in.
+
+        Args:
+            buckets (list): Cumulative (upper bound, count) pairs as returned by get_cumulative_buckets.
+            quantile (float): The quantile between 0 and 1.
+
+        Returns:
+            float: The estimated value, or None if the histogram is empty.
+    """
+    total = buckets[-1][1]
+    if not total:
+        return None
+
+    rank = quantile * total
+    lower_bound, lower_count = 0.0, 0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                # Values above the last finite bound cannot be placed, report that bound
+                return lower_bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / max(count - lower_count, 1)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def format_labels(labelnames, key, extra=()):
+    """
+        Format label names and values as an exposition label set, e.g. {view="home-view"}.
+    """
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    """
+        Format a sample value for the exposition format.
+    """
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_text(families):
+    """
+        Render collected metrics in the Prometheus text exposition format (version 0.0.4).
+
+        Args:
+            families (dict): The metrics as returned by collect.
+
+        Returns:
+            str: The exposition text.
+    """
+    lines = []
+    for name, family in sorted(families.items()):
+        lines.append(f"# HELP {name} {family['documentation']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        labelnames = family["labelnames"]
+        for key, value in sorted(family["series"].items()):
+            if family["type"] != "histogram":
+                lines.append(f"{name}{format_labels(labelnames, key)} {format_value(value)}")
+                continue
+            for bound, count in get_cumulative_buckets(family, value):
+                labels = format_labels(labelnames, key, [("le", format_value(bound))])
+                lines.append(f"{name}_bucket{labels} {count}")
+            lines.append(f"{name}_sum{format_labels(labelnames, key)} {format_value(value['sum'])}")
+            lines.append(f"{name}_count{format_labels(labelnames, key)} {value['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,167 @@
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import counter, histogram
+from .profiling import SamplingProfiler, write_profile
+from .queries import QueryRecorder
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "Request latency by URL name.", labelnames=("view", "method", "status"),
+)
+REQUESTS = counter(
+    "http_requests_total", "Requests by URL name.", labelnames=("view", "method", "status"),
+)
+REQUEST_DB_QUERIES = histogram(
+    "http_request_db_queries", "Database queries per request by URL name.", labelnames=("view",),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = histogram(
+    "http_request_db_duration_seconds", "Total database query time per request by URL name.", labelnames=("view",),
+)
+
+
+class QueryTracker:
+    """
+        Database execute wrapper counting the queries of a request and summing their duration.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def get_view_name(request):
+    """
+        Get the URL name a request resolved to, used as the metric label so that the label values stay bounded.
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """
+        Record the latency, status and database queries of every request in the metrics registry.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tracker = QueryTracker()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(tracker))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        view = get_view_name(request)
+        labels = {"view": view, "method": request.method, "status": response.status_code}
+        REQUEST_SECONDS.observe(elapsed, **labels)
+        REQUESTS.inc(**labels)
+        REQUEST_DB_QUERIES.observe(tracker.count, view=view)
+        REQUEST_DB_SECONDS.observe(tracker.seconds, view=view)
+        return response
+
+
+class QueryBudgetMiddleware:
+    """
+        Record the queries of every request and warn about N+1 patterns and views over their query budget.
+
+        Repeated query shapes are logged with the project stack they were issued from. Views listed in QUERY_BUDGETS
+        are checked against their budget. The query count and the number of repeated shapes are added to the response
+        as X-Query-Count and X-Duplicate-Queries headers. The middleware is only active with QUERY_BUDGET_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_BUDGET_ENABLED:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with recorder.install():
+            response = self.get_response(request)
+
+        view = get_view_name(request)
+        duplicates = recorder.duplicates()
+        if duplicates:
+            logger.warning(
+                "%s %s (%s) repeated %d query shapes:\n%s",
+                request.method, request.path, view, len(duplicates), recorder.report(),
+            )
+
+        budget = settings.QUERY_BUDGETS.get(view)
+        if budget is not None and recorder.count > budget:
+            logger.warning(
+                "%s %s (%s) ran %d queries, over its budget of %d", request.method, request.path, view, recorder.count,
+                budget,
+            )
+
+        response["X-Query-Count"] = str(recorder.count)
+        response["X-Duplicate-Queries"] = str(len(duplicates))
+        return response
+
+
+class ProfilerMiddleware:
+    """
+        Profile requests with a sampling profiler and store them as folded stacks for flame graphs.
+
+        Staff users profile a single request with the "_profile=1" query parameter or an "X-Profile: 1" header. A
+        PROFILER_SAMPLE_RATE fraction of all other requests is profiled as well. Must come after the authentication
+        middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        """
+            Decide whether to profile a request, on demand for staff or by random sampling.
+        """
+        # The user is only loaded when profiling was asked for, other requests keep their session lazy
+        if (request.GET.get("_profile") == "1" or request.headers.get("X-Profile") == "1") and request.user.is_staff:
+            return True
+        return random.random() < settings.PROFILER_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profiler = SamplingProfiler(threading.get_ident(), settings.PROFILER_INTERVAL)
+        started = time.time()
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = profiler.stop()
+        duration = time.perf_counter() - start
+
+        if stacks:
+            try:
+                response["X-Profile-Name"] = write_profile(get_view_name(request), started, duration, stacks)
+            except OSError:
+                logger.exception("Could not write the profile of %s", request.path)
+        return response
@@ -0,0 +1,152 @@
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+# <start time in ms>_<view>_<duration in ms>_<pid>.folded
+PROFILE_NAME = re.compile(r"^(?P<started>\d+)_(?P<view>[\w.-]+)_(?P<duration>\d+)_(?P<pid>\d+)\.folded$")
+
+
+def fold_stack(frame):
+    """
+        Format a stack as one line of the folded stack format, outermost frame first.
+
+        Args:
+            frame (frame): The innermost frame.
+
+        Returns:
+            str: The frames as "module.function" joined by semicolons.
+    """
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+        Statistical profiler sampling the stack of one thread from a background thread.
+
+        The profiled thread is never interrupted, so the overhead is one stack walk per interval regardless of how much
+        Python code the request runs.
+
+        Attributes:
+            thread_id (int): The identifier of the profiled thread.
+            interval (float): Seconds between two samples.
+            stacks (Counter): The number of samples per folded stack.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[fold_stack(frame)] += 1
+
+    def start(self):
+        """
+            Start sampling.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+            Stop sampling and return the sampled stacks.
+        """
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+def get_profile_dir():
+    """
+        Get the ring buffer directory of the captured profiles.
+    """
+    return str(settings.PROFILER_DIR)
+
+
+def write_profile(view, started, duration, stacks):
+    """
+        Write a profile to the ring buffer directory and drop the oldest profiles over PROFILER_MAX_PROFILES.
+
+        Args:
+            view (str): The URL name of the profiled request.
+            started (float): The start time of the request as a Unix timestamp.
+            duration (float): The duration of the request in seconds.
+            stacks (Counter): The number of samples per folded stack.
+
+        Returns:
+            str: The file name of the profile.
+    """
+    directory = get_profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    safe_view = re.sub(r"[^\w.-]", ".", view)
+    name = f"{int(started * 1000)}_{safe_view}_{int(duration * 1000)}_{os.getpid()}.folded"
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    os.replace(temp_path, os.path.join(directory, name))
+
+    # Names start with the start time, so sorting them sorts the profiles from oldest to newest
+    profiles = sorted(entry for entry in os.listdir(directory) if PROFILE_NAME.match(entry))
+    for old in profiles[:max(len(profiles) - settings.PROFILER_MAX_PROFILES, 0)]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            pass
+    return name
+
+
+def list_profiles():
+    """
+        List the captured profiles grouped by view.
+
+        Returns:
+            dict: {view: [profile dictionaries with 'name', 'started', 'duration_ms' and 'pid', newest first]}.
+    """
+    directory = get_profile_dir()
+    if not os.path.isdir(directory):
+        return {}
+
+    profiles = {}
+    for name in sorted(os.listdir(directory), reverse=True):
+        match = PROFILE_NAME.match(name)
+        if match is None:
+            continue
+        profiles.setdefault(match["view"], []).append({
+            "name": name,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(match["started"]) / 1000)),
+            "duration_ms": int(match["duration"]),
+            "pid": int(match["pid"]),
+        })
+    return dict(sorted(profiles.items()))
+
+
+def get_profile_path(name):
+    """
+        Get the path of a captured profile.
+
+        Args:
+            name (str): The profile file name.
+
+        Returns:
+            str: The path, or None if the name is not a profile name or the profile was dropped.
+    """
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(get_profile_dir(), name)
+    return path if os.path.exists(path) else None
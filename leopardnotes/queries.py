@@ -0,0 +1,104 @@
+import re
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+# Placeholder lists of IN clauses and bulk inserts vary in length with the number of rows
+PLACEHOLDER_LIST = re.compile(r"%s(?:\s*,\s*%s)+")
+VALUES_LIST = re.compile(r"\(%s(?:, %s)*\)(?:, \(%s(?:, %s)*\))+")
+
+
+def get_query_shape(sql):
+    """
+        Reduce an SQL statement to its shape, which is the same for every row of an N+1 loop.
+
+        The statement is already parameterized, only the lengths of placeholder lists need collapsing.
+
+        Args:
+            sql (str): The SQL statement with %s placeholders.
+
+        Returns:
+            str: The normalized statement.
+    """
+    sql = VALUES_LIST.sub("(...)", sql)
+    return PLACEHOLDER_LIST.sub("%s, ...", sql)
+
+
+def get_project_stack():
+    """
+        Get the frames of the current stack that belong to the project, innermost last.
+
+        Returns:
+            list: "path:line in function" strings, relative to BASE_DIR.
+    """
+    base_dir = str(settings.BASE_DIR)
+    frames = []
+    for frame in traceback.extract_stack():
+        if frame.filename.startswith(base_dir) and "site-packages" not in frame.filename \
+                and frame.filename != __file__:
+            frames.append(f"{frame.filename[len(base_dir):].lstrip('/')}:{frame.lineno} in {frame.name}")
+    return frames
+
+
+class QueryRecorder:
+    """
+        Database execute wrapper recording the shape of every query run while it is installed, with the project stack
+        of the first occurrence of each shape.
+
+        Attributes:
+            count (int): The number of queries.
+            shapes (dict): {shape: number of queries with that shape} in the order the shapes were first seen.
+            stacks (dict): {shape: project stack of its first query}.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.shapes = {}
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = get_query_shape(sql)
+        self.count += 1
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+        if shape not in self.stacks:
+            self.stacks[shape] = get_project_stack()
+        return execute(sql, params, many, context)
+
+    def install(self):
+        """
+            Install the recorder on every database connection until the returned context exits.
+        """
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    def duplicates(self, threshold=None):
+        """
+            Get the query shapes repeated at least `threshold` times, the signature of an N+1 loop.
+
+            Args:
+                threshold (int, optional): Defaults to the QUERY_DUPLICATE_THRESHOLD setting.
+
+            Returns:
+                list: (shape, count, stack) tuples, most repeated first.
+        """
+        if threshold is None:
+            threshold = settings.QUERY_DUPLICATE_THRESHOLD
+        repeated = [(shape, count, self.stacks[shape]) for shape, count in self.shapes.items() if count >= threshold]
+        return sorted(repeated, key=lambda duplicate: -duplicate[1])
+
+    def report(self, threshold=None):
+        """
+            Describe the repeated query shapes and where they were issued.
+
+            Returns:
+                str: One paragraph per repeated shape.
+        """
+        paragraphs = []
+        for shape, count, stack in self.duplicates(threshold):
+            lines = [f"{count}x {shape}"] + [f"    {frame}" for frame in stack[-6:]]
+            paragraphs.append("\n".join(lines))
+        return "\n\n".join(paragraphs)
@@ -51,11 +51,14 @@ if DEBUG:
 # EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 
 MIDDLEWARE = [
+    "leopardnotes.middleware.MetricsMiddleware",
+    "leopardnotes.middleware.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "leopardnotes.middleware.ProfilerMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -143,8 +146,119 @@ MEDIA_URL = "/media/"
 
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Uploaded media is stored once per distinct content, see leopardnotes/storage.py
+STORAGES = {
+    "default": {
+        "BACKEND": "leopardnotes.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Number of pages of a batch upload (PDF or zip of images) OCR'd in parallel
+OCR_BATCH_WORKERS = int(os.environ.get("OCR_BATCH_WORKERS", 2))
+# A batch without a processed page for this long lost its processing thread, e.g. to a restart, and is marked failed
+OCR_BATCH_STALE_MINUTES = int(os.environ.get("OCR_BATCH_STALE_MINUTES", 30))
+# Largest batch upload accepted, in megabytes
+OCR_BATCH_MAX_UPLOAD_MB = int(os.environ.get("OCR_BATCH_MAX_UPLOAD_MB", 200))
+# Batches with more pages than this are rejected before any page is processed
+OCR_BATCH_MAX_PAGES = int(os.environ.get("OCR_BATCH_MAX_PAGES", 500))
+# Images of a zip batch larger than this uncompressed, in megabytes, fail without being extracted
+OCR_BATCH_MAX_IMAGE_MB = int(os.environ.get("OCR_BATCH_MAX_IMAGE_MB", 50))
+# PDF pages are rasterized at a lower DPI when they would have more pixels than this
+OCR_BATCH_MAX_PAGE_PIXELS = int(os.environ.get("OCR_BATCH_MAX_PAGE_PIXELS", 25_000_000))
+
+# Threads rendering the resized derivatives of uploaded images in the background, 0 renders them in the request
+DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", 2))
+
+# Regions scoring at least this are sent to the LaTeX model when no OCR type is chosen
+OCR_MATH_THRESHOLD = float(os.environ.get("OCR_MATH_THRESHOLD", 0.5))
+
+# Inference backend of the LaTeX OCR model, "fp32" or "int8" for dynamically quantized linear layers
+OCR_LATEX_BACKEND = os.environ.get("OCR_LATEX_BACKEND", "fp32")
+# Quantized model loaded by the int8 backend, written by the export_latex_int8 command or on first load
+OCR_LATEX_INT8_PATH = os.environ.get("OCR_LATEX_INT8_PATH", BASE_DIR / ".latex_int8.pt")
+
+# Directory the worker processes share their metrics through, unset keeps the metrics of each process apart
+METRICS_MULTIPROCESS_DIR = os.environ.get("METRICS_MULTIPROCESS_DIR")
+# Seconds between writes of a process's metrics to the multiprocess directory
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 1.0))
+# Addresses allowed to scrape /metrics without a staff login
+METRICS_ALLOWED_IPS = os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+# Number of reverse proxies in front of the app, each appending the address it received the request from to
+# X-Forwarded-For. With 0 the address of the connection is used, behind a proxy that is the proxy's address.
+METRICS_TRUSTED_PROXIES = int(os.environ.get("METRICS_TRUSTED_PROXIES", 0))
+
+# Log N+1 query patterns and views over their query budget, see leopardnotes.middleware.QueryBudgetMiddleware
+QUERY_BUDGET_ENABLED = os.environ.get("QUERY_BUDGET_ENABLED", str(DEBUG)) == "True"
+# A query shape run this many times in one request is reported as an N+1 pattern
+QUERY_DUPLICATE_THRESHOLD = int(os.environ.get("QUERY_DUPLICATE_THRESHOLD", 5))
+# Maximum number of queries per URL name, also enforced by leopardnotes.testing.query_budget
+QUERY_BUDGETS = {
+    "home-view": 5,
+    "posts:main-post-view": 30,
+    "posts:post-page-view": 25,
+    "profiles:profile-detail-view": 25,
+    "profiles:all-profiles-view": 20,
+    "profiles:my-profile-view": 15,
+    "profiles:chat-message-view": 15,
+    "ocr-view-results": 10,
+}
+
+# Fraction of requests profiled by leopardnotes.middleware.ProfilerMiddleware, staff can also profile on demand
+PROFILER_SAMPLE_RATE = float(os.environ.get("PROFILER_SAMPLE_RATE", 0))
+# Seconds between two stack samples of a profiled request
+PROFILER_INTERVAL = float(os.environ.get("PROFILER_INTERVAL", 0.005))
+# Ring buffer of the captured profiles, the oldest are dropped beyond PROFILER_MAX_PROFILES
+PROFILER_DIR = os.environ.get("PROFILER_DIR", BASE_DIR / ".profiles")
+PROFILER_MAX_PROFILES = int(os.environ.get("PROFILER_MAX_PROFILES", 200))
+
+# Materialize each profile's feed in posts.TimelineEntry when posts are written instead of joining the friends and
+# following graph at read time. Run the rebuild_timelines command after turning it on.
+FEED_FANOUT_ON_WRITE = os.environ.get("FEED_FANOUT_ON_WRITE", "False") == "True"
+
+# Cache shared by all worker processes, e.g. "django.core.cache.backends.redis.RedisCache" with
+# CACHE_LOCATION=redis://127.0.0.1:6379 (needs the redis package) or "django.core.cache.backends.db.DatabaseCache"
+# with CACHE_LOCATION=leopardnotes_cache (run createcachetable first). Defaults to a per-process memory cache.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    },
+}
+
+# Seconds the viewer-independent parts of post cards stay cached, 0 disables the cache. Edits and comments invalidate
+# them at once, the "... ago" times of comments can be this much out of date. The invalidation only reaches other
+# worker processes through a shared cache, so the default is 0 with the per-process memory cache.
+POST_CARD_CACHE_TIMEOUT = int(os.environ.get(
+    "POST_CARD_CACHE_TIMEOUT",
+    0 if CACHES["default"]["BACKEND"].endswith(".LocMemCache") else 300,
+))
+
+# Query budget warnings and one JSON line per OCR pipeline request with the stage timings
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "leopardnotes.middleware": {
+            "handlers": ["console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
+        "leopardnotes.timing": {
+            "handlers": ["console"],
+            "level": os.environ.get("OCR_TIMING_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
 GRAPH_MODELS = {
     'all_applications': True,
     'group_models': True,
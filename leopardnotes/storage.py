@@ -0,0 +1,182 @@
+import functools
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+        File system storage that keeps every distinct file content once.
+
+        Files are stored under the SHA-256 of their content in sharded directories (cas/ab/cd/abcd....png) and
+        StoredBlob rows count the references to each of them. Saving content that is already stored only increments
+        the reference count, so duplicate uploads cost no extra disk space and no extra file writes. Deleting a name
+        only decrements the count, blobs without references are reclaimed by the media maintenance command.
+        Names outside of the cas/ prefix, e.g. the default avatar, are handled like in FileSystemStorage.
+
+        The models storing files release the references of deleted rows and replaced files with release_files. The
+        increment of a save runs in the caller's transaction when there is one, so it is rolled back with it. A save
+        failing in autocommit mode after its file was stored leaves one reference too many, which the
+        reconcile_refcounts step of the media maintenance command corrects.
+    """
+    prefix = "cas"
+    chunk_size = 64 * 2 ** 10
+
+    def get_available_name(self, name, max_length=None):
+        """
+            The requested name is only used for its extension, the stored name is derived from the content, so there
+            is no need to look for a free name.
+        """
+        return name
+
+    def _save(self, name, content):
+        from profiles.models import StoredBlob
+
+        digest, size, spooled_path = self._hash_content(content)
+        _, extension = os.path.splitext(name)
+        blob_name = f"{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}"
+
+        try:
+            with transaction.atomic():
+                blob, _ = StoredBlob.objects.select_for_update().get_or_create(
+                    digest=digest,
+                    defaults={"name": blob_name, "size": size},
+                )
+                if not self.exists(blob.name):
+                    if spooled_path:
+                        self._move_into_place(spooled_path, blob.name)
+                        spooled_path = None
+                    else:
+                        self._write_blob(content, blob.name)
+
+                StoredBlob.objects.filter(pk=blob.pk).update(refcount=F("refcount") + 1, updated=timezone.now())
+        finally:
+            if spooled_path:
+                os.remove(spooled_path)
+
+        return blob.name
+
+    def delete(self, name):
+        """
+            Drop one reference to a content-addressed file. The file itself stays until it is garbage collected.
+        """
+        from profiles.models import StoredBlob
+
+        if not name.startswith(f"{self.prefix}/"):
+            return super().delete(name)
+
+        StoredBlob.objects.filter(name=name, refcount__gt=0).update(
+            refcount=F("refcount") - 1,
+            updated=timezone.now(),
+        )
+
+    def _hash_content(self, content):
+        """
+            Hash the content chunk by chunk without holding it in memory.
+
+            Uploads are seekable (in memory or spooled to a temporary file by Django), so they are hashed in a
+            read-only pass and written later only if the content is new. Unseekable content is copied to a temporary
+            file next to the blobs while it is hashed, that copy is moved into place if the content is new.
+
+            Returns:
+                tuple: (hex digest, size in bytes, path of the spooled copy or None).
+        """
+        hasher = hashlib.sha256()
+        size = 0
+
+        if getattr(content, "seekable", lambda: True)():
+            for chunk in content.chunks(self.chunk_size):
+                hasher.update(chunk)
+                size += len(chunk)
+            content.seek(0)
+            return hasher.hexdigest(), size, None
+
+        os.makedirs(self.location, exist_ok=True)
+        fd, spooled_path = tempfile.mkstemp(dir=self.location, suffix=".upload")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in content.chunks(self.chunk_size):
+                hasher.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        return hasher.hexdigest(), size, spooled_path
+
+    def _write_blob(self, content, name):
+        """
+            Write content to a temporary file and move it into place, so a blob name never points at a partial file.
+        """
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks(self.chunk_size):
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._move_into_place(tmp_path, name)
+
+    def _move_into_place(self, tmp_path, name):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+
+
+def is_content_addressed(field_file):
+    """
+        Tell whether a stored file is a reference counted blob of ContentAddressedStorage.
+    """
+    storage = field_file.storage
+    return (
+        bool(field_file.name)
+        and isinstance(storage, ContentAddressedStorage)
+        and field_file.name.startswith(f"{storage.prefix}/")
+    )
+
+
+def get_replaced_files(instance, field_names, update_fields=None):
+    """
+        Get the content-addressed files of a saved row that saving the instance replaces. Called from pre_save.
+
+        Args:
+            instance (Model): The instance being saved.
+            field_names (iterable): The names of the file fields of the model.
+            update_fields (frozenset): The fields saved, None if all fields are saved.
+
+        Returns:
+            list: The FieldFiles stored in the row that the instance no longer holds.
+    """
+    if update_fields is not None:
+        field_names = [field_name for field_name in field_names if field_name in update_fields]
+    if instance._state.adding or instance.pk is None or not field_names:
+        return []
+
+    stored = type(instance)._default_manager.filter(pk=instance.pk).only(*field_names).first()
+    if stored is None:
+        return []
+    return [
+        getattr(stored, field_name) for field_name in field_names
+        if is_content_addressed(getattr(stored, field_name))
+        and getattr(stored, field_name).name != getattr(instance, field_name).name
+    ]
+
+
+def release_files(field_files):
+    """
+        Drop one reference to each content-addressed file once the current transaction commits, e.g. for the files of
+        a deleted row or the files a save replaced. Other files, e.g. the default avatar, are never deleted.
+
+        Args:
+            field_files (iterable): The FieldFiles to release.
+    """
+    for field_file in field_files:
+        if is_content_addressed(field_file):
+            transaction.on_commit(functools.partial(field_file.storage.delete, field_file.name))
@@ -0,0 +1,156 @@
+import functools
+import itertools
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from PIL import Image
+
+from .queries import QueryRecorder
+
+# Suffix of the usernames created by make_profiles, unique across the fixture sizes of a test
+_usernames = itertools.count()
+
+
+class TemporaryMediaMixin:
+    """
+        Run the tests of a TestCase against a temporary MEDIA_ROOT, removed after the class, that only holds the
+        default avatar. Derivatives are rendered in the request rather than in the background pool.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp(prefix="leopardnotes-media-")
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+
+        media_settings = override_settings(MEDIA_ROOT=media_root, DERIVATIVE_WORKERS=0)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+
+        with open(os.path.join(media_root, "avatar.png"), "wb") as avatar:
+            avatar.write(make_image_file("avatar.png").read())
+
+        super().setUpClass()
+
+
+def make_image_file(name="image.png", size=(64, 48)):
+    """
+        Create a small PNG upload for image fixtures.
+
+        Args:
+            name (str): The file name of the upload.
+            size (tuple): The (width, height) of the image.
+
+        Returns:
+            SimpleUploadedFile: The image, ready to assign to an ImageField.
+    """
+    content = BytesIO()
+    Image.new("RGB", size, "white").save(content, "PNG")
+    return SimpleUploadedFile(name, content.getvalue(), content_type="image/png")
+
+
+def query_budget(view_name, max_queries=None, sizes=(1, 10, 50)):
+    """
+        Declare the query budget of a view in a Django TestCase and check it at growing fixture sizes.
+
+        The decorated test method is called once per fixture size with the size as its argument. It creates that many
+        rows of whatever the view lists and returns the URL arguments of the view (a dict of kwargs, a list of args or
+        None), after logging in the test client if the view needs it. The view is then requested and the test fails
+        if it ran more queries than its budget, reporting the repeated query shapes and where they were issued. A
+        view with an N+1 pattern passes at the smallest size and fails as the fixtures grow.
+
+        Example:
+            @query_budget("posts:main-post-view")
+            def test_main_post_view_queries(self, size):
+                self.client.force_login(self.user)
+                make_posts(self.user.profile, size)
+
+        Args:
+            view_name (str): The URL name of the view, e.g. 'profiles:profile-detail-view'.
+            max_queries (int, optional): The budget. Defaults to the view's entry in the QUERY_BUDGETS setting, read
+                when the test runs so that override_settings applies.
+            sizes (tuple): The fixture sizes to check.
+    """
+    def decorator(test_method):
+        @functools.wraps(test_method)
+        def wrapper(self):
+            budget = settings.QUERY_BUDGETS.get(view_name) if max_queries is None else max_queries
+            if budget is None:
+                self.fail(f"{view_name} has no entry in the QUERY_BUDGETS setting and no max_queries was given.")
+
+            for size in sizes:
+                with self.subTest(fixture_size=size):
+                    url_arguments = test_method(self, size)
+                    if isinstance(url_arguments, dict):
+                        url = reverse(view_name, kwargs=url_arguments)
+                    else:
+                        url = reverse(view_name, args=url_arguments or ())
+
+                    recorder = QueryRecorder()
+                    with recorder.install():
+                        response = self.client.get(url)
+
+                    self.assertLess(response.status_code, 400, f"GET {url} returned {response.status_code}")
+                    self.assertLessEqual(
+                        recorder.count,
+                        budget,
+                        f"{view_name} ran {recorder.count} queries with {size} fixture rows, over its budget of "
+                        f"{budget}.\n{recorder.report(threshold=2)}",
+                    )
+
+        return wrapper
+
+    return decorator
+
+
+def make_profiles(count, prefix="user"):
+    """
+        Create users with their profiles for query budget fixtures.
+
+        Args:
+            count (int): Number of profiles to create.
+            prefix (str): Prefix of the usernames.
+
+        Returns:
+            list: The created Profile objects.
+    """
+    return [
+        User.objects.create_user(username=f"{prefix}-{next(_usernames)}", password="password").profile
+        for _ in range(count)
+    ]
+
+
+def make_posts(author, count, comments=2, likers=()):
+    """
+        Create posts with comments and likes for query budget fixtures.
+
+        Args:
+            author (Profile): The author of the posts.
+            count (int): Number of posts to create.
+            comments (int): Number of comments on each post, written by the likers or else the author.
+            likers (iterable): Profiles liking every post.
+
+        Returns:
+            list: The created Post objects.
+    """
+
+    from posts.models import Comment, Post
+    from posts.views_utils import like_unlike_post
+
+    likers = list(likers)
+    posts = []
+    for number in range(count):
+        post = Post.objects.create(author=author, content=f"Post {number} of {author}")
+        for comment_number in range(comments):
+            commenter = likers[comment_number % len(likers)] if likers else author
+            Comment.objects.create(profile=commenter, post=post, content=f"Comment {comment_number}")
+        for liker in likers:
+            like_unlike_post(liker, post.pk, post, action="like")
+        posts.append(post)
+    return posts
@@ -0,0 +1,131 @@
+import contextvars
+import functools
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+OCR_STAGE_SECONDS = histogram(
+    "ocr_stage_seconds", "Time spent in each stage of the OCR pipeline.", labelnames=("stage",),
+)
+OCR_REQUEST_SECONDS = histogram(
+    "ocr_request_seconds", "Total time of the OCR pipeline views.", labelnames=("view",),
+)
+
+_current_timer = contextvars.ContextVar("ocr_stage_timer", default=None)
+
+
+class StageTimer:
+    """
+        Collects the stage durations of one run of the OCR pipeline.
+
+        Attributes:
+            name (str): The name of the timed view.
+            stages (list): (stage, milliseconds, fields) tuples in the order the stages finished.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.start = time.monotonic()
+
+    def add(self, stage, elapsed_ms, **fields):
+        """
+            Add a finished stage, fields are only set for the per-segment engine runs.
+        """
+        self.stages.append((stage, elapsed_ms, fields))
+
+    def totals(self):
+        """
+            Sum the durations of repeated stages, e.g. one tesseract run per segment.
+
+            Returns:
+                dict: {stage: (total milliseconds, number of runs)} in the order the stages first finished.
+        """
+        totals = {}
+        for stage, elapsed_ms, _ in self.stages:
+            total, count = totals.get(stage, (0.0, 0))
+            totals[stage] = (total + elapsed_ms, count + 1)
+        return totals
+
+    def server_timing(self):
+        """
+            Format the stage totals and the overall duration as a Server-Timing header value.
+        """
+        entries = [
+            f'{stage};dur={total:.1f};desc="{count}x"' if count > 1 else f"{stage};dur={total:.1f}"
+            for stage, (total, count) in self.totals().items()
+        ]
+        entries.append(f"total;dur={(time.monotonic() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def log(self, **extra):
+        """
+            Write one JSON log line with the total, the per-stage totals and the per-segment engine timings.
+        """
+        logger.info(json.dumps({
+            "event": "ocr_pipeline",
+            "view": self.name,
+            "total_ms": round((time.monotonic() - self.start) * 1000, 1),
+            "stages": {stage: round(total, 1) for stage, (total, _) in self.totals().items()},
+            "segments": [
+                dict(fields, stage=stage, ms=round(elapsed_ms, 1)) for stage, elapsed_ms, fields in self.stages if fields
+            ],
+            **extra,
+        }))
+
+
+def record_stage(stage, elapsed_ms, **fields):
+    """
+        Record a stage duration measured by the caller in the stage histogram and in the active timer, if any.
+
+        Args:
+            stage (str): The stage name, a Server-Timing metric name.
+            elapsed_ms (float): The stage duration in milliseconds.
+            **fields: Extra details logged with the stage, e.g. the OCR type and region size of an engine run.
+    """
+    OCR_STAGE_SECONDS.observe(elapsed_ms / 1000, stage=stage)
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add(stage, elapsed_ms, **fields)
+
+
+@contextmanager
+def timed_stage(stage):
+    """
+        Time the enclosed block as one OCR pipeline stage.
+
+        Args:
+            stage (str): The stage name, a Server-Timing metric name.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, (time.perf_counter() - start) * 1000)
+
+
+def timed_ocr_view(view_func):
+    """
+        Time the OCR pipeline stages run by a view, add them to its response as a Server-Timing header and log them.
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        timer = StageTimer(view_func.__name__)
+        token = _current_timer.set(timer)
+        try:
+            response = view_func(request, *args, **kwargs)
+        finally:
+            _current_timer.reset(token)
+
+        if timer.stages:
+            response["Server-Timing"] = timer.server_timing()
+            timer.log(method=request.method, status=response.status_code)
+            OCR_REQUEST_SECONDS.observe(time.monotonic() - timer.start, view=timer.name)
+        return response
+
+    return wrapper
@@ -4,7 +4,9 @@ from django.contrib import admin
 from django.urls import include, path
 
 from .views import home_view, ocr_view, ocr_results_view, OCRImageDeleteView, segment_image, submit_marked_data,\
-    snip_view
+    snip_view, reocr_segment_view, ocr_search_view, ocr_detail_view, ocr_segmented_preview_view, ocr_batch_view,\
+    ocr_batch_progress_view, ocr_export_view, ocr_metrics_view, metrics_view,\
+    profiling_view, profiling_download_view
 
 
 urlpatterns = [
@@ -19,6 +21,17 @@ urlpatterns = [
     path('segment-image/', segment_image, name='segment-image'),
     path('submit-marked-data/', submit_marked_data, name='submit-marked-data'),
     path('ocr/snip-image/', snip_view, name='ocr-snip'),
+    path('ocr/batch/', ocr_batch_view, name='ocr-batch'),
+    path('ocr/batch/<int:pk>/', ocr_batch_progress_view, name='ocr-batch-progress'),
+    path('ocr/<int:pk>/', ocr_detail_view, name='ocr-detail'),
+    path('ocr/<int:pk>/segmented/', ocr_segmented_preview_view, name='ocr-segmented-preview'),
+    path('ocr/search/', ocr_search_view, name='ocr-search'),
+    path('ocr/export/', ocr_export_view, name='ocr-export'),
+    path('ocr/metrics/', ocr_metrics_view, name='ocr-metrics'),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiling/', profiling_view, name='profiling'),
+    path('profiling/<str:name>/', profiling_download_view, name='profiling-download'),
+    path('ocr/segments/<int:pk>/reocr/', reocr_segment_view, name='reocr-segment'),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,21 +1,39 @@
-from django.shortcuts import redirect, render
+from django.shortcuts import get_object_or_404, redirect, render
 from django.core.files.base import ContentFile
+from django.db.models.functions import Length, Substr
 from PIL import Image
 import pytesseract
-from profiles.models import OCRImage
-from django.urls import reverse_lazy
+from profiles.models import OCRBatch, OCRImage, OCRSegment, OCR_TYPE_CHOICES
+from profiles.search import search_ocr_images
+from profiles.views_utils import get_keyset_page
+from django.urls import reverse, reverse_lazy
 from django.views.generic import DeleteView
 from django.contrib import messages
 from io import BytesIO
 import base64
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 import cv2
 import numpy as np
-from pix2tex.cli import LatexOCR
+from functools import lru_cache
+from importlib import metadata
 import json
+import time
+
+from .batch import BatchError, fail_if_stale, start_batch
+from .classify import classify_region
+from .export import MANIFEST_FORMATS, stream_notes_zip
+from .latex import get_latex_model
+from .metrics import collect, estimate_quantile, get_cumulative_buckets, render_text
+from .profiling import get_profile_path, list_profiles
+from .timing import record_stage, timed_ocr_view, timed_stage
 
 pytesseract.pytesseract.tesseract_cmd = 'C://Program Files//Tesseract-OCR//tesseract.exe'
-latex_model = LatexOCR()
+
+OCR_RESULTS_PAGE_SIZE = 20
+OCR_TEXT_PREVIEW_LENGTH = 300
 
 
 def Crop(sorted_contours_lines, img):
@@ -89,6 +107,39 @@ def Threshhold(img):
     return gaussian
 
 
+def segment_array(img):
+    """
+        Find the text line regions of a decoded image.
+
+        Args:
+            img (numpy.ndarray): The decoded BGR image to be segmented.
+
+        Returns:
+            boxes (list): A list of [x, y, w, h] bounding boxes sorted from top to bottom.
+            img_copy (numpy.ndarray): A copy of the image with the segmentation rectangles drawn on it.
+    """
+    # Create a copy of the original image
+    img_copy = img.copy()
+
+    # Convert the image to grayscale and perform the segmentation
+    with timed_stage('threshold'):
+        gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        blur_gray_img = cv2.medianBlur(gray_img, 5)
+        invert_blur_gray_img = cv2.bitwise_not(blur_gray_img)
+        new_img = Threshhold(invert_blur_gray_img)
+        Kernel(new_img)
+
+    # Draw the rectangle boxes on the original image copy
+    with timed_stage('contours'):
+        (contours, _) = cv2.findContours(new_img.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        sorted_contours_lines = sorted(contours, key=lambda ctr: cv2.boundingRect(ctr)[1])
+        Crop(sorted_contours_lines, img_copy)
+
+    boxes = [[int(value) for value in cv2.boundingRect(contour)] for contour in sorted_contours_lines]
+
+    return boxes, img_copy
+
+
 def perform_segmentation(image):
     """
         Perform image segmentation on the provided image.
@@ -99,43 +150,105 @@ def perform_segmentation(image):
         Returns:
             segmented_images_base64 (list): A list of base64-encoded strings representing individual segmented images.
             full_image_segmented_base64 (str): A base64-encoded string representing the full image with segmentation rectangles.
+            boxes (list): A list of [x, y, w, h] bounding boxes, one per segmented image, in the original image.
+            ocr_types (list): The suggested OCR type ('text' or 'math') of each segmented image.
         """
 
     # Convert the image to numpy array
-    nparr = np.frombuffer(image.read(), np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-    # Create a copy of the original image
-    img_copy = img.copy()
-
-    # Convert the image to grayscale and perform the segmentation
-    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur_gray_img = cv2.medianBlur(gray_img, 5)
-    invert_blur_gray_img = cv2.bitwise_not(blur_gray_img)
-    new_img = Threshhold(invert_blur_gray_img)
-    Kernel(new_img)
+    with timed_stage('imdecode'):
+        nparr = np.frombuffer(image.read(), np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
-    # Draw the rectangle boxes on the original image copy
-    (contours, _) = cv2.findContours(new_img.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    sorted_contours_lines = sorted(contours, key=lambda ctr: cv2.boundingRect(ctr)[1])
-    Crop(sorted_contours_lines, img_copy)
+    boxes, img_copy = segment_array(img)
 
     # Return a list of individual segmented images as base64 strings
     segmented_images_base64 = []
-    for contour in sorted_contours_lines:
-        rect = cv2.boundingRect(contour)
-        x, y, w, h = rect
+    ocr_types = []
+    for x, y, w, h in boxes:
         cropped_img = img_copy[y:y+h, x:x+w]
+        # Classify the region of the original image, the copy has the segmentation rectangles drawn on it
+        ocr_types.append(classify_region(Image.fromarray(cv2.cvtColor(img[y:y+h, x:x+w], cv2.COLOR_BGR2RGB))))
 
-        _, buffer = cv2.imencode('.png', cropped_img)
-        segmented_image_base64 = base64.b64encode(buffer).decode('utf-8')
+        with timed_stage('png_encode'):
+            _, buffer = cv2.imencode('.png', cropped_img)
+            segmented_image_base64 = base64.b64encode(buffer).decode('utf-8')
         segmented_images_base64.append(segmented_image_base64)
 
     # Encode the full segmented image
-    _, buffer = cv2.imencode('.png', img_copy)
-    full_image_segmented_base64 = base64.b64encode(buffer).decode('utf-8')
+    with timed_stage('png_encode'):
+        _, buffer = cv2.imencode('.png', img_copy)
+        full_image_segmented_base64 = base64.b64encode(buffer).decode('utf-8')
+
+    return segmented_images_base64, full_image_segmented_base64, boxes, ocr_types
+
+
+@lru_cache(maxsize=None)
+def get_engine_version(ocr_type):
+    """
+        Get a version string for the OCR engine used for the given OCR type.
+
+        Args:
+            ocr_type (str): Type of OCR, 'text' for tesseract or 'math' for pix2tex.
+
+        Returns:
+            str: The engine name and version, or an empty string if the OCR type is not recognized.
+    """
+    try:
+        if ocr_type == 'text':
+            return f"tesseract {pytesseract.get_tesseract_version()}"
+        if ocr_type == 'math':
+            version = f"pix2tex {metadata.version('pix2tex')}"
+            # Quantized inference can produce different output, keep it apart from the fp32 results
+            return version if settings.OCR_LATEX_BACKEND == 'fp32' else f"{version} {settings.OCR_LATEX_BACKEND}"
+    except Exception:
+        return ocr_type
+    return ''
+
+
+def run_ocr_engine(pil_image, ocr_type):
+    """
+        Run the OCR engine matching the OCR type on a PIL image and time it.
+
+        Args:
+            pil_image (PIL.Image.Image): The image to recognize.
+            ocr_type (str): Type of OCR to perform. Can be 'text' for text OCR or 'math' for mathematical expressions
+            OCR.
+
+        Returns:
+            tuple: (ocr_result, engine_version, elapsed_ms). The OCR result is an empty string if the OCR type is not
+            recognized.
+    """
+    start = time.perf_counter()
+    if ocr_type == 'text':
+        ocr_result = pytesseract.image_to_string(pil_image)
+        engine = 'tesseract'
+    elif ocr_type == 'math':
+        ocr_result = get_latex_model()(pil_image)
+        engine = 'latex'
+    else:
+        return '', get_engine_version(ocr_type), 0.0
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_stage(engine, elapsed_ms, ocr_type=ocr_type, width=pil_image.width, height=pil_image.height)
+
+    return ocr_result, get_engine_version(ocr_type), elapsed_ms
 
-    return segmented_images_base64, full_image_segmented_base64
+
+def decode_base64_image(image_data):
+    """
+        Decode base64-encoded image data into an RGB PIL image.
+
+        Args:
+            image_data (str): Base64-encoded image data.
+
+        Returns:
+            PIL.Image.Image: The decoded image.
+    """
+    with timed_stage('b64decode'):
+        decoded_data = base64.b64decode(image_data)
+    with timed_stage('imdecode'):
+        nparr = np.frombuffer(decoded_data, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
 
 
 def performOCR(image_data, ocr_type):
@@ -153,16 +266,7 @@ def performOCR(image_data, ocr_type):
             str: OCR result as a string. If the OCR type is not recognized, an empty string is returned.
     """
 
-    decoded_data = base64.b64decode(image_data)
-    nparr = np.frombuffer(decoded_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    pil_image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-    if ocr_type == 'text':
-        ocr_result = pytesseract.image_to_string(pil_image)
-    elif ocr_type == 'math':
-        ocr_result = latex_model(pil_image)
-    else:
-        ocr_result = ''
+    ocr_result, _, _ = run_ocr_engine(decode_base64_image(image_data), ocr_type)
 
     return ocr_result
 
@@ -180,21 +284,126 @@ def processOCRResults(segmented_images, selected_options):
                 The keys are in the format 'segmented_dropdown_{index}', where index is the 1-based index of the
                 segment.
                 The values are the selected OCR option, which can be 'text' for text OCR or 'math' for mathematical
-                expressions OCR.
+                expressions OCR. Segments without a selected option are classified automatically.
 
         Returns:
-            list: A list of OCR results as strings. The order of results corresponds to the order of segmented_images.
+            list: A list of OCR results as dictionaries with the keys 'ocr_type', 'text', 'engine_version' and
+                'elapsed_ms'. The order of results corresponds to the order of segmented_images.
         """
     ocr_results = []
 
     for index, image_data in enumerate(segmented_images):
-        selected_option = selected_options.get(f'segmented_dropdown_{index + 1}', 'text')
-        ocr_result = performOCR(image_data, selected_option)
-        ocr_results.append(ocr_result)
+        pil_image = decode_base64_image(image_data)
+        selected_option = selected_options.get(f'segmented_dropdown_{index + 1}') or classify_region(pil_image)
+        ocr_result, engine_version, elapsed_ms = run_ocr_engine(pil_image, selected_option)
+        ocr_results.append({
+            'ocr_type': selected_option,
+            'text': ocr_result,
+            'engine_version': engine_version,
+            'elapsed_ms': elapsed_ms,
+        })
 
     return ocr_results
 
 
+def clip_box(box, image_width, image_height):
+    """
+        Clip a client-supplied bounding box to the bounds of its image.
+
+        Args:
+            box (list): An [x, y, w, h] box.
+            image_width (int): The width of the image.
+            image_height (int): The height of the image.
+
+        Returns:
+            list: The clipped [x, y, w, h] box, or None if no part of the box lies within the image.
+
+        Raises:
+            ValueError: If the box is not four numbers.
+    """
+    try:
+        x, y, w, h = (int(value) for value in box)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid segment box {box!r}")
+
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + w, image_width), min(y + h, image_height)
+    if right <= left or bottom <= top:
+        return None
+    return [left, top, right - left, bottom - top]
+
+
+def create_ocr_segments(ocr_image, ocr_results, boxes):
+    """
+        Store the per-region OCR results of an OCR image as OCRSegment rows.
+
+        Args:
+            ocr_image (OCRImage): The parent OCR image.
+            ocr_results (list): OCR result dictionaries as returned by processOCRResults.
+            boxes (list): A list of [x, y, w, h] boxes (or None) matching ocr_results.
+
+        Returns:
+            list: The created OCRSegment instances.
+    """
+    segments = []
+    for order, (result, box) in enumerate(zip(ocr_results, boxes)):
+        x, y, width, height = box if box else (None, None, None, None)
+        segments.append(OCRSegment(
+            ocr_image=ocr_image,
+            order=order,
+            x=x,
+            y=y,
+            width=width,
+            height=height,
+            ocr_type=result['ocr_type'],
+            text=result['text'],
+            engine_version=result['engine_version'],
+            elapsed_ms=result['elapsed_ms'],
+        ))
+
+    return OCRSegment.objects.bulk_create(segments)
+
+
+def load_segment_image(segment):
+    """
+        Load the image region of a stored OCR segment.
+
+        Segments with a bounding box are cropped out of the OCR image's original upload. Snipped images have a single
+        segment without a box whose region is the stored snipped image.
+
+        Args:
+            segment (OCRSegment): The segment to load.
+
+        Returns:
+            PIL.Image.Image: The RGB image of the segment region.
+
+        Raises:
+            ValueError: If the segment's box lies outside of the image, or a segment of an image that is not snipped
+                has no box. Its region is not stored anywhere, the segmented preview has the boxes drawn on it.
+    """
+    ocr_image = segment.ocr_image
+    if segment.box:
+        source = ocr_image.uploaded_image
+    elif ocr_image.isSnipped and ocr_image.fully_segmented_image:
+        source = ocr_image.fully_segmented_image
+    else:
+        raise ValueError('The segment has no box to crop out of its image, upload the image again to OCR it.')
+
+    with source.open('rb') as f:
+        nparr = np.frombuffer(f.read(), np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+    if segment.box:
+        box = clip_box(segment.box, img.shape[1], img.shape[0])
+        if box is None:
+            raise ValueError('The segment box lies outside of its image.')
+        x, y, w, h = box
+        img = img[y:y+h, x:x+w]
+
+    return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+
+@timed_ocr_view
 def segment_image(request):
     """
         Segment an uploaded image and return segmented results in a JSON response.
@@ -212,12 +421,14 @@ def segment_image(request):
     if request.method == 'POST' and request.FILES.get('image'):
         image = request.FILES['image']
 
-        segmented_images, full_image_segmented = perform_segmentation(image)
+        segmented_images, full_image_segmented, boxes, ocr_types = perform_segmentation(image)
 
         if segmented_images is not None:
             response_data = {
                 'segmented_images': segmented_images,
                 'full_image_segmented': full_image_segmented,
+                'boxes': boxes,
+                'ocr_types': ocr_types,
             }
             return JsonResponse(response_data)
         else:
@@ -226,6 +437,7 @@ def segment_image(request):
     return JsonResponse({'error': 'Invalid request'})
 
 
+@timed_ocr_view
 def submit_marked_data(request):
     """
         Process marked image data, perform OCR, and save OCR results to the database.
@@ -245,31 +457,62 @@ def submit_marked_data(request):
 
         segmented_images = []
         selected_options = {}
+        boxes = []
         for item in marked_data:
             segmented_images.append(item['imageBase64'])
-            selected_options[f'segmented_dropdown_{len(segmented_images)}'] = item['ocrType']
+            selected_options[f'segmented_dropdown_{len(segmented_images)}'] = item.get('ocrType')
+            boxes.append(item.get('box'))
+
+        image = request.FILES.get('image')
+        if any(boxes):
+            if not image:
+                return JsonResponse({'error': 'Invalid request'}, status=400)
+            # Boxes come from the client, they are stored and later cropped out of the image
+            try:
+                with Image.open(image) as pil_image:
+                    image_width, image_height = pil_image.size
+                    # Segmentation decodes with OpenCV, which applies the EXIF orientation, 5 to 8 are rotated by 90°
+                    if pil_image.getexif().get(0x0112) in (5, 6, 7, 8):
+                        image_width, image_height = image_height, image_width
+            except OSError:
+                return JsonResponse({'error': 'The uploaded file is not a readable image.'}, status=400)
+            image.seek(0)
+            clipped_boxes = []
+            for box in boxes:
+                if box:
+                    try:
+                        box = clip_box(box, image_width, image_height)
+                    except ValueError as e:
+                        return JsonResponse({'error': str(e)}, status=400)
+                    if box is None:
+                        return JsonResponse({'error': 'A segment box lies outside of the image.'}, status=400)
+                clipped_boxes.append(box)
+            boxes = clipped_boxes
 
         # Perform OCR on the segmented images with their respective OCR types
         ocr_results = processOCRResults(segmented_images, selected_options)
         # Combine the OCR results into a single string
-        combined_ocr_text = '\n'.join(ocr_results)
+        combined_ocr_text = '\n'.join(result['text'] for result in ocr_results)
 
-        image = request.FILES.get('image')
         title = request.POST.get('title')
 
         full_image_segmented_base64 = request.POST.get('preview-image')
-        full_image_segmented_binary = base64.b64decode(full_image_segmented_base64)
+        with timed_stage('b64decode'):
+            full_image_segmented_binary = base64.b64decode(full_image_segmented_base64)
 
         filename = f"{title}.png"
 
-        ocr_image = OCRImage.objects.create(
-            profile=request.user.profile,
-            title=title,
-            ocr_text=combined_ocr_text,
-            uploaded_image=image,
-            fully_segmented_image=ContentFile(full_image_segmented_binary, name=filename),
-            isSnipped=False,
-        )
+        with timed_stage('save'):
+            ocr_image = OCRImage.objects.create(
+                profile=request.user.profile,
+                title=title,
+                ocr_text=combined_ocr_text,
+                uploaded_image=image,
+                fully_segmented_image=ContentFile(full_image_segmented_binary, name=filename),
+                isSnipped=False,
+            )
+            create_ocr_segments(ocr_image, ocr_results, boxes)
+
         context = {
             'ocr_text': ocr_image.ocr_text,
             'title': ocr_image.title,
@@ -323,6 +566,7 @@ def ocr_view(request):
         return redirect('home-view')
 
 
+@timed_ocr_view
 def snip_view(request):
     """
         Process snipped image data, perform OCR, and save OCR results to the database.
@@ -351,18 +595,16 @@ def snip_view(request):
                 return render(request, 'main/ocr.html', {'error': 'Please snip the image first.'})
 
             try:
-                # Save the original image to the file path
                 filename = f"{title}.png"
-                with open(filename, 'wb') as f:
-                    f.write(base64.b64decode(original_image_data.split(',')[1]))
-
-                # Perform OCR on the snipped image
-                ocr_image = Image.open(BytesIO(base64.b64decode(snipped_image_data.split(',')[1])))
-                if ocr_type == 'text':
-                    ocr_text = pytesseract.image_to_string(ocr_image)
-                elif ocr_type == 'math':
-                    ocr_text = latex_model(ocr_image)
-                else:
+                original_image_binary = base64.b64decode(original_image_data.split(',')[1])
+                snipped_image_binary = base64.b64decode(snipped_image_data.split(',')[1])
+
+                # Perform OCR on the snipped image, classifying it when no OCR type was chosen
+                ocr_image = Image.open(BytesIO(snipped_image_binary))
+                if not ocr_type:
+                    ocr_type = classify_region(ocr_image)
+                ocr_text, engine_version, elapsed_ms = run_ocr_engine(ocr_image, ocr_type)
+                if ocr_type not in ('text', 'math'):
                     ocr_text = 'Did not work.... Try again'
 
                 if ocr_text:
@@ -370,10 +612,16 @@ def snip_view(request):
                         profile=request.user.profile,
                         title=title,
                         ocr_text=ocr_text,
-                        uploaded_image=ContentFile(base64.b64decode(original_image_data.split(',')[1]), name=filename),
-                        fully_segmented_image=ContentFile(base64.b64decode(snipped_image_data.split(',')[1]), name=filename),
+                        uploaded_image=ContentFile(original_image_binary, name=filename),
+                        fully_segmented_image=ContentFile(snipped_image_binary, name=filename),
                         isSnipped=True,
                     )
+                    create_ocr_segments(ocr_image, [{
+                        'ocr_type': ocr_type,
+                        'text': ocr_text,
+                        'engine_version': engine_version,
+                        'elapsed_ms': elapsed_ms,
+                    }], [None])
                     context = {
                         'ocr_text': ocr_image.ocr_text,
                         'title': ocr_image.title,
@@ -393,12 +641,74 @@ def snip_view(request):
         return redirect('home-view')
 
 
+def ocr_batch_view(request):
+    """
+        Display the batch upload page and start processing an uploaded PDF or zip of images.
+
+        This view function renders the batch upload page (main/ocr_batch.html). A POST request with a 'document' file
+        creates an OCRBatch and processes its pages in the background, each page becoming its own OCR image.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            HttpResponse: The batch upload page, or a JSON response with the batch progress URL or an error message.
+    """
+    if not request.user.is_authenticated:
+        return redirect('home-view')
+
+    if request.method == 'POST':
+        document = request.FILES.get('document')
+        if not document:
+            return JsonResponse({'error': 'Please choose a PDF or zip file first.'})
+
+        try:
+            batch = start_batch(request.user.profile, request.POST.get('title', '').strip(), document)
+        except BatchError as e:
+            return JsonResponse({'error': str(e)})
+
+        return JsonResponse({
+            'batch_id': batch.pk,
+            'total_pages': batch.total_pages,
+            'progress_url': reverse('ocr-batch-progress', args=[batch.pk]),
+        })
+
+    return render(request, 'main/ocr_batch.html')
+
+
+def ocr_batch_progress_view(request, pk):
+    """
+        Report the progress of one of the authenticated user's batch uploads, marking it failed if its processing
+        stopped without finishing.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+            pk (int): The primary key of the OCRBatch.
+
+        Returns:
+            JsonResponse: A JSON response containing the status, page counts and per-page errors of the batch.
+    """
+    if not request.user.is_authenticated:
+        return redirect('home-view')
+
+    batch = fail_if_stale(get_object_or_404(OCRBatch, pk=pk, profile=request.user.profile))
+
+    return JsonResponse({
+        'status': batch.status,
+        'total_pages': batch.total_pages,
+        'processed_pages': batch.processed_pages,
+        'failed_pages': batch.failed_pages,
+        'errors': batch.errors,
+    })
+
+
 def ocr_results_view(request):
     """
         Display OCR results associated with the authenticated user.
 
-        This view function retrieves OCR images associated with the authenticated user's profile and renders them
-        in the OCR results page (main/ocr_results.html).
+        This view function retrieves one page of the OCR images associated with the authenticated user's profile and
+        renders them in the OCR results page (main/ocr_results.html). Pages are keyset-paginated on (created, id) and
+        only a preview prefix of the OCR text is loaded, the full text and segments are fetched on demand.
 
         Args:
             request (HttpRequest): The incoming HTTP request object.
@@ -407,15 +717,324 @@ def ocr_results_view(request):
             HttpResponse: A rendered HTML response displaying the OCR results or redirecting to the home view.
     """
     if request.user.is_authenticated:
-        ocr_images = OCRImage.objects.filter(profile=request.user.profile)
+        queryset = (
+            OCRImage.objects.filter(profile=request.user.profile)
+            .defer('ocr_text')
+            .annotate(
+                ocr_text_preview=Substr('ocr_text', 1, OCR_TEXT_PREVIEW_LENGTH),
+                ocr_text_length=Length('ocr_text'),
+            )
+        )
+        cursor = request.GET.get('after')
+        ocr_images, next_cursor = get_keyset_page(queryset, cursor, OCR_RESULTS_PAGE_SIZE)
         context = {
             'ocr_images': ocr_images,
+            'next_cursor': next_cursor,
+            'is_paginated': bool(cursor),
+            'preview_length': OCR_TEXT_PREVIEW_LENGTH,
         }
         return render(request, 'main/ocr_results.html', context)
     else:
         return redirect('home-view')
 
 
+def ocr_detail_view(request, pk):
+    """
+        Return the full OCR text and the segments of one of the authenticated user's OCR images.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+            pk (int): The primary key of the OCRImage.
+
+        Returns:
+            JsonResponse: A JSON response containing the OCR text and the segments with their re-OCR URLs.
+    """
+    if not request.user.is_authenticated:
+        return redirect('home-view')
+
+    ocr_image = get_object_or_404(OCRImage, pk=pk, profile=request.user.profile)
+    segments = [
+        {
+            'id': segment.id,
+            'order': segment.order,
+            'ocr_type': segment.ocr_type,
+            'text': segment.text,
+            'reocr_url': reverse('reocr-segment', args=[segment.id]),
+        }
+        for segment in ocr_image.segments.only('id', 'order', 'ocr_type', 'text')
+    ]
+
+    return JsonResponse({
+        'id': ocr_image.id,
+        'title': ocr_image.title,
+        'ocr_text': ocr_image.ocr_text,
+        'segments': segments,
+    })
+
+
+def ocr_segmented_preview_view(request, pk):
+    """
+        Render the segmented preview of an OCR image from its original image and the stored segment boxes.
+
+        The media maintenance command drops stored segmented previews of old OCR images because they can be derived
+        again, this view renders them on demand.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+            pk (int): The primary key of the OCRImage.
+
+        Returns:
+            HttpResponse: A JPEG image with the segmentation rectangles drawn on the original image.
+    """
+    if not request.user.is_authenticated:
+        return redirect('home-view')
+
+    ocr_image = get_object_or_404(OCRImage, pk=pk, profile=request.user.profile)
+
+    with ocr_image.uploaded_image.open('rb') as f:
+        img = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR)
+
+    for x, y, w, h in ocr_image.segments.exclude(x__isnull=True).values_list('x', 'y', 'width', 'height'):
+        cv2.rectangle(img, (x, y), (x + w, y + h), (40, 100, 250), 2)
+
+    _, buffer = cv2.imencode('.jpg', img)
+    response = HttpResponse(buffer.tobytes(), content_type='image/jpeg')
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+def ocr_search_view(request):
+    """
+        Search the authenticated user's OCR notes by title and OCR text.
+
+        This view function runs a full-text search for the 'q' query parameter and returns one page of hits ranked by
+        relevance, each with a highlighted snippet of the matching OCR text.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            JsonResponse: A JSON response containing the ranked hits and pagination information.
+    """
+    if not request.user.is_authenticated:
+        return redirect('home-view')
+
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    if not query:
+        return JsonResponse({'query': query, 'page': page, 'has_next': False, 'results': []})
+
+    results, has_next = search_ocr_images(request.user.profile, query, page=page)
+    for result in results:
+        result['detail_url'] = reverse('ocr-detail', args=[result['id']])
+
+    return JsonResponse({
+        'query': query,
+        'page': page,
+        'has_next': has_next,
+        'results': results,
+    })
+
+
+def ocr_export_view(request):
+    """
+        Export all of the authenticated user's OCR notes as a streamed zip archive.
+
+        The archive contains a manifest of the notes, the OCR text of every note and, with the 'images' query
+        parameter set to 1, the uploaded and segmented images. The 'manifest' query parameter selects a 'json'
+        (default) or 'csv' manifest. The archive is built while it is sent, so it is never held in memory.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            StreamingHttpResponse: The zip archive, or a JSON error message for an unknown manifest format.
+    """
+    if not request.user.is_authenticated:
+        return redirect('home-view')
+
+    manifest_format = request.GET.get('manifest', 'json')
+    if manifest_format not in MANIFEST_FORMATS:
+        return JsonResponse({'error': 'Invalid manifest format'})
+    include_images = request.GET.get('images') == '1'
+
+    notes = OCRImage.objects.filter(profile=request.user.profile)
+    response = StreamingHttpResponse(
+        stream_notes_zip(notes, include_images=include_images, manifest_format=manifest_format),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = f'attachment; filename="leopard-notes-{timezone.now():%Y-%m-%d}.zip"'
+    return response
+
+
+def ocr_metrics_view(request):
+    """
+        Report the aggregated request and OCR pipeline timings of all worker processes to staff users.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            JsonResponse: A JSON response with the count, mean, estimated p50/p95 and buckets of every histogram series.
+    """
+    if not request.user.is_staff:
+        return redirect('home-view')
+
+    metrics = {}
+    for name, family in sorted(collect().items()):
+        if family['type'] != 'histogram':
+            continue
+        series = []
+        for key, value in sorted(family['series'].items()):
+            buckets = get_cumulative_buckets(family, value)
+            series.append({
+                'labels': dict(zip(family['labelnames'], key)),
+                'count': value['count'],
+                'mean': value['sum'] / value['count'] if value['count'] else None,
+                'p50': estimate_quantile(buckets, 0.5),
+                'p95': estimate_quantile(buckets, 0.95),
+                'buckets': [['+Inf' if bound == float('inf') else bound, count] for bound, count in buckets],
+            })
+        metrics[name] = {'documentation': family['documentation'], 'series': series}
+
+    return JsonResponse({'metrics': metrics})
+
+
+def get_client_ip(request):
+    """
+        Get the address of the client that sent a request, looking through the METRICS_TRUSTED_PROXIES reverse proxies
+        in front of the app.
+
+        Only the entries the trusted proxies appended to X-Forwarded-For are used, the ones before them are sent by
+        the client and can be forged.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            str: The client address, None if the request came through fewer proxies than expected.
+    """
+    proxies = settings.METRICS_TRUSTED_PROXIES
+    if not proxies:
+        return request.META.get('REMOTE_ADDR')
+
+    forwarded_for = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if len(forwarded_for) < proxies:
+        return None
+    return forwarded_for[-proxies]
+
+
+def metrics_view(request):
+    """
+        Expose all metrics in the Prometheus text format.
+
+        Scrapes are allowed from the addresses in METRICS_ALLOWED_IPS and from staff users. Behind a reverse proxy the
+        client address is taken from X-Forwarded-For, see get_client_ip.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            HttpResponse: The metrics in the text exposition format, or a 403 response.
+    """
+    if get_client_ip(request) not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponse(status=403)
+
+    return HttpResponse(render_text(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def profiling_view(request):
+    """
+        List the profiles captured by the sampling profiler, grouped by view.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            HttpResponse: The rendered list of profiles.
+    """
+    return render(request, 'main/profiling.html', {'profiles': list_profiles()})
+
+
+@staff_member_required
+def profiling_download_view(request, name):
+    """
+        Download a captured profile in the folded stack format, which flamegraph.pl and speedscope read.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+            name (str): The profile file name.
+
+        Returns:
+            FileResponse: The profile file.
+    """
+    path = get_profile_path(name)
+    if path is None:
+        raise Http404('Profile not found')
+
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type='text/plain')
+
+
+@timed_ocr_view
+def reocr_segment_view(request, pk):
+    """
+        Change the OCR type of a single segment and re-run OCR on that segment only.
+
+        This view function processes a POST request containing the new OCR type for one of the requesting user's
+        segments. Only the region of that segment is recognized again; the parent OCR image text is then recomposed
+        from the stored segment results.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+            pk (int): The primary key of the OCRSegment to re-run.
+
+        Returns:
+            JsonResponse: A JSON response containing the new segment text and the recomposed OCR text, or an error
+            message.
+    """
+    if not request.user.is_authenticated:
+        return redirect('home-view')
+
+    if request.method == 'POST':
+        segment = get_object_or_404(
+            OCRSegment.objects.select_related('ocr_image'),
+            pk=pk,
+            ocr_image__profile=request.user.profile,
+        )
+        ocr_type = request.POST.get('ocr_type')
+
+        if ocr_type not in dict(OCR_TYPE_CHOICES):
+            return JsonResponse({'error': 'Invalid OCR type'})
+
+        try:
+            region = load_segment_image(segment)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        ocr_result, engine_version, elapsed_ms = run_ocr_engine(region, ocr_type)
+
+        segment.ocr_type = ocr_type
+        segment.text = ocr_result
+        segment.engine_version = engine_version
+        segment.elapsed_ms = elapsed_ms
+        segment.save(update_fields=['ocr_type', 'text', 'engine_version', 'elapsed_ms', 'updated'])
+
+        segment.ocr_image.recompose_ocr_text()
+
+        return JsonResponse({
+            'segment_text': segment.text,
+            'ocr_text': segment.ocr_image.ocr_text,
+            'elapsed_ms': elapsed_ms,
+        })
+
+    return JsonResponse({'error': 'Invalid request'})
+
+
 class OCRImageDeleteView(DeleteView):
     """
         Delete view for deleting an OCRImage instance.
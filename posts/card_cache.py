@@ -0,0 +1,112 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from leopardnotes.metrics import CACHE_REQUESTS
+
+
+def get_version_key(post_id):
+    """
+        Get the cache key of the version of a post's cached card fragments.
+    """
+    return f"post-card:{post_id}:version"
+
+
+def get_fragment_key(post_id, version, part, vary_on=()):
+    """
+        Get the cache key of one fragment of a post card.
+
+        Args:
+            post_id (int): The ID of the post.
+            version (int): The current version of the post's fragments.
+            part (str): The name of the cached part of the card, e.g. "feed-body".
+            vary_on (iterable): Further values the fragment depends on, e.g. the commenters of a comments fragment.
+
+        Returns:
+            str: The cache key.
+    """
+    key = f"post-card:{post_id}:{version}:{part}"
+    if vary_on:
+        key += ":" + hashlib.md5(":".join(str(value) for value in vary_on).encode(), usedforsecurity=False).hexdigest()
+    return key
+
+
+def get_commenters_key(comments):
+    """
+        Get a value that changes whenever the rendered name or avatar of one of the commenters changes, so that the
+        cached comments fragments of a post are not served with an old avatar or name.
+
+        Args:
+            comments (list): The rendered comments, with their profiles and users loaded.
+
+        Returns:
+            str: The key.
+    """
+    return ",".join(
+        f"{comment.profile_id}:{comment.profile.user.username}:{comment.profile.avatar.name}" for comment in comments
+    )
+
+
+def get_post_card_versions(post_ids):
+    """
+        Get the current fragment versions of several posts with one cache request, initializing missing versions.
+
+        Args:
+            post_ids (list): The IDs of the posts.
+
+        Returns:
+            dict: {post id: version}.
+    """
+    keys = {get_version_key(post_id): post_id for post_id in post_ids}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+
+    for post_id in set(post_ids) - set(versions):
+        # A version starting at the current time never matches the fragments cached before it was evicted
+        cache.add(get_version_key(post_id), time.time_ns(), timeout=None)
+        versions[post_id] = cache.get(get_version_key(post_id))
+    return versions
+
+
+def bump_post_card_version(post_id):
+    """
+        Invalidate the cached card fragments of a post by moving it to a new version.
+
+        Args:
+            post_id (int): The ID of the post.
+    """
+    try:
+        cache.incr(get_version_key(post_id))
+    except ValueError:
+        cache.add(get_version_key(post_id), time.time_ns(), timeout=None)
+
+
+def get_cached_fragment(post_id, version, part, render, vary_on=()):
+    """
+        Get a fragment of a post card from the cache, rendering and caching it on a miss.
+
+        Args:
+            post_id (int): The ID of the post.
+            version (int): The current version of the post's fragments.
+            part (str): The name of the cached part of the card.
+            render (callable): Renders the fragment.
+            vary_on (iterable): Further values the fragment depends on besides the post.
+
+        Returns:
+            str: The fragment's HTML.
+    """
+    timeout = settings.POST_CARD_CACHE_TIMEOUT
+    if not timeout:
+        return render()
+
+    key = get_fragment_key(post_id, version, part, vary_on)
+    html = cache.get(key)
+    if html is not None:
+        CACHE_REQUESTS.inc(cache="post_cards", result="hit")
+        return html
+
+    CACHE_REQUESTS.inc(cache="post_cards", result="miss")
+    html = render()
+    cache.set(key, html, timeout)
+    return html
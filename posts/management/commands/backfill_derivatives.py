@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from profiles.derivatives import AVATAR_SIZES, OCR_IMAGE_SIZES, POST_IMAGE_SIZES, generate_derivatives
+from profiles.models import OCRImage, Profile
+
+# (model, image field, derivative sizes) of every stored image with derivatives
+DERIVATIVE_SOURCES = {
+    "avatars": (Profile, "avatar", AVATAR_SIZES),
+    "posts": (Post, "image", POST_IMAGE_SIZES),
+    "ocr": (OCRImage, "uploaded_image", OCR_IMAGE_SIZES),
+    "ocr-segmented": (OCRImage, "fully_segmented_image", OCR_IMAGE_SIZES),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the missing resized derivatives of images uploaded before they were generated at upload time, so "
+        "pages stop serving the full-size originals or rendering derivatives on first view."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sources",
+            nargs="*",
+            choices=tuple(DERIVATIVE_SOURCES),
+            default=list(DERIVATIVE_SOURCES),
+            help="Images to backfill, all by default.",
+        )
+        parser.add_argument("--force", action="store_true", help="Render the existing derivatives again as well.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=max(settings.DERIVATIVE_WORKERS, 1),
+            help="Number of images rendered in parallel.",
+        )
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for source in options["sources"]:
+                model, field, sizes = DERIVATIVE_SOURCES[source]
+                images = model.objects.exclude(**{field: ""}).only("pk", field).order_by("pk")
+
+                # Distinct files only, e.g. every profile without an upload shares the default avatar
+                field_files = {}
+                for instance in images.iterator(chunk_size=500):
+                    field_file = getattr(instance, field)
+                    field_files.setdefault(field_file.name, field_file)
+
+                generated = sum(pool.map(
+                    lambda field_file: generate_derivatives(field_file, sizes, overwrite=options["force"]),
+                    field_files.values(),
+                ))
+                self.stdout.write(self.style.SUCCESS(
+                    f"{source}: rendered {generated} derivatives for {len(field_files)} images"
+                ))
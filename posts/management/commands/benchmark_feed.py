@@ -0,0 +1,112 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from posts.models import Post, TimelineEntry
+from posts.models_utils import fan_out_post, get_related_posts_queryset
+from posts.views_utils import POSTS_PAGE_SIZE
+from profiles.models import Profile
+from profiles.views_utils import encode_keyset_cursor, get_keyset_page
+
+
+def measure(function, repeat):
+    """
+        Run a function several times and measure it.
+
+        Args:
+            function (callable): The function to measure.
+            repeat (int): The number of runs.
+
+        Returns:
+            tuple: The median duration in milliseconds and the number of queries of the last run.
+    """
+    durations = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            function()
+            durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), len(queries)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the read and write costs of the query-time feed with the fan-out-on-write timeline for the profiles "
+        "with the largest friends and following graphs. Timelines have to be built first, see rebuild_timelines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", type=int, default=10, help="Number of profiles to benchmark.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the median is reported.")
+        parser.add_argument("--depth", type=int, default=20, help="Page number of the deep page read.")
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.annotate(
+            graph_size=Count("friends", distinct=True) + Count("following", distinct=True),
+        ).order_by("-graph_size")[:options["profiles"]]
+
+        results = {"query_first": [], "query_deep": [], "timeline_first": [], "timeline_deep": [], "fan_out": []}
+        for profile in profiles:
+            feed = get_related_posts_queryset(profile, profile.friends.all(), profile.following.all())
+            timeline = TimelineEntry.objects.filter(owner=profile)
+            feed_length = feed.count()
+            timeline_length = timeline.count()
+            if timeline_length != feed_length:
+                self.stderr.write(
+                    f"{profile}: the timeline has {timeline_length} entries but the feed {feed_length} posts, "
+                    f"run rebuild_timelines first."
+                )
+                continue
+
+            # Cursor of the last post before the deep page
+            depth_offset = (options["depth"] - 1) * POSTS_PAGE_SIZE - 1
+            feed_cursor = timeline_cursor = None
+            if feed_length > depth_offset >= 0:
+                feed_cursor = encode_keyset_cursor(feed.order_by("-created", "-pk")[depth_offset])
+                timeline_cursor = encode_keyset_cursor(timeline.order_by("-created", "-pk")[depth_offset])
+
+            pages = {
+                "query_first": lambda: get_keyset_page(feed, None, POSTS_PAGE_SIZE),
+                "timeline_first": lambda: Post.objects.get_timeline_page(profile, None, POSTS_PAGE_SIZE),
+            }
+            if feed_cursor:
+                pages["query_deep"] = lambda: get_keyset_page(feed, feed_cursor, POSTS_PAGE_SIZE)
+                pages["timeline_deep"] = lambda: Post.objects.get_timeline_page(
+                    profile, timeline_cursor, POSTS_PAGE_SIZE,
+                )
+
+            line = [f"{profile}: graph {profile.graph_size}, {feed_length} posts in feed"]
+            for name, page in pages.items():
+                duration, queries = measure(page, options["repeat"])
+                results[name].append(duration)
+                line.append(f"{name} {duration:.1f} ms/{queries}q")
+
+            # A post written by this profile, fanned out and rolled back so the benchmark leaves no data behind
+            with transaction.atomic():
+                post = Post.objects.bulk_create([Post(author=profile, content="benchmark_feed")])[0]
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    fan_out_post(post)
+                    fan_out_ms = (time.perf_counter() - start) * 1000
+                entries = TimelineEntry.objects.filter(post=post).count()
+                transaction.set_rollback(True)
+            results["fan_out"].append(fan_out_ms)
+            line.append(f"fan-out {fan_out_ms:.1f} ms/{len(queries)}q for {entries} entries")
+
+            self.stdout.write(", ".join(line))
+
+        if not results["query_first"]:
+            self.stdout.write("No profiles to benchmark.")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            "Median over profiles: "
+            + ", ".join(f"{name} {statistics.median(values):.1f} ms" for name, values in results.items() if values)
+        ))
+        self.stdout.write(
+            f"Timeline storage: {TimelineEntry.objects.count()} entries for {Post.objects.count()} posts"
+        )
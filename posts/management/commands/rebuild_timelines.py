@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import TimelineEntry
+from posts.models_utils import rebuild_timeline
+from profiles.models import Profile
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the materialized feed timelines from the friends and following relations. Run it after turning on "
+        "FEED_FANOUT_ON_WRITE, timelines are only maintained while the setting is on."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("slugs", nargs="*", help="Slugs of the profiles to rebuild, defaults to all profiles.")
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.order_by("pk")
+        if options["slugs"]:
+            profiles = profiles.filter(slug__in=options["slugs"])
+
+        rebuilt = 0
+        for profile in profiles.iterator():
+            # One transaction per profile, the feed of a profile is never read half rebuilt
+            with transaction.atomic():
+                rebuild_timeline(profile)
+            rebuilt += 1
+            self.stdout.write(f"{profile}: {TimelineEntry.objects.filter(owner=profile).count()} entries")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timelines."))
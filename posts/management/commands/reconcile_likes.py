@@ -0,0 +1,33 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from posts.models import Like
+from posts.models_utils import LEGACY_LIKED_TABLE, merge_legacy_likes
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge the legacy Post.liked table into the Like rows, which are now the only store of likes, and remove "
+        "duplicate likes. The migration that moves Post.liked onto Like runs the same merge, see the README, this "
+        "command repairs databases migrated without it and drops the legacy table. The legacy table wins where the "
+        "two stores disagree, it is what the pages displayed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drop-legacy", action="store_true", help="Drop the legacy table after merging it.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            result = merge_legacy_likes(Like, connection, drop_legacy=options["drop_legacy"])
+
+        self.stdout.write(f"Removed {result['duplicates']} duplicate likes.")
+        if result["legacy"]:
+            self.stdout.write(f"Added {result['added']} likes only stored in the legacy table.")
+            self.stdout.write(f"Removed {result['removed']} likes missing from the legacy table.")
+            if options["drop_legacy"]:
+                self.stdout.write(f"Dropped {LEGACY_LIKED_TABLE}.")
+        else:
+            self.stdout.write(f"No {LEGACY_LIKED_TABLE} table, the likes are already stored once.")
+
+        call_command("reconcile_post_counters", stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models_utils import get_drifted_post_counters, repair_post_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the stored like and comment counters of posts and repair the ones that drifted, e.g. after likes "
+        "were removed with a deleted profile, or to fill in the counters of existing posts after the migration that "
+        "adds them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of posts updated per query.")
+        parser.add_argument("--dry-run", action="store_true", help="Report the drifted posts without repairing them.")
+
+    def handle(self, *args, **options):
+        drifted = self.report(get_drifted_post_counters().iterator(chunk_size=options["batch_size"]))
+
+        if options["dry_run"]:
+            repaired = sum(1 for _ in drifted)
+        else:
+            with transaction.atomic():
+                repaired = repair_post_counters(drifted, batch_size=options["batch_size"])
+
+        verb = "Found" if options["dry_run"] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {repaired} posts with drifted counters."))
+
+    def report(self, drifted):
+        """
+            Write every drifted post to the output while passing it on.
+
+            Yields:
+                tuple: The drifted post rows, unchanged.
+        """
+        for row in drifted:
+            pk, like_count, actual_likes, comment_count, actual_comments = row
+            self.stdout.write(
+                f"Post #{pk}: likes {like_count} -> {actual_likes}, comments {comment_count} -> {actual_comments}"
+            )
+            yield row
@@ -1,10 +1,16 @@
+from django.conf import settings
 from django.core.validators import FileExtensionValidator
 from django.db import models
 
 from profiles.models import Profile
-from profiles.views_utils import get_request_user_profile
+from profiles.views_utils import get_keyset_page, get_request_user_profile
 
-from .models_utils import get_related_posts_queryset
+from .models_utils import (
+    get_profile_posts_queryset,
+    get_related_posts_queryset,
+    get_timeline_posts_queryset,
+    with_post_card_relations,
+)
 
 
 class PostManager(models.Manager):
@@ -22,6 +28,10 @@ class PostManager(models.Manager):
                 QuerySet: A queryset containing related posts.
         """
         profile = get_request_user_profile(user)
+
+        if settings.FEED_FANOUT_ON_WRITE:
+            return get_timeline_posts_queryset(profile)
+
         friends = profile.friends.all()
         following = profile.following.all()
 
@@ -29,6 +39,57 @@ class PostManager(models.Manager):
 
         return related_posts
 
+    def get_feed_page(self, user, cursor, page_size):
+        """
+            Retrieve one keyset-paginated page of the user's feed.
+
+            With FEED_FANOUT_ON_WRITE the page is a range scan over the user's timeline entries, followed by one
+            query for the posts of the page and the prefetches of their likes and comments.
+
+            Args:
+                user (User): The user whose feed is paginated.
+                cursor (str): The cursor of the previous page, empty for the first page.
+                page_size (int): The number of posts per page.
+
+            Returns:
+                tuple: A list with the posts of the page and the cursor of the next page (None on the last page).
+        """
+        if not settings.FEED_FANOUT_ON_WRITE:
+            return get_keyset_page(self.get_related_posts(user), cursor, page_size)
+
+        return self.get_timeline_page(get_request_user_profile(user), cursor, page_size)
+
+    def get_timeline_page(self, profile, cursor, page_size):
+        """
+            Retrieve one keyset-paginated page of a profile's materialized timeline.
+
+            Args:
+                profile (Profile): The owner of the timeline.
+                cursor (str): The cursor of the previous page, empty for the first page.
+                page_size (int): The number of posts per page.
+
+            Returns:
+                tuple: A list with the posts of the page and the cursor of the next page (None on the last page).
+        """
+        entries, next_cursor = get_keyset_page(
+            TimelineEntry.objects.filter(owner=profile).only("post_id", "created"), cursor, page_size,
+        )
+        posts = {post.pk: post for post in with_post_card_relations(self.filter(pk__in=[e.post_id for e in entries]))}
+
+        return [posts[entry.post_id] for entry in entries if entry.post_id in posts], next_cursor
+
+    def get_profile_posts(self, profile):
+        """
+            Retrieve a queryset of the posts written by a profile.
+
+            Args:
+                profile (Profile): The author of the posts.
+
+            Returns:
+                QuerySet: A queryset containing the profile's posts.
+        """
+        return get_profile_posts_queryset(profile)
+
 
 class Post(models.Model):
     """
@@ -41,9 +102,16 @@ class Post(models.Model):
         upload_to="posts",
         validators=[FileExtensionValidator(["png", "jpg", "jpeg"])],
     )
-    liked = models.ManyToManyField(Profile, blank=True, related_name="likes")
+    # Like rows are the only store of likes, this relation reads them. Existing databases need the hand-written
+    # migration described in the README.
+    liked = models.ManyToManyField(Profile, blank=True, related_name="likes", through="Like")
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="posts")
 
+    # Denormalized counters, updated with F() expressions by the like toggle and the comment signals. The
+    # reconcile_post_counters command repairs drift.
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
 
@@ -62,15 +130,18 @@ class Post(models.Model):
 
     def num_comments(self):
         """
-            Calculate the number of comments on the post.
+            Get the number of comments on the post from its stored counter.
 
             Returns:
                 int: The number of comments on the post.
         """
-        return self.comment_set.all().count()
+        return self.comment_count
 
     class Meta:
         ordering = ("-created",)
+        indexes = [
+            models.Index(fields=["author", "-created", "-id"], name="post_author_created_idx"),
+        ]
 
 
 class Comment(models.Model):
@@ -93,6 +164,11 @@ class Comment(models.Model):
         """
         return f"{self.profile} - {self.content}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "-created", "-id"], name="comment_post_created_idx"),
+        ]
+
 
 class Like(models.Model):
     """
@@ -112,3 +188,36 @@ class Like(models.Model):
                str: A string representation of the like.
        """
         return f"{self.profile} liked {self.post}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["profile", "post"], name="like_profile_post_unique"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """
+    Represents a post in the feed of a profile, written when the post is created (fan-out on write).
+    """
+    owner = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="timeline_entries")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+
+    # Copy of the post's creation time, so a page of the feed is read from this table's index alone
+    created = models.DateTimeField()
+
+    def __str__(self):
+        """
+            Returns a string representation of the timeline entry.
+
+            Returns:
+                str: A string representation of the timeline entry.
+        """
+        return f"{self.post} in the feed of {self.owner}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "post"], name="timelineentry_owner_post_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-created", "-id"], name="timeline_owner_created_idx"),
+        ]
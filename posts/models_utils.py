@@ -1,12 +1,23 @@
-from profiles.models import Profile
+from itertools import islice
+
+from django.db.models import Count, F, IntegerField, Min, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
+
+# Number of timeline entries inserted per query
+TIMELINE_BATCH_SIZE = 1000
+# Number of comments rendered with each post card, the older ones are loaded on demand
+LATEST_COMMENTS_PER_POST = 3
+# Table of the former Post.liked many-to-many relation, which stored every like a second time
+LEGACY_LIKED_TABLE = "posts_post_liked"
 
 
 def get_related_posts_queryset(profile, friends, following):
     """
         Generate a combined queryset of posts related to a given profile, their friends, and those they follow.
 
-        This function retrieves posts authored by the given profile, their friends, and profiles they follow,
-        creating a single queryset containing these posts sorted by their creation time.
+        The authors are resolved inside the database: the friends and following querysets are used as subqueries over
+        the many-to-many tables, so the feed is one query however large the social graph is. Authors and their users
+        are joined in, and the latest comments the feed renders are prefetched.
 
         Args:
             profile (Profile): The main profile for which related posts are to be fetched.
@@ -20,25 +31,325 @@ def get_related_posts_queryset(profile, friends, following):
 
     from .models import Post
 
-    unique_profiles = set()
-    querysets = []
-    post_pks = []
+    result = with_post_card_relations(Post.objects.filter(get_related_posts_filter(profile, friends, following)))
+
+    return result
+
+
+def get_related_posts_filter(profile, friends, following):
+    """
+        Build the condition selecting the posts of a profile, their friends, and those they follow.
+
+        Args:
+            profile (Profile): The main profile.
+            friends (QuerySet[User]): The main profile's friends.
+            following (QuerySet[User]): The users the main profile follows.
+
+        Returns:
+            Q: The condition on Post.
+    """
+    return Q(author=profile) | Q(author__user__in=friends) | Q(author__user__in=following)
+
+
+def get_profile_posts_queryset(profile):
+    """
+        Generate a queryset of the posts written by a profile, ready to be rendered as post cards.
+
+        Args:
+            profile (Profile): The author of the posts.
+
+        Returns:
+            QuerySet[Post]: The profile's posts ordered by creation time in descending order.
+    """
+
+    from .models import Post
+
+    return with_post_card_relations(Post.objects.filter(author=profile))
+
+
+def with_post_card_relations(queryset):
+    """
+        Join in the authors and their users and prefetch the latest comments a post card renders.
+
+        The latest LATEST_COMMENTS_PER_POST comments of every post are fetched with one windowed query as the
+        'latest_comments' list, newest first. Older comments are loaded on demand.
+
+        Args:
+            queryset (QuerySet[Post]): The posts to render.
+
+        Returns:
+            QuerySet[Post]: The queryset ordered by creation time in descending order.
+    """
+
+    from .models import Comment
+
+    latest_comments = Comment.objects.select_related("profile__user").order_by("-created", "-pk")
+
+    return (
+        queryset.select_related("author__user")
+        .prefetch_related(
+            Prefetch("comment_set", queryset=latest_comments[:LATEST_COMMENTS_PER_POST], to_attr="latest_comments"),
+        )
+        .order_by("-created", "-pk")
+    )
+
+
+def get_timeline_posts_queryset(profile):
+    """
+        Generate the feed of a profile from its materialized timeline entries.
+
+        Args:
+            profile (Profile): The owner of the timeline.
+
+        Returns:
+            QuerySet[Post]: The posts of the profile's timeline, ordered by creation time in descending order.
+    """
+
+    from .models import Post
+
+    return with_post_card_relations(Post.objects.filter(timeline_entries__owner=profile))
+
+
+def get_timeline_owner_ids(author):
+    """
+        Get the profiles whose feed shows the posts of an author: the author, their friends and their followers.
+
+        Args:
+            author (Profile): The author of the posts.
+
+        Returns:
+            set: The primary keys of the profiles.
+    """
+
+    from profiles.models import Profile
+
+    owner_ids = set(
+        Profile.objects.filter(Q(friends=author.user_id) | Q(following=author.user_id)).values_list("pk", flat=True)
+    )
+    owner_ids.add(author.pk)
+
+    return owner_ids
+
+
+def is_author_in_feed(owner, author):
+    """
+        Check whether the posts of an author belong in the feed of a profile.
+
+        Args:
+            owner (Profile): The profile whose feed is checked.
+            author (Profile): The author of the posts.
+
+        Returns:
+            bool: True if the author is the owner, a friend of the owner, or followed by the owner.
+    """
+    return (
+        owner.pk == author.pk
+        or owner.friends.filter(pk=author.user_id).exists()
+        or owner.following.filter(pk=author.user_id).exists()
+    )
+
+
+def create_timeline_entries(entries):
+    """
+        Insert timeline entries in batches, skipping the ones that already exist.
+
+        Args:
+            entries (iterable): (owner id, post id, post creation time) tuples, consumed lazily.
+    """
+
+    from .models import TimelineEntry
+
+    entries = iter(entries)
+    while True:
+        batch = [
+            TimelineEntry(owner_id=owner_id, post_id=post_id, created=created)
+            for owner_id, post_id, created in islice(entries, TIMELINE_BATCH_SIZE)
+        ]
+        if not batch:
+            break
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """
+        Add a new post to the timeline of its author and of everyone whose feed shows the author.
+
+        Args:
+            post (Post): The new post.
+    """
+    create_timeline_entries(
+        (owner_id, post.pk, post.created) for owner_id in get_timeline_owner_ids(post.author)
+    )
+
+
+def backfill_timeline(owner, author):
+    """
+        Add all posts of an author to the timeline of a profile that started seeing them.
+
+        Args:
+            owner (Profile): The profile that became a friend or follower of the author.
+            author (Profile): The author of the posts.
+    """
+
+    from .models import Post
+
+    posts = Post.objects.filter(author=author).values_list("pk", "created")
+    create_timeline_entries(
+        (owner.pk, post_id, created) for post_id, created in posts.iterator(chunk_size=TIMELINE_BATCH_SIZE)
+    )
+
+
+def prune_timeline(owner, author):
+    """
+        Remove the posts of an author from the timeline of a profile, unless the author is still in their feed
+        through another relationship, e.g. an unfollowed friend.
+
+        Args:
+            owner (Profile): The profile that stopped being a friend or follower of the author.
+            author (Profile): The author of the posts.
+    """
+
+    from .models import TimelineEntry
+
+    if not is_author_in_feed(owner, author):
+        TimelineEntry.objects.filter(owner=owner, post__author=author).delete()
+
+
+def rebuild_timeline(owner):
+    """
+        Replace the timeline of a profile with the posts of its query-time feed.
+
+        Args:
+            owner (Profile): The owner of the timeline.
+    """
+
+    from .models import Post, TimelineEntry
+
+    TimelineEntry.objects.filter(owner=owner).delete()
+    posts = Post.objects.filter(
+        get_related_posts_filter(owner, owner.friends.all(), owner.following.all()),
+    ).values_list("pk", "created").distinct()
+    create_timeline_entries(
+        (owner.pk, post_id, created) for post_id, created in posts.iterator(chunk_size=TIMELINE_BATCH_SIZE)
+    )
 
-    for user in friends:
-        unique_profiles.add(Profile.objects.get(user=user))
 
-    for user in following:
-        unique_profiles.add(Profile.objects.get(user=user))
+def count_subquery(queryset):
+    """
+        Turn a queryset of the rows referencing a post into a correlated subquery counting them.
+
+        Args:
+            queryset (QuerySet): The rows, filtered on post=OuterRef("pk").
+
+        Returns:
+            Coalesce: The number of rows, 0 when there are none.
+    """
+    counted = queryset.order_by().values("post").annotate(count=Count("pk")).values("count")
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def get_drifted_post_counters():
+    """
+        Get the posts whose stored like or comment counter differs from the number of their likes or comments.
+
+        Returns:
+            QuerySet: (pk, like_count, actual likes, comment_count, actual comments) tuples ordered by pk.
+    """
+
+    from .models import Comment, Like, Post
+
+    return (
+        Post.objects.annotate(
+            actual_likes=count_subquery(Like.objects.filter(post=OuterRef("pk"))),
+            actual_comments=count_subquery(Comment.objects.filter(post=OuterRef("pk"))),
+        )
+        .filter(~Q(like_count=F("actual_likes")) | ~Q(comment_count=F("actual_comments")))
+        .order_by("pk")
+        .values_list("pk", "like_count", "actual_likes", "comment_count", "actual_comments")
+    )
+
+
+def repair_post_counters(drifted, batch_size=1000):
+    """
+        Write the recounted like and comment counters of drifted posts, in batches.
+
+        Args:
+            drifted (iterable): (pk, like_count, actual likes, comment_count, actual comments) tuples, as returned by
+                get_drifted_post_counters.
+            batch_size (int): Number of posts updated per query.
+
+        Returns:
+            int: The number of repaired posts.
+    """
+
+    from .models import Post
+
+    repaired = 0
+    batch = []
+    for pk, _, actual_likes, _, actual_comments in drifted:
+        batch.append(Post(pk=pk, like_count=actual_likes, comment_count=actual_comments))
+        if len(batch) >= batch_size:
+            Post.objects.bulk_update(batch, ["like_count", "comment_count"])
+            repaired += len(batch)
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, ["like_count", "comment_count"])
+        repaired += len(batch)
+    return repaired
+
+
+def merge_legacy_likes(like_model, connection, drop_legacy=False):
+    """
+        Merge the legacy Post.liked table into the Like rows and remove duplicate likes.
+
+        The legacy table wins where the two stores disagree, it is what the pages displayed. Takes the model and the
+        connection as arguments so that a migration can call it with its historical Like model, see the README.
+
+        Args:
+            like_model (Model): The Like model.
+            connection (BaseDatabaseWrapper): The connection of the database to merge.
+            drop_legacy (bool): Whether to drop the legacy table after merging it.
+
+        Returns:
+            dict: The number of 'duplicates' removed, of likes 'added' from and 'removed' for missing from the legacy
+            table, and whether there was a 'legacy' table at all.
+    """
+    result = {"duplicates": 0, "added": 0, "removed": 0, "legacy": False}
 
-    querysets.append(profile.posts.all())
+    for duplicate in (
+        like_model.objects.using(connection.alias).values("profile", "post")
+        .annotate(likes=Count("pk"), first=Min("pk"))
+        .filter(likes__gt=1)
+        .order_by()
+    ):
+        like_model.objects.using(connection.alias).filter(
+            profile=duplicate["profile"], post=duplicate["post"],
+        ).exclude(pk=duplicate["first"]).delete()
+        result["duplicates"] += duplicate["likes"] - 1
 
-    for unique_profile in unique_profiles:
-        querysets.append(unique_profile.posts.all())
+    if LEGACY_LIKED_TABLE not in connection.introspection.table_names():
+        return result
+    result["legacy"] = True
 
-    for queryset in querysets:
-        for post in queryset:
-            post_pks.append(post.pk)
+    like_table = connection.ops.quote_name(like_model._meta.db_table)
+    legacy_table = connection.ops.quote_name(LEGACY_LIKED_TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {like_table} (profile_id, post_id, created, updated) "
+            f"SELECT legacy.profile_id, legacy.post_id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP "
+            f"FROM {legacy_table} legacy WHERE NOT EXISTS ("
+            f"SELECT 1 FROM {like_table} likes "
+            f"WHERE likes.profile_id = legacy.profile_id AND likes.post_id = legacy.post_id)"
+        )
+        result["added"] = cursor.rowcount
 
-    result = Post.objects.filter(pk__in=post_pks).order_by("-created")
+        cursor.execute(
+            f"DELETE FROM {like_table} WHERE NOT EXISTS ("
+            f"SELECT 1 FROM {legacy_table} legacy "
+            f"WHERE legacy.profile_id = {like_table}.profile_id AND legacy.post_id = {like_table}.post_id)"
+        )
+        result["removed"] = cursor.rowcount
 
+        if drop_legacy:
+            cursor.execute(f"DROP TABLE {legacy_table}")
     return result
@@ -0,0 +1,187 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from leopardnotes.storage import get_replaced_files, release_files
+from profiles.derivatives import POST_IMAGE_SIZES, schedule_derivatives
+from profiles.models import Profile
+
+from .card_cache import bump_post_card_version
+from .models import Comment, Post
+from .models_utils import backfill_timeline, fan_out_post, prune_timeline
+
+
+def get_feed_relation_pairs(instance, reverse, pk_set):
+    """
+        Get the (owner, author) pairs of a change to the friends or following relation of profiles.
+
+        Args:
+            instance (Profile | User): The profile whose relation changed, or the user added to or removed from the
+                relation of other profiles.
+            reverse (bool): Whether the change was made from the User side.
+            pk_set (set): The primary keys of the added or removed objects.
+
+        Returns:
+            list: (owner profile, author profile) tuples, the owner's feed gains or loses the author's posts.
+    """
+    if reverse:
+        author = Profile.objects.get(user=instance)
+        return [(owner, author) for owner in Profile.objects.filter(pk__in=pk_set)]
+    return [(instance, author) for author in Profile.objects.filter(user__in=pk_set)]
+
+
+@receiver(post_save, sender=Post)
+def post_save_fan_out_post(sender, instance, created, **kwargs):
+    """
+        Write a new post to the timelines of everyone whose feed shows its author when FEED_FANOUT_ON_WRITE is on,
+        and invalidate the cached card of an edited post.
+
+        Args:
+            sender (Model): The sender model class (Post).
+            instance (Post): The Post instance being saved.
+            created (bool): Indicates whether the instance was newly created.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    if not created:
+        bump_post_card_version(instance.pk)
+    elif settings.FEED_FANOUT_ON_WRITE:
+        fan_out_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_save_generate_post_image_derivatives(sender, instance, update_fields, **kwargs):
+    """
+        Render the width-bounded derivatives of a post's image when it has none yet.
+
+        Args:
+            sender (Model): The sender model class (Post).
+            instance (Post): The Post instance being saved.
+            update_fields (frozenset): The fields saved, None if all fields were saved.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    if update_fields is None or "image" in update_fields:
+        schedule_derivatives(instance.image, POST_IMAGE_SIZES, overwrite=False)
+
+
+@receiver(pre_save, sender=Post)
+def pre_save_find_replaced_image(sender, instance, update_fields, **kwargs):
+    """
+        Remember the stored image that saving a post replaces, it is released once the post is saved.
+
+        Args:
+            sender (Model): The sender model class (Post).
+            instance (Post): The Post instance being saved.
+            update_fields (frozenset): The fields saved, None if all fields are saved.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    instance._replaced_files = get_replaced_files(instance, ("image",), update_fields)
+
+
+@receiver(post_save, sender=Post)
+def post_save_release_replaced_image(sender, instance, **kwargs):
+    """
+        Release the stored image replaced by saving a post, once the save is committed.
+
+        Args:
+            sender (Model): The sender model class (Post).
+            instance (Post): The Post instance saved.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    release_files(getattr(instance, "_replaced_files", ()))
+    instance._replaced_files = []
+
+
+@receiver(post_delete, sender=Post)
+def post_delete_release_image(sender, instance, **kwargs):
+    """
+        Release the stored image of a deleted post, once the delete is committed.
+
+        Args:
+            sender (Model): The sender model class (Post).
+            instance (Post): The deleted Post instance.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    release_files([instance.image])
+
+
+@receiver(m2m_changed, sender=Profile.friends.through)
+@receiver(m2m_changed, sender=Profile.following.through)
+def m2m_changed_update_timelines(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+        Backfill or prune timelines when profiles become or stop being friends, or follow or unfollow each other.
+
+        Args:
+            sender (Model): The through model of Profile.friends or Profile.following.
+            instance (Profile | User): The instance whose relation changed.
+            action (str): The kind of change, only "post_add" and "post_remove" are handled.
+            reverse (bool): Whether the change was made from the User side.
+            model (Model): The model of the added or removed objects.
+            pk_set (set): The primary keys of the added or removed objects.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    if not settings.FEED_FANOUT_ON_WRITE or action not in ("post_add", "post_remove") or not pk_set:
+        return
+
+    for owner, author in get_feed_relation_pairs(instance, reverse, pk_set):
+        if action == "post_add":
+            backfill_timeline(owner, author)
+        else:
+            prune_timeline(owner, author)
+
+
+@receiver(post_save, sender=Comment)
+def post_save_increment_comment_count(sender, instance, created, **kwargs):
+    """
+        Increment the stored comment counter of a post when a comment is created, and invalidate the cached card
+        of the post.
+
+        Args:
+            sender (Model): The sender model class (Comment).
+            instance (Comment): The Comment instance being saved.
+            created (bool): Indicates whether the instance was newly created.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(comment_count=F("comment_count") + 1)
+    bump_post_card_version(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def post_delete_decrement_comment_count(sender, instance, **kwargs):
+    """
+        Decrement the stored comment counter of a post when a comment is deleted, and invalidate the cached card
+        of the post. The counter never goes below 0, even when it drifted below the number of comments.
+
+        Args:
+            sender (Model): The sender model class (Comment).
+            instance (Comment): The Comment instance being deleted.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    Post.objects.filter(pk=instance.post_id).update(comment_count=Greatest(F("comment_count") - 1, 0))
+    bump_post_card_version(instance.post_id)
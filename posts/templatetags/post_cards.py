@@ -0,0 +1,59 @@
+from django import template
+
+from posts.card_cache import get_cached_fragment, get_commenters_key, get_post_card_versions
+
+register = template.Library()
+
+
+class PostCardCacheNode(template.Node):
+    def __init__(self, nodelist, post, part, vary_on):
+        self.nodelist = nodelist
+        self.post = post
+        self.part = part
+        self.vary_on = vary_on
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        part = self.part.resolve(context)
+        vary_on = [value.resolve(context) for value in self.vary_on]
+
+        # prepare_post_cards looks up the versions of a whole page at once
+        version = getattr(post, "card_version", None)
+        if version is None:
+            version = get_post_card_versions([post.pk])[post.pk]
+
+        return get_cached_fragment(post.pk, version, part, lambda: self.nodelist.render(context), vary_on)
+
+
+@register.tag
+def postcardcache(parser, token):
+    """
+        Cache the enclosed viewer-independent part of a post card until the post, its comments or the timeout
+        change it, e.g. {% postcardcache post "feed-body" %}...{% endpostcardcache %}.
+
+        Further arguments are values the part also depends on, like the vary_on arguments of Django's cache tag,
+        e.g. {% postcardcache post "comments" post.latest_comments|commenters_key %}.
+
+        The enclosed part must not depend on the viewer and must not contain CSRF tokens.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a post and the name of the cached part")
+
+    nodelist = parser.parse(("endpostcardcache",))
+    parser.delete_first_token()
+
+    return PostCardCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
+
+
+@register.filter
+def commenters_key(comments):
+    """
+        Vary a cached comments fragment on the names and avatars of its commenters, see get_commenters_key.
+    """
+    return get_commenters_key(comments)
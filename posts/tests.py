@@ -0,0 +1,34 @@
+from django.test import TestCase
+
+from leopardnotes.testing import TemporaryMediaMixin, make_posts, make_profiles, query_budget
+
+
+class PostQueryBudgetTests(TemporaryMediaMixin, TestCase):
+    """
+        Check that the post lists run a constant number of queries as the feed grows.
+    """
+
+    def setUp(self):
+        self.profile = make_profiles(1, prefix="viewer")[0]
+        self.client.force_login(self.profile.user)
+
+    def add_feed_posts(self, size):
+        """
+            Add a friend, a followed profile and their posts, commented and liked by others, to the viewer's feed.
+        """
+        friend, followed = make_profiles(2, prefix="author")
+        self.profile.friends.add(friend.user)
+        self.profile.following.add(followed.user)
+
+        likers = make_profiles(3, prefix="liker")
+        make_posts(friend, size, likers=likers)
+        make_posts(followed, size, likers=likers)
+        make_posts(self.profile, size, likers=likers)
+
+    @query_budget("posts:main-post-view")
+    def test_main_post_view_queries(self, size):
+        self.add_feed_posts(size)
+
+    @query_budget("posts:post-page-view")
+    def test_post_page_view_queries(self, size):
+        self.add_feed_posts(size)
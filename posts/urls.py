@@ -4,7 +4,12 @@ from .views import (
     CommentDeleteView,
     PostDeleteView,
     PostUpdateView,
+    comment_create_view,
+    like_state_view,
     post_comment_create_and_list_view,
+    post_comments_view,
+    post_create_view,
+    post_page_view,
     switch_like,
 )
 
@@ -12,7 +17,12 @@ app_name = "posts"
 
 urlpatterns = [
     path("", post_comment_create_and_list_view, name="main-post-view"),
+    path("page/", post_page_view, name="post-page-view"),
+    path("create/", post_create_view, name="post-create-view"),
+    path("comments/create/", comment_create_view, name="comment-create-view"),
     path("like/", switch_like, name="switch-like-view"),
+    path("likes/", like_state_view, name="like-state-view"),
+    path("<int:pk>/comments/", post_comments_view, name="post-comments-view"),
     path("<pk>/delete/", PostDeleteView.as_view(), name="post-delete"),
     path("<pk>/update/", PostUpdateView.as_view(), name="post-update"),
     path("comments/<pk>/delete/", CommentDeleteView.as_view(), name="comment-delete"),
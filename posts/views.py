@@ -2,19 +2,26 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import HttpResponseRedirect, JsonResponse
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.views.generic import DeleteView, UpdateView
 
-from profiles.views_utils import get_request_user_profile, redirect_back
+from profiles.models import Profile
+from profiles.views_utils import get_keyset_page, get_request_user_profile, redirect_back
 
 from .forms import CommentCreateModelForm, PostCreateModelForm, PostUpdateModelForm
 from .models import Comment, Post
 from .views_utils import (
+    COMMENTS_PAGE_SIZE,
+    LIKE_STATE_MAX_POSTS,
+    POSTS_PAGE_SIZE,
     add_comment_if_submitted,
     add_post_if_submitted,
     get_post_id_and_post_obj,
+    get_like_states,
     like_unlike_post,
+    prepare_post_cards,
 )
 
 
@@ -25,6 +32,8 @@ def post_comment_create_and_list_view(request):
 
         This view function displays the user's posts and provides forms to create comments on those posts.
         It also handles the submission of new posts and comments, redirecting back to the main page after submission.
+        Only the first page of posts is rendered, the following pages are keyset-paginated on (created, id) and
+        loaded by post_page_view while scrolling.
 
         Args:
             request (HttpRequest): The incoming HTTP request object.
@@ -32,7 +41,6 @@ def post_comment_create_and_list_view(request):
         Returns:
             HttpResponse: A rendered HTML response containing user's posts and comment forms.
     """
-    qs = Post.objects.get_related_posts(user=request.user)
     profile = get_request_user_profile(request.user)
 
     p_form = PostCreateModelForm()
@@ -44,9 +52,13 @@ def post_comment_create_and_list_view(request):
     if add_comment_if_submitted(request, profile):
         return redirect_back(request)
 
+    posts, next_cursor = Post.objects.get_feed_page(request.user, request.GET.get("after"), POSTS_PAGE_SIZE)
+
     context = {
-        "qs": qs,
+        "qs": prepare_post_cards(posts, profile),
+        "next_cursor": next_cursor,
         "profile": profile,
+        "request_user_profile": profile,
         "p_form": p_form,
         "c_form": c_form,
     }
@@ -54,13 +66,128 @@ def post_comment_create_and_list_view(request):
     return render(request, "posts/main.html", context)
 
 
+@login_required
+def post_page_view(request):
+    """
+        Return the next page of a post list for infinite scrolling.
+
+        Without a 'profile' parameter the page is taken from the user's feed, otherwise from the posts of the profile
+        with that slug. The page starts after the 'after' cursor of the previous page.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object.
+
+        Returns:
+            JsonResponse: JSON response containing the rendered post cards as html and the next_cursor, which is
+            null on the last page.
+    """
+    cursor = request.GET.get("after")
+    author_slug = request.GET.get("profile")
+    if author_slug:
+        author = get_object_or_404(Profile, slug=author_slug)
+        posts, next_cursor = get_keyset_page(Post.objects.get_profile_posts(author), cursor, POSTS_PAGE_SIZE)
+        card_template = "posts/_profile_post_card.html"
+    else:
+        posts, next_cursor = Post.objects.get_feed_page(request.user, cursor, POSTS_PAGE_SIZE)
+        card_template = "posts/_post_card.html"
+
+    profile = get_request_user_profile(request.user)
+
+    context = {
+        "posts": prepare_post_cards(posts, profile),
+        "card_template": card_template,
+        "request_user_profile": profile,
+        "c_form": CommentCreateModelForm(),
+    }
+    html = render_to_string("posts/_post_list.html", context, request=request)
+
+    return JsonResponse({"html": html, "next_cursor": next_cursor})
+
+
+@login_required
+def post_create_view(request):
+    """
+        Create a post and return only its rendered card.
+
+        Lets the feed add a post without a redirect and a re-render of the whole feed.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object with the post form data.
+
+        Returns:
+            JsonResponse: JSON response containing the post card as html and the post_id, or an error message with the
+            form errors.
+    """
+    if request.method == "POST":
+        profile = get_request_user_profile(request.user)
+        p_form = PostCreateModelForm(request.POST, request.FILES)
+
+        if not p_form.is_valid():
+            return JsonResponse({"error": "Invalid post", "errors": p_form.errors.get_json_data()}, status=400)
+
+        post = p_form.save(commit=False)
+        post.author = profile
+        post.save()
+
+        # A new post has no likes or comments, the card needs no queries for them
+        post.liked_by_me = False
+        post.latest_comments = []
+        post.older_comments_cursor = None
+
+        context = {
+            "post": post,
+            "request_user_profile": profile,
+            "c_form": CommentCreateModelForm(),
+        }
+        html = render_to_string("posts/_post_card.html", context, request=request)
+
+        return JsonResponse({"html": html, "post_id": post.pk})
+
+    return JsonResponse({"error": "Invalid request"}, status=405)
+
+
+@login_required
+def comment_create_view(request):
+    """
+        Create a comment on a post and return only the rendered comment.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object with the comment form data and the post_id.
+
+        Returns:
+            JsonResponse: JSON response containing the comment as html and the new comment_count of the post, or an
+            error message.
+    """
+    if request.method == "POST":
+        post = Post.objects.filter(pk=request.POST.get("post_id")).first()
+        if post is None:
+            return JsonResponse({"error": "Post not found"}, status=404)
+
+        c_form = CommentCreateModelForm(request.POST)
+        if not c_form.is_valid():
+            return JsonResponse({"error": "Invalid comment", "errors": c_form.errors.get_json_data()}, status=400)
+
+        comment = c_form.save(commit=False)
+        comment.profile = get_request_user_profile(request.user)
+        comment.post = post
+        comment.save()
+
+        post.refresh_from_db(fields=["comment_count"])
+        html = render_to_string("posts/_comment.html", {"c": comment}, request=request)
+
+        return JsonResponse({"html": html, "comment_count": post.comment_count})
+
+    return JsonResponse({"error": "Invalid request"}, status=405)
+
+
 @login_required
 def switch_like(request):
     """
         Add or remove a like to/from a post
 
         This view function processes a POST request to add or remove a like from a post. It returns a JSON
-        response indicating the total number of likes and whether a like was added or removed.
+        response indicating the total number of likes and whether a like was added or removed. An optional 'action'
+        of "like" or "unlike" sets the state instead of toggling it, so repeated requests have the same effect.
 
         Args:
             request (HttpRequest): The incoming HTTP request object.
@@ -72,14 +199,71 @@ def switch_like(request):
         post_id, post_obj = get_post_id_and_post_obj(request)
         profile = get_request_user_profile(request.user)
 
-        like_added = like_unlike_post(profile, post_id, post_obj)
+        action = request.POST.get("action") or None
+        if action not in (None, "like", "unlike"):
+            return JsonResponse({"error": "Invalid like action"}, status=400)
+
+        like_added = like_unlike_post(profile, post_id, post_obj, action)
+        post_obj.refresh_from_db(fields=["like_count"])
 
     # Return JSON response for AJAX script in like.js
     return JsonResponse(
-        {"total_likes": post_obj.liked.count(), "like_added": like_added},
+        {"total_likes": post_obj.like_count, "like_added": like_added},
     )
 
 
+@login_required
+def like_state_view(request):
+    """
+        Return the like counters of several posts and whether the user liked them.
+
+        Lets like.js refresh the like buttons of every post on the page in one request, e.g. when the page is shown
+        again from the browser's cache.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object, with the post IDs as a comma-separated 'ids'
+                parameter.
+
+        Returns:
+            JsonResponse: JSON response mapping each existing post ID to its 'liked' state and 'like_count'.
+    """
+    try:
+        post_ids = [int(post_id) for post_id in request.GET.get("ids", "").split(",") if post_id]
+    except ValueError:
+        return JsonResponse({"error": "Invalid post ids"}, status=400)
+
+    if len(post_ids) > LIKE_STATE_MAX_POSTS:
+        return JsonResponse({"error": f"At most {LIKE_STATE_MAX_POSTS} posts per request"}, status=400)
+
+    profile = get_request_user_profile(request.user)
+
+    return JsonResponse({"posts": get_like_states(profile, post_ids)})
+
+
+@login_required
+def post_comments_view(request, pk):
+    """
+        Return a page of the comments of a post, older than the comments already shown.
+
+        Args:
+            request (HttpRequest): The incoming HTTP request object, with the cursor of the oldest shown comment as
+                'after'.
+            pk (int): The primary key of the post.
+
+        Returns:
+            JsonResponse: JSON response containing the rendered comments, oldest first, as html and the next_cursor,
+            which is null when there are no older comments.
+    """
+    post = get_object_or_404(Post, pk=pk)
+
+    queryset = Comment.objects.filter(post=post).select_related("profile__user")
+    comments, next_cursor = get_keyset_page(queryset, request.GET.get("after"), COMMENTS_PAGE_SIZE)
+
+    html = render_to_string("posts/_comment_list.html", {"comments": reversed(comments)}, request=request)
+
+    return JsonResponse({"html": html, "next_cursor": next_cursor})
+
+
 class PostDeleteView(LoginRequiredMixin, DeleteView):
     """
         Delete a post by its primary key.
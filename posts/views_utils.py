@@ -1,6 +1,21 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.functions import Greatest
+
+from profiles.views_utils import encode_keyset_cursor
+
+from .card_cache import get_post_card_versions
 from .forms import CommentCreateModelForm, PostCreateModelForm
 from .models import Like, Post
 
+# Number of posts rendered per page of the feed and of the profile pages
+POSTS_PAGE_SIZE = 10
+# Maximum number of posts whose like state is returned by one like_state_view request
+LIKE_STATE_MAX_POSTS = 100
+# Number of older comments returned per request of post_comments_view
+COMMENTS_PAGE_SIZE = 20
+
 
 def add_post_if_submitted(request, profile):
     """
@@ -68,31 +83,121 @@ def get_post_id_and_post_obj(request):
     return post_id, post_obj
 
 
-def like_unlike_post(profile, post_id, post_obj):
+def like_unlike_post(profile, post_id, post_obj, action=None):
     """
         Handle liking or unliking a post by a user.
 
+        Likes are stored once, as Like rows with a unique (profile, post) pair. A toggle tries to delete the like and
+        inserts it when there was nothing to delete, the like counter of the post only moves when a row did.
+
         Args:
             profile (Profile): The user profile performing the like/unlike action.
             post_id (str): The ID of the post being liked/unliked.
             post_obj (Post): The Post object being liked/unliked.
+            action (str, optional): "like" or "unlike" to set the state idempotently, e.g. for a repeated click,
+                toggles the like when omitted.
+
+        Returns:
+            bool: True if the post is liked by the profile afterwards, False otherwise.
+    """
+    if action not in (None, "like", "unlike"):
+        raise ValueError(f"Unknown like action: {action}")
+
+    with transaction.atomic():
+        change = 0
+        liked = False
+
+        if action != "like":
+            deleted, _ = Like.objects.filter(profile=profile, post_id=post_id).delete()
+            change -= deleted
+
+        if action == "like" or (action is None and not deleted):
+            try:
+                # A concurrent request may have inserted the same like, the savepoint keeps the transaction usable
+                with transaction.atomic():
+                    Like.objects.create(profile=profile, post_id=post_id)
+                change += 1
+            except IntegrityError:
+                pass
+            liked = True
+
+        if change:
+            # Clamped, a counter that drifted below the number of likes must not fail the unlike
+            Post.objects.filter(pk=post_obj.pk).update(like_count=Greatest(F("like_count") + change, 0))
+
+    return liked
+
+
+def set_liked_by_me(posts, profile):
+    """
+        Mark which posts of a page the viewing profile liked, with one query for the whole page.
+
+        Args:
+            posts (list): The Post objects of the page.
+            profile (Profile): The viewing profile.
 
         Returns:
-            bool: True if the like was added, False if it was removed.
+            list: The same posts, each with a 'liked_by_me' boolean attribute.
     """
-    if profile in post_obj.liked.all():
-        post_obj.liked.remove(profile)
-        like_added = False
-    else:
-        post_obj.liked.add(profile)
-        like_added = True
+    liked_ids = set(
+        Like.objects.filter(profile=profile, post_id__in=[post.pk for post in posts]).values_list("post_id", flat=True)
+    )
+    for post in posts:
+        post.liked_by_me = post.pk in liked_ids
+    return posts
 
-    like, created = Like.objects.get_or_create(profile=profile, post_id=post_id)
 
-    if not created:
-        like.delete()
-    else:
-        like.save()
-        post_obj.save()
+def set_older_comments_cursor(posts):
+    """
+        Set the cursor from which the comments older than the prefetched latest comments of each post are loaded.
+
+        Args:
+            posts (list): The Post objects of the page, with their 'latest_comments' prefetched.
 
-    return like_added
+        Returns:
+            list: The same posts, each with an 'older_comments_cursor' attribute, None if every comment is shown.
+    """
+    for post in posts:
+        shown = post.latest_comments
+        has_older = shown and post.comment_count > len(shown)
+        post.older_comments_cursor = encode_keyset_cursor(shown[-1]) if has_older else None
+    return posts
+
+
+def prepare_post_cards(posts, profile):
+    """
+        Add the per-viewer and per-page state the post card templates render to a page of posts, and the versions of
+        their cached card fragments.
+
+        Args:
+            posts (list): The Post objects of the page.
+            profile (Profile): The viewing profile.
+
+        Returns:
+            list: The same posts.
+    """
+    set_liked_by_me(posts, profile)
+    set_older_comments_cursor(posts)
+
+    if settings.POST_CARD_CACHE_TIMEOUT:
+        versions = get_post_card_versions([post.pk for post in posts])
+        for post in posts:
+            post.card_version = versions[post.pk]
+    return posts
+
+
+def get_like_states(profile, post_ids):
+    """
+        Get the like counters of posts and whether the viewing profile liked them.
+
+        Args:
+            profile (Profile): The viewing profile.
+            post_ids (list): The IDs of the posts.
+
+        Returns:
+            dict: {post id: {'liked': bool, 'like_count': int}} for the posts that exist.
+    """
+    posts = Post.objects.filter(pk__in=post_ids).annotate(
+        liked_by_me=Exists(Like.objects.filter(profile=profile, post=OuterRef("pk"))),
+    ).values_list("pk", "like_count", "liked_by_me")
+    return {pk: {"liked": liked_by_me, "like_count": like_count} for pk, like_count, liked_by_me in posts}
@@ -0,0 +1,226 @@
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.functional import cached_property
+from PIL import Image, ImageOps, features
+
+from leopardnotes.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Bounding box (width, height) of every derivative size, images are scaled down to fit and never up
+DERIVATIVE_SIZES = {
+    "thumb": (160, 160),
+    "preview": (640, 1280),
+    "avatar": (96, 96),
+    "avatar_large": (400, 400),
+    "post": (800, 4000),
+    "post_2x": (1600, 8000),
+}
+# Sizes cropped to fill their whole box, avatars are always square
+CROPPED_SIZES = {"avatar", "avatar_large"}
+
+OCR_IMAGE_SIZES = ("thumb", "preview")
+# "avatar" covers the 35px avatar circles at high density, "avatar_large" the profile pictures
+AVATAR_SIZES = ("avatar", "avatar_large")
+# Post images are bounded by width only, at 1x and 2x of the feed column
+POST_IMAGE_SIZES = ("post", "post_2x")
+
+DERIVATIVE_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+DERIVATIVE_EXTENSION = "webp" if DERIVATIVE_FORMAT == "WEBP" else "jpg"
+DERIVATIVE_QUALITY = 80
+
+_derivative_executor = None
+_derivative_executor_lock = threading.Lock()
+
+
+class DerivativeStorage(FileSystemStorage):
+    """
+        Storage of the derivatives, in the derivatives/ directory of MEDIA_ROOT.
+
+        The location follows the MEDIA_ROOT and MEDIA_URL settings, so tests overriding them keep their derivatives
+        in their own media directory.
+    """
+
+    @cached_property
+    def base_location(self):
+        return os.path.join(settings.MEDIA_ROOT, "derivatives")
+
+    @cached_property
+    def base_url(self):
+        return f"{settings.MEDIA_URL}derivatives/"
+
+
+derivative_storage = DerivativeStorage()
+
+
+def get_derivative_name(source_name, size):
+    """
+        Get the storage name of a derivative of a stored image.
+
+        Args:
+            source_name (str): The storage name of the original image.
+            size (str): A key of DERIVATIVE_SIZES.
+
+        Returns:
+            str: The name of the derivative inside the derivative storage.
+    """
+    root, _ = os.path.splitext(source_name)
+    return f"{size}/{root}.{DERIVATIVE_EXTENSION}"
+
+
+def generate_derivative(field_file, size):
+    """
+        Render a derivative of a stored image and write it to the derivative storage.
+
+        The file is written under a temporary name and moved into place, so concurrent requests never serve a
+        partially written derivative.
+
+        Args:
+            field_file (FieldFile): The original image.
+            size (str): A key of DERIVATIVE_SIZES.
+
+        Returns:
+            str: The name of the derivative inside the derivative storage.
+    """
+    name = get_derivative_name(field_file.name, size)
+    max_size = DERIVATIVE_SIZES[size]
+
+    with field_file.storage.open(field_file.name, "rb") as f:
+        image = Image.open(f)
+        # Let the JPEG decoder downscale while decoding instead of decoding the full resolution
+        image.draft("RGB", max_size)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+        if size in CROPPED_SIZES:
+            image = ImageOps.fit(image, max_size)
+        else:
+            image.thumbnail(max_size)
+
+    buffer = BytesIO()
+    image.save(buffer, DERIVATIVE_FORMAT, quality=DERIVATIVE_QUALITY)
+
+    path = derivative_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A unique temporary file per call, a request and the background pool may render the same derivative at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buffer.getvalue())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return name
+
+
+def generate_derivatives(field_file, sizes, overwrite=True):
+    """
+        Render derivatives of a stored image, e.g. right after it was uploaded.
+
+        Args:
+            field_file (FieldFile): The original image.
+            sizes (iterable): Keys of DERIVATIVE_SIZES.
+            overwrite (bool): Whether to render the derivatives that already exist again.
+
+        Returns:
+            int: The number of derivatives rendered.
+    """
+    if not field_file:
+        return 0
+
+    generated = 0
+    for size in sizes:
+        if not overwrite and derivative_storage.exists(get_derivative_name(field_file.name, size)):
+            continue
+        try:
+            generate_derivative(field_file, size)
+            generated += 1
+        except Exception:
+            logger.exception("Could not generate the %s derivative of %s", size, field_file.name)
+    return generated
+
+
+def get_derivative_executor():
+    """
+        Get the thread pool uploads' derivatives are rendered in, created in each process on first use.
+    """
+    global _derivative_executor
+    with _derivative_executor_lock:
+        if _derivative_executor is None:
+            _derivative_executor = ThreadPoolExecutor(
+                max_workers=settings.DERIVATIVE_WORKERS, thread_name_prefix="derivatives",
+            )
+    return _derivative_executor
+
+
+def _reset_after_fork():
+    # The worker threads of the pool are not copied into a forked child
+    global _derivative_executor, _derivative_executor_lock
+    _derivative_executor = None
+    _derivative_executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def schedule_derivatives(field_file, sizes, overwrite=True):
+    """
+        Render derivatives of an uploaded image once the current transaction commits, in the background pool or,
+        with DERIVATIVE_WORKERS set to 0, in the request itself.
+
+        Args:
+            field_file (FieldFile): The original image.
+            sizes (iterable): Keys of DERIVATIVE_SIZES.
+            overwrite (bool): Whether to render the derivatives that already exist again.
+    """
+    if not field_file:
+        return
+
+    def run():
+        if settings.DERIVATIVE_WORKERS:
+            get_derivative_executor().submit(generate_derivatives, field_file, sizes, overwrite)
+        else:
+            generate_derivatives(field_file, sizes, overwrite)
+
+    transaction.on_commit(run)
+
+
+def get_derivative_url(field_file, size):
+    """
+        Get the URL of a derivative of a stored image, rendering it on first request.
+
+        Derivatives are cached on disk, so only the first request of a size pays for the resize. If the
+        derivative cannot be rendered the URL of the original image is returned instead.
+
+        Args:
+            field_file (FieldFile): The original image.
+            size (str): A key of DERIVATIVE_SIZES.
+
+        Returns:
+            str: The URL of the derivative, or an empty string if there is no image.
+    """
+    if not field_file:
+        return ""
+
+    name = get_derivative_name(field_file.name, size)
+    if derivative_storage.exists(name):
+        CACHE_REQUESTS.inc(cache="derivatives", result="hit")
+    else:
+        CACHE_REQUESTS.inc(cache="derivatives", result="miss")
+        try:
+            generate_derivative(field_file, size)
+        except Exception:
+            logger.exception("Could not generate the %s derivative of %s", size, field_file.name)
+            return field_file.url
+
+    return derivative_storage.url(name)
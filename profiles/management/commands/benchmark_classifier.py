@@ -0,0 +1,91 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from leopardnotes.classify import get_math_score
+from leopardnotes.views import load_segment_image, run_ocr_engine
+from profiles.models import OCRSegment
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the text-vs-math region classifier against the OCR types stored for existing segments: how many "
+        "segments it keeps off the LaTeX model and how much OCR time that saves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=500, help="Number of most recent segments to classify.")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=None,
+            help="Math score from which a region is math, defaults to the OCR_MATH_THRESHOLD setting.",
+        )
+
+    def handle(self, *args, **options):
+        threshold = settings.OCR_MATH_THRESHOLD if options["threshold"] is None else options["threshold"]
+        segments = OCRSegment.objects.select_related("ocr_image").order_by("-pk")[:options["limit"]]
+
+        confusion = {(chosen, predicted): 0 for chosen in ("text", "math") for predicted in ("text", "math")}
+        classify_ms = []
+        prepasses = 0
+        chosen_ms = predicted_ms = 0.0
+        failed = 0
+
+        for segment in segments.iterator():
+            try:
+                region = load_segment_image(segment)
+            except Exception as e:
+                self.stderr.write(f"Segment #{segment.pk} could not be loaded: {e}")
+                failed += 1
+                continue
+
+            start = time.perf_counter()
+            score, used_prepass = get_math_score(region)
+            classify_ms.append((time.perf_counter() - start) * 1000)
+            prepasses += used_prepass
+
+            predicted = "math" if score >= threshold else "text"
+            confusion[(segment.ocr_type, predicted)] += 1
+
+            # The stored elapsed time is the cost of the chosen engine, run the other engine when the labels differ
+            chosen_ms += segment.elapsed_ms
+            if predicted == segment.ocr_type:
+                predicted_ms += segment.elapsed_ms
+            else:
+                predicted_ms += run_ocr_engine(region, predicted)[2]
+
+        total = len(classify_ms)
+        if not total:
+            self.stdout.write("No segments to benchmark.")
+            return
+
+        chosen_math = confusion[("math", "text")] + confusion[("math", "math")]
+        predicted_math = confusion[("text", "math")] + confusion[("math", "math")]
+        kept_off = confusion[("math", "text")]
+        agreement = confusion[("text", "text")] + confusion[("math", "math")]
+        classify_total_ms = sum(classify_ms)
+        saved_ms = chosen_ms - (predicted_ms + classify_total_ms)
+
+        self.stdout.write(f"Segments classified: {total} ({failed} failed to load), threshold {threshold:.2f}")
+        self.stdout.write(f"Agreement with stored OCR types: {agreement / total:.1%}")
+        self.stdout.write(
+            "Confusion (stored -> predicted): "
+            + ", ".join(f"{chosen}->{predicted}: {count}" for (chosen, predicted), count in confusion.items())
+        )
+        self.stdout.write(f"Math share: {chosen_math / total:.1%} stored, {predicted_math / total:.1%} predicted")
+        self.stdout.write(
+            f"Kept off the math model: {kept_off} segments ({kept_off / total:.1%} of all, "
+            f"{kept_off / max(chosen_math, 1):.1%} of stored math)"
+        )
+        self.stdout.write(
+            f"Classifier: {classify_total_ms / total:.1f} ms/segment mean, "
+            f"{sorted(classify_ms)[min(total - 1, int(total * 0.95))]:.1f} ms p95, "
+            f"tesseract pre-pass on {prepasses / total:.1%} of segments"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"OCR time: {chosen_ms / 1000:.1f}s with stored types, "
+            f"{(predicted_ms + classify_total_ms) / 1000:.1f}s classified including the classifier, "
+            f"saved {saved_ms / 1000:.1f}s ({saved_ms / max(chosen_ms, 1e-9):.1%}, {saved_ms / total:.1f} ms/segment)"
+        ))
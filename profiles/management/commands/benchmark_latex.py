@@ -0,0 +1,194 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from leopardnotes.latex import LATEX_BACKENDS, export_quantized_latex_model, load_latex_model
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def edit_distance(a, b):
+    """
+        Levenshtein distance between two strings.
+    """
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def normalize_latex(latex):
+    """
+        Drop whitespace, which carries no meaning in LaTeX math, before comparing two outputs.
+    """
+    return "".join(latex.split())
+
+
+def get_current_rss_kb():
+    """
+        The resident set size of this process right now, in kilobytes.
+
+        ru_maxrss is the lifetime high-water mark, so it also counts memory freed again, e.g. while loading a model.
+        Falls back to it where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def percentile(values, fraction):
+    """
+        The value below which the given fraction of the values fall.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the accuracy, latency and peak memory of the LaTeX OCR backends on a directory of formula crops. "
+        "A <name>.tex file next to a crop is used as its reference, otherwise the fp32 output is."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("fixtures", help="Directory of formula crop images.")
+        parser.add_argument("--backends", nargs="+", default=list(LATEX_BACKENDS), choices=LATEX_BACKENDS)
+        parser.add_argument("--repeat", type=int, default=3, help="Timed runs per crop, the fastest one is kept.")
+        parser.add_argument("--threads", type=int, default=None, help="Number of torch intra-op threads.")
+        # Every backend runs in its own process so that its peak RSS is measured in isolation
+        parser.add_argument("--child-backend", choices=LATEX_BACKENDS, help="Internal: run a single backend.")
+
+    def handle(self, *args, **options):
+        fixtures = options["fixtures"]
+        if not os.path.isdir(fixtures):
+            raise CommandError(f"{fixtures} is not a directory.")
+        images = sorted(name for name in os.listdir(fixtures) if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not images:
+            raise CommandError(f"No formula crops found in {fixtures}.")
+
+        if options["child_backend"]:
+            self.stdout.write(json.dumps(self.run_backend(fixtures, images, options)))
+            return
+
+        if "int8" in options["backends"] and not os.path.exists(settings.OCR_LATEX_INT8_PATH):
+            # Exported here, so that the int8 child measures loading the saved model and not the export
+            self.stdout.write(f"Exporting the quantized model to {settings.OCR_LATEX_INT8_PATH}...")
+            export_quantized_latex_model(str(settings.OCR_LATEX_INT8_PATH))
+
+        reports = {backend: self.spawn_backend(backend, options) for backend in options["backends"]}
+        self.write_report(fixtures, images, reports)
+
+    def run_backend(self, fixtures, images, options):
+        """
+            Load one backend and recognize every crop, returning the outputs, timings, RSS after the load and peak RSS.
+        """
+        if options["threads"]:
+            import torch
+
+            torch.set_num_threads(options["threads"])
+
+        start = time.perf_counter()
+        latex_model = load_latex_model(options["child_backend"])
+        load_seconds = time.perf_counter() - start
+        load_rss_kb = get_current_rss_kb()
+
+        outputs = {}
+        latencies = {}
+        for name in images:
+            with Image.open(os.path.join(fixtures, name)) as image:
+                image = image.convert("RGB")
+            runs = []
+            for _ in range(max(options["repeat"], 1)):
+                start = time.perf_counter()
+                outputs[name] = latex_model(image)
+                runs.append((time.perf_counter() - start) * 1000)
+            latencies[name] = min(runs)
+
+        return {
+            "load_seconds": load_seconds,
+            "outputs": outputs,
+            "latencies": latencies,
+            "load_rss_kb": load_rss_kb,
+            # Kilobytes on Linux, the process only ever held this backend's model
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    def spawn_backend(self, backend, options):
+        """
+            Run one backend in a child process and return its report.
+        """
+        self.stdout.write(f"Running the {backend} backend...")
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, "manage.py"), "benchmark_latex", options["fixtures"],
+            "--child-backend", backend, "--repeat", str(options["repeat"]),
+        ]
+        if options["threads"]:
+            command += ["--threads", str(options["threads"])]
+
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(f"The {backend} backend failed:\n{process.stderr}")
+        # The model may print while loading, the report is the last line
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def write_report(self, fixtures, images, reports):
+        """
+            Write the accuracy, latency and memory of every backend, compared with the references and with fp32.
+        """
+        references = {}
+        tex_references = 0
+        for name in images:
+            tex_path = os.path.join(fixtures, os.path.splitext(name)[0] + ".tex")
+            if os.path.exists(tex_path):
+                with open(tex_path) as f:
+                    references[name] = f.read()
+                tex_references += 1
+            elif "fp32" in reports:
+                references[name] = reports["fp32"]["outputs"][name]
+        self.stdout.write(
+            f"{len(images)} crops, {tex_references} with a .tex reference, the others are compared with the fp32 output"
+        )
+
+        baseline = reports.get("fp32")
+        for backend, report in reports.items():
+            latencies = list(report["latencies"].values())
+            mean_ms = sum(latencies) / len(latencies)
+
+            compared = [name for name in images if name in references]
+            exact = sum(
+                normalize_latex(report["outputs"][name]) == normalize_latex(references[name]) for name in compared
+            )
+            distance = sum(
+                edit_distance(normalize_latex(report["outputs"][name]), normalize_latex(references[name]))
+                / max(len(normalize_latex(references[name])), 1)
+                for name in compared
+            )
+
+            line = (
+                f"{backend}: load {report['load_seconds']:.1f}s, {mean_ms:.0f} ms/crop mean, "
+                f"{percentile(latencies, 0.95):.0f} ms p95, RSS after load {report['load_rss_kb'] / 1024:.0f} MB, "
+                f"peak RSS {report['peak_rss_kb'] / 1024:.0f} MB"
+            )
+            if compared:
+                line += f", exact match {exact / len(compared):.1%}, normalized edit distance {distance / len(compared):.3f}"
+            if baseline and backend != "fp32":
+                baseline_ms = sum(baseline["latencies"].values()) / len(images)
+                line += (
+                    f", {baseline_ms / mean_ms:.2f}x the fp32 speed, "
+                    f"{(baseline['load_rss_kb'] - report['load_rss_kb']) / 1024:.0f} MB less RSS after load, "
+                    f"{(baseline['peak_rss_kb'] - report['peak_rss_kb']) / 1024:.0f} MB less peak RSS"
+                )
+            self.stdout.write(line)
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from leopardnotes.latex import export_quantized_latex_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Quantize the LaTeX OCR model and save it to OCR_LATEX_INT8_PATH, so that processes using the int8 backend "
+        "load the int8 weights directly instead of building the fp32 model first. Run it again after upgrading "
+        "pix2tex or torch."
+    )
+
+    def handle(self, *args, **options):
+        export_quantized_latex_model(str(settings.OCR_LATEX_INT8_PATH))
+        self.stdout.write(self.style.SUCCESS(f"Saved the quantized LaTeX OCR model to {settings.OCR_LATEX_INT8_PATH}"))
@@ -0,0 +1,370 @@
+import json
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from posts.models import Post
+from profiles.derivatives import DERIVATIVE_EXTENSION, DERIVATIVE_FORMAT
+from profiles.models import OCRImage, Profile, StoredBlob
+
+DERIVATIVES_DIR = "derivatives"
+CAS_DIR = "cas"
+# Models and file fields storing uploads, their upload_to directories hold the uploads saved before content addressing
+FILE_FIELDS = (
+    (OCRImage, "uploaded_image"),
+    (OCRImage, "fully_segmented_image"),
+    (Post, "image"),
+    (Profile, "avatar"),
+)
+COMPACT_EXTENSIONS = (".webp", ".jpg", ".jpeg")
+COMPACT_QUALITY = 85
+
+
+def walk_sorted(root, components=()):
+    """
+        Walk a directory tree depth-first in sorted order, one directory at a time.
+
+        The walk order equals the lexicographic order of the directory component tuples, which lets an interrupted
+        walk resume after the last finished directory.
+
+        Args:
+            root (str): The root directory.
+            components (tuple): The path components of the current directory below root.
+
+        Yields:
+            tuple: (directory components, list of os.DirEntry for the files in that directory).
+    """
+    try:
+        entries = sorted(os.scandir(os.path.join(root, *components)), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+
+    yield components, [entry for entry in entries if entry.is_file(follow_symlinks=False)]
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_sorted(root, components + (entry.name,))
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove media files no longer referenced by the database and compact old OCR images. "
+        "Runs incrementally under a time budget and resumes where the previous run stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("jobs", nargs="*", choices=("gc", "compact"), default=["gc", "compact"])
+        parser.add_argument("--older-than", type=int, default=90, help="Compact OCR images older than this many days.")
+        parser.add_argument(
+            "--grace-hours",
+            type=int,
+            default=24,
+            help="Never remove files or blobs touched within this many hours, protects uploads in flight.",
+        )
+        parser.add_argument("--time-budget", type=float, default=None, help="Stop after this many seconds.")
+        parser.add_argument(
+            "--state",
+            default=os.path.join(settings.BASE_DIR, ".media_maintenance.json"),
+            help="File recording where the previous run stopped.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be done without changing anything.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        # Files counted by a dry run, a content-addressed blob can back several OCR images
+        self.counted_names = set()
+        self.grace_cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        self.deadline = time.monotonic() + options["time_budget"] if options["time_budget"] else None
+        state = self.read_state(options["state"])
+
+        if "gc" in options["jobs"] and not self.out_of_time():
+            reclaimed, stopped_at = self.collect_garbage(state.get("gc_cursor"))
+            state["gc_cursor"] = stopped_at
+            self.stdout.write(self.style.SUCCESS(
+                f"gc: reclaimed {reclaimed} bytes" + (", stopped early" if stopped_at is not None else ""),
+            ))
+
+        if "compact" in options["jobs"] and not self.out_of_time():
+            saved, stopped_at = self.compact(options["older_than"], state.get("compact_after_pk") or 0)
+            state["compact_after_pk"] = stopped_at
+            self.stdout.write(self.style.SUCCESS(
+                f"compact: saved {saved} bytes" + (", stopped early" if stopped_at is not None else ""),
+            ))
+
+        if not self.dry_run:
+            self.write_state(options["state"], state)
+
+    def out_of_time(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def get_referenced_names(self):
+        """
+            Stream every file name referenced by the database.
+
+            Returns:
+                Counter: The number of references per file name.
+        """
+        referenced = Counter()
+        for model, field in FILE_FIELDS:
+            for name in model.objects.exclude(**{field: ""}).values_list(field, flat=True).iterator(chunk_size=2000):
+                if name:
+                    referenced[name] += 1
+
+        referenced[Profile._meta.get_field("avatar").default] += 1
+        return referenced
+
+    def get_upload_dirs(self):
+        """
+            Get the directories, as component tuples, that uploads were stored in before content addressing.
+        """
+        return {
+            tuple(model._meta.get_field(field).upload_to.strip("/").split("/"))
+            for model, field in FILE_FIELDS
+        }
+
+    def reconcile_refcounts(self, referenced):
+        """
+            Set the reference count of stored blobs to the number of references found in the database.
+
+            The references are a snapshot taken before the walk, so only blobs untouched since the grace cutoff are
+            reconciled: every upload and release of a blob updates it. Each count is only written if the blob is
+            still unchanged, so an upload or release racing with the reconciliation is never overwritten.
+        """
+        drifted = []
+        settled = StoredBlob.objects.filter(updated__lt=self.grace_cutoff).only("pk", "name", "refcount")
+        for blob in settled.iterator(chunk_size=2000):
+            if blob.refcount != referenced.get(blob.name, 0):
+                drifted.append(blob)
+
+        reconciled = 0
+        for blob in drifted:
+            if self.dry_run:
+                reconciled += 1
+                continue
+            reconciled += StoredBlob.objects.filter(
+                pk=blob.pk,
+                refcount=blob.refcount,
+                updated__lt=self.grace_cutoff,
+            ).update(refcount=referenced.get(blob.name, 0))
+        self.stdout.write(f"gc: reconciled {reconciled} blob reference counts")
+
+    def collect_garbage(self, cursor):
+        """
+            Remove unreferenced files by streaming the media tree against the names referenced by the database.
+
+            Content-addressed blobs are removed once their reference count is zero, derivatives once their original
+            is no longer referenced, and files in the upload directories of the models once they are no longer
+            referenced. Files anywhere else, e.g. at the top of the media directory, are never removed. Files and
+            blobs touched within the grace period are kept.
+
+            Args:
+                cursor (list): Components of the last finished directory of an interrupted run, or None.
+
+            Returns:
+                tuple: (bytes reclaimed, components of the last finished directory if the time budget ran out,
+                    otherwise None).
+        """
+        referenced = self.get_referenced_names()
+        referenced_roots = {os.path.splitext(name)[0] for name in referenced}
+        upload_dirs = self.get_upload_dirs()
+        self.reconcile_refcounts(referenced)
+
+        cursor = tuple(cursor) if cursor is not None else None
+        grace_timestamp = self.grace_cutoff.timestamp()
+        reclaimed = 0
+
+        for components, files in walk_sorted(str(settings.MEDIA_ROOT)):
+            if cursor is not None and components <= cursor:
+                continue
+            if self.out_of_time():
+                # Nothing finished yet means the next run starts from the beginning anyway
+                return reclaimed, list(cursor) if cursor is not None else None
+
+            directory = "/".join(components)
+            candidates = {}
+            for entry in files:
+                stat = entry.stat()
+                if stat.st_mtime > grace_timestamp:
+                    continue
+                name = f"{directory}/{entry.name}" if directory else entry.name
+
+                if components[:1] == (DERIVATIVES_DIR,):
+                    # derivatives/<size>/<original name without extension>.<ext>
+                    if os.path.splitext("/".join(components[2:] + (entry.name,)))[0] not in referenced_roots:
+                        reclaimed += self.remove_file(entry.path, stat.st_size)
+                elif components[:1] == (CAS_DIR,):
+                    candidates[name] = entry
+                elif name not in referenced and any(components[:len(path)] == path for path in upload_dirs):
+                    reclaimed += self.remove_file(entry.path, stat.st_size)
+
+            if candidates:
+                reclaimed += self.remove_unreferenced_blobs(candidates, referenced)
+
+            cursor = components
+
+        return reclaimed, None
+
+    def remove_unreferenced_blobs(self, candidates, referenced):
+        """
+            Remove content-addressed blobs without references, locking their rows so a concurrent upload of the same
+            content either revives the blob first or writes it again afterwards.
+        """
+        reclaimed = 0
+        with transaction.atomic():
+            known = set(StoredBlob.objects.filter(name__in=candidates).values_list("name", flat=True))
+            unreferenced = StoredBlob.objects.select_for_update().filter(
+                name__in=candidates,
+                refcount=0,
+                updated__lt=self.grace_cutoff,
+            )
+            for blob in unreferenced:
+                reclaimed += self.remove_file(candidates[blob.name].path, blob.size)
+                if not self.dry_run:
+                    blob.delete()
+
+            # Blobs written by an upload that failed before its row was created
+            for name, entry in candidates.items():
+                if name not in known and name not in referenced:
+                    reclaimed += self.remove_file(entry.path, entry.stat().st_size)
+
+        return reclaimed
+
+    def remove_file(self, path, size):
+        if self.dry_run:
+            self.stdout.write(f"would remove {path}")
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return 0
+        return size
+
+    def compact(self, older_than, after_pk):
+        """
+            Transcode old OCR image originals to a compact lossy format and drop segmented previews that can be
+            rendered again from the original and the segment boxes.
+
+            Args:
+                older_than (int): Only OCR images created more than this many days ago are compacted.
+                after_pk (int): Primary key of the last OCR image compacted by an interrupted run.
+
+            Returns:
+                tuple: (bytes saved, primary key of the last compacted OCR image if the time budget ran out,
+                    otherwise None).
+        """
+        cutoff = timezone.now() - timedelta(days=older_than)
+        saved = 0
+
+        while True:
+            chunk = list(
+                OCRImage.objects.filter(created__lt=cutoff, pk__gt=after_pk)
+                .order_by("pk")
+                .only("pk", "uploaded_image", "fully_segmented_image", "isSnipped")[:100]
+            )
+            if not chunk:
+                return saved, None
+
+            for ocr_image in chunk:
+                if self.out_of_time():
+                    return saved, after_pk
+                try:
+                    saved += self.compact_original(ocr_image)
+                    saved += self.drop_segmented_preview(ocr_image)
+                except Exception as e:
+                    self.stderr.write(f"compact: OCR image #{ocr_image.pk} failed: {e}")
+                after_pk = ocr_image.pk
+
+    def compact_original(self, ocr_image):
+        old_name = ocr_image.uploaded_image.name
+        if not old_name or old_name.lower().endswith(COMPACT_EXTENSIONS):
+            return 0
+
+        old_size = ocr_image.uploaded_image.size
+        with ocr_image.uploaded_image.open("rb") as f:
+            image = ImageOps.exif_transpose(Image.open(f)).convert("RGB")
+        buffer = BytesIO()
+        image.save(buffer, DERIVATIVE_FORMAT, quality=COMPACT_QUALITY)
+
+        if buffer.tell() >= old_size:
+            return 0
+        if self.dry_run:
+            # The same original always compacts to the same blob, both are counted once
+            if not self.release(old_name, old_size):
+                return 0
+            return old_size - buffer.tell()
+
+        root, _ = os.path.splitext(os.path.basename(old_name))
+        ocr_image.uploaded_image.save(f"{root}.{DERIVATIVE_EXTENSION}", ContentFile(buffer.getvalue()), save=False)
+        OCRImage.objects.filter(pk=ocr_image.pk).update(uploaded_image=ocr_image.uploaded_image.name)
+
+        # Only the first reference to the compacted blob stores it
+        stored = buffer.tell() if self.is_last_reference(ocr_image.uploaded_image.name, 1) else 0
+        return self.release(old_name, old_size) - stored
+
+    def drop_segmented_preview(self, ocr_image):
+        # Snipped images keep theirs, the snipped region is not stored anywhere else
+        if ocr_image.isSnipped or not ocr_image.fully_segmented_image:
+            return 0
+        segments = ocr_image.segments.all()
+        if not segments.exists() or segments.filter(x__isnull=True).exists():
+            return 0
+
+        name = ocr_image.fully_segmented_image.name
+        size = ocr_image.fully_segmented_image.size
+        if not self.dry_run:
+            OCRImage.objects.filter(pk=ocr_image.pk).update(fully_segmented_image=None)
+
+        return self.release(name, size)
+
+    def release(self, name, size):
+        """
+            Drop one reference to a stored file.
+
+            A content-addressed blob can back several OCR images and is only freed with its last reference, so its
+            size is counted once, when that reference is dropped. Dry runs count every file once.
+
+            Args:
+                name (str): The stored file name.
+                size (int): The size of the file.
+
+            Returns:
+                int: The number of bytes freed.
+        """
+        if self.dry_run:
+            if name in self.counted_names:
+                return 0
+            self.counted_names.add(name)
+            return size
+
+        default_storage.delete(name)
+        if not name.startswith(f"{CAS_DIR}/"):
+            return size
+        return size if self.is_last_reference(name, 0) else 0
+
+    def is_last_reference(self, name, refcount):
+        """
+            Whether the content-addressed blob of a file name has the given number of references left.
+        """
+        return StoredBlob.objects.filter(name=name, refcount=refcount).exists()
+
+    def read_state(self, path):
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def write_state(self, path, state):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,262 @@
+import json
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from PIL import Image
+
+from leopardnotes.classify import classify_region
+from leopardnotes.views import run_ocr_engine, segment_array
+from profiles.models import OCRImage, OCRSegment
+
+
+def read_image_mmap(path):
+    """
+        Decode an image file through a read-only memory map instead of reading it into a bytes object.
+
+        Args:
+            path (str): Path of the stored image file.
+
+        Returns:
+            numpy.ndarray: The decoded BGR image.
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            img = cv2.imdecode(np.frombuffer(mm, np.uint8), cv2.IMREAD_COLOR)
+        finally:
+            mm.close()
+
+    if img is None:
+        raise ValueError(f"Could not decode image {path}")
+    return img
+
+
+def reocr_image(job):
+    """
+        Re-run segmentation and OCR for one stored OCR image. Runs inside a worker process and never touches the
+        database.
+
+        Args:
+            job (tuple): (pk, image path, is snipped, {order: ocr_type}, default ocr_type).
+
+        Returns:
+            tuple: (pk, list of segment result dictionaries, error message or None).
+    """
+    pk, path, is_snipped, ocr_types, default_ocr_type = job
+    try:
+        img = read_image_mmap(path)
+        boxes = [None] if is_snipped else segment_array(img)[0]
+
+        results = []
+        for order, box in enumerate(boxes):
+            region = img
+            if box:
+                x, y, w, h = box
+                region = img[y:y+h, x:x+w]
+            pil_image = Image.fromarray(cv2.cvtColor(region, cv2.COLOR_BGR2RGB))
+            ocr_type = ocr_types.get(order, default_ocr_type)
+            if ocr_type == "auto":
+                ocr_type = classify_region(pil_image)
+            text, engine_version, elapsed_ms = run_ocr_engine(pil_image, ocr_type)
+            results.append({
+                "box": box,
+                "ocr_type": ocr_type,
+                "text": text,
+                "engine_version": engine_version,
+                "elapsed_ms": elapsed_ms,
+            })
+        return pk, results, None
+    except Exception as e:
+        return pk, [], str(e)
+
+
+class Command(BaseCommand):
+    help = "Re-run segmentation and OCR for stored OCR images, e.g. after upgrading tesseract or the pix2tex weights."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=100, help="Number of OCR images per primary-key chunk.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of OCR worker processes.")
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(settings.BASE_DIR, ".reocr_checkpoint.json"),
+            help=(
+                "File recording the last processed primary key and the failed images, used to resume an interrupted "
+                "run and to retry the failed images."
+            ),
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the beginning.")
+        parser.add_argument(
+            "--default-ocr-type",
+            default="auto",
+            choices=("auto", "text", "math"),
+            help="OCR type for regions without a stored segment to take the type from, 'auto' classifies them.",
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = options["checkpoint"]
+        last_pk, failed_pks = (0, set()) if options["restart"] else self.read_checkpoint(checkpoint)
+        if last_pk:
+            self.stdout.write(f"Resuming after OCR image #{last_pk}")
+        if failed_pks:
+            self.stdout.write(f"Retrying {len(failed_pks)} OCR images that failed before")
+
+        # Worker processes are forked on the first submit, close the connections so no socket is shared with them.
+        # The LaTeX model is not loaded here: torch's thread pools do not survive a fork, so each worker loads its
+        # own copy on the first math region.
+        connections.close_all()
+        self.images_done = self.segments_done = 0
+        self.start = time.monotonic()
+
+        images = OCRImage.objects.order_by("pk").only("pk", "uploaded_image", "fully_segmented_image", "isSnipped")
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            pool.submit(int).result()
+
+            # Failed images are checkpointed apart from the last processed primary key and retried first
+            retry_pks = sorted(failed_pks)
+            for index in range(0, len(retry_pks), options["chunk_size"]):
+                retry_chunk = retry_pks[index:index + options["chunk_size"]]
+                # Images deleted since they failed are dropped as well
+                failed_pks.difference_update(retry_chunk)
+                chunk = list(images.filter(pk__in=retry_chunk))
+                if chunk:
+                    failed_pks.update(self.run_chunk(pool, chunk, options["default_ocr_type"], len(failed_pks)))
+                self.write_checkpoint(checkpoint, last_pk, failed_pks)
+
+            while True:
+                chunk = list(images.filter(pk__gt=last_pk)[:options["chunk_size"]])
+                if not chunk:
+                    break
+
+                failed_pks.update(self.run_chunk(pool, chunk, options["default_ocr_type"], len(failed_pks)))
+                last_pk = chunk[-1].pk
+                self.write_checkpoint(checkpoint, last_pk, failed_pks)
+
+        if failed_pks:
+            self.stderr.write(
+                f"{len(failed_pks)} OCR images failed, they stay in {checkpoint} and are retried by the next run."
+            )
+        elif os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.monotonic() - self.start
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-OCR'd {self.images_done} images and {self.segments_done} segments in {elapsed:.1f}s "
+            f"({self.images_done / max(elapsed, 1e-9):.2f} images/s, "
+            f"{self.segments_done / max(elapsed, 1e-9):.2f} segments/s), {len(failed_pks)} failed",
+        ))
+
+    def run_chunk(self, pool, chunk, default_ocr_type, failed):
+        """
+            Re-OCR a chunk of OCR images in the worker processes, write the results and report the progress.
+
+            Args:
+                pool (ProcessPoolExecutor): The worker processes.
+                chunk (list): The OCR images.
+                default_ocr_type (str): The OCR type of regions without a stored segment.
+                failed (int): The number of failed images so far, for the progress report.
+
+            Returns:
+                list: The primary keys of the images that failed.
+        """
+        jobs, results = self.build_jobs(chunk, default_ocr_type)
+        results += pool.map(reocr_image, jobs)
+
+        written, errors = self.write_results(chunk, results)
+        for pk, error in errors:
+            self.stderr.write(f"OCR image #{pk} failed: {error}")
+
+        self.images_done += len(chunk) - len(errors)
+        self.segments_done += written
+        elapsed = time.monotonic() - self.start
+        self.stdout.write(
+            f"#{chunk[-1].pk}: {self.images_done} images ({self.images_done / elapsed:.2f}/s), "
+            f"{self.segments_done} segments ({self.segments_done / elapsed:.2f}/s), {failed + len(errors)} failed",
+        )
+        return [pk for pk, _ in errors]
+
+    def build_jobs(self, chunk, default_ocr_type):
+        """
+            Build the worker jobs for a chunk of OCR images, keeping the OCR type chosen for each stored segment.
+
+            Returns:
+                tuple: (list of jobs, list of failed results for the images without a stored source image).
+        """
+        ocr_types = {ocr_image.pk: {} for ocr_image in chunk}
+        for ocr_image_id, order, ocr_type in OCRSegment.objects.filter(
+            ocr_image__in=chunk,
+        ).values_list("ocr_image_id", "order", "ocr_type"):
+            ocr_types[ocr_image_id][order] = ocr_type
+
+        jobs = []
+        missing = []
+        for ocr_image in chunk:
+            source = ocr_image.fully_segmented_image if ocr_image.isSnipped else ocr_image.uploaded_image
+            if not source:
+                # Recorded as failed like a worker error, so the image is checkpointed instead of aborting the run
+                missing.append((ocr_image.pk, [], f"no {source.field.name} is stored"))
+                continue
+            jobs.append((ocr_image.pk, source.path, ocr_image.isSnipped, ocr_types[ocr_image.pk], default_ocr_type))
+        return jobs, missing
+
+    def write_results(self, chunk, results):
+        """
+            Replace the segments and combined text of every successfully processed OCR image in the chunk.
+
+            Returns:
+                tuple: (number of segments written, list of (pk, error) for failed images).
+        """
+        by_pk = {ocr_image.pk: ocr_image for ocr_image in chunk}
+        updated = []
+        segments = []
+        errors = []
+
+        for pk, segment_results, error in results:
+            if error:
+                errors.append((pk, error))
+                continue
+
+            ocr_image = by_pk[pk]
+            ocr_image.ocr_text = "\n".join(result["text"] for result in segment_results)
+            updated.append(ocr_image)
+
+            for order, result in enumerate(segment_results):
+                x, y, width, height = result["box"] or (None, None, None, None)
+                segments.append(OCRSegment(
+                    ocr_image=ocr_image,
+                    order=order,
+                    x=x,
+                    y=y,
+                    width=width,
+                    height=height,
+                    ocr_type=result["ocr_type"],
+                    text=result["text"],
+                    engine_version=result["engine_version"],
+                    elapsed_ms=result["elapsed_ms"],
+                ))
+
+        with transaction.atomic():
+            OCRSegment.objects.filter(ocr_image__in=updated).delete()
+            OCRSegment.objects.bulk_create(segments)
+            OCRImage.objects.bulk_update(updated, ["ocr_text"])
+
+        return len(segments), errors
+
+    def read_checkpoint(self, path):
+        if not os.path.exists(path):
+            return 0, set()
+        with open(path) as f:
+            state = json.load(f)
+        return state["last_pk"], set(state.get("failed_pks", ()))
+
+    def write_checkpoint(self, path, last_pk, failed_pks):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"last_pk": last_pk, "failed_pks": sorted(failed_pks)}, f)
+        os.replace(tmp_path, path)
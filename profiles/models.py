@@ -202,6 +202,37 @@ class Message(models.Model):
         return f"{self.sender} - {str(self.content)}"
 
 
+BATCH_STATUS_CHOICES = (
+    ("processing", "processing"),
+    ("done", "done"),
+    ("failed", "failed"),
+)
+
+
+class OCRBatch(models.Model):
+    """
+        Model representing a multi-page upload (PDF or zip of images) processed into one OCR image per page.
+    """
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="ocr_batches")
+    title = models.CharField(max_length=100, default="Untitled")
+    source_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=12, choices=BATCH_STATUS_CHOICES, default="processing")
+    total_pages = models.PositiveIntegerField(default=0)
+    processed_pages = models.PositiveIntegerField(default=0)
+    failed_pages = models.PositiveIntegerField(default=0)
+    # List of {"page": number, "error": message} for the pages that could not be processed
+    errors = models.JSONField(default=list, blank=True)
+
+    updated = models.DateTimeField(auto_now=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """
+            Return a string representation of the OCR batch.
+        """
+        return f"{self.title} ({self.processed_pages}/{self.total_pages})"
+
+
 class OCRImage(models.Model):
     """
         Model representing OCR images.
@@ -212,6 +243,8 @@ class OCRImage(models.Model):
     uploaded_image = models.ImageField(upload_to='media/ocr_images/')
     fully_segmented_image = models.ImageField(upload_to='media/fully_segmented_images/', null=True, blank=True)
     isSnipped = models.BooleanField(default=False)
+    batch = models.ForeignKey(OCRBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='pages')
+    page_number = models.PositiveIntegerField(null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -220,3 +253,88 @@ class OCRImage(models.Model):
         """
         return self.title
 
+    def recompose_ocr_text(self):
+        """
+            Rebuild the combined OCR text from the stored segment results.
+
+            Only the per-segment texts are read back; no OCR engine is run, so a single re-OCR'd segment
+            can be folded into the parent text without touching the other segments.
+        """
+        self.ocr_text = "\n".join(self.segments.values_list("text", flat=True))
+        self.save(update_fields=["ocr_text"])
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["profile", "-created", "-id"], name="ocrimage_profile_created_idx"),
+        ]
+
+
+OCR_TYPE_CHOICES = (
+    ("text", "text"),
+    ("math", "math"),
+)
+
+
+class OCRSegment(models.Model):
+    """
+        Model representing a single segmented region of an OCR image and its OCR result.
+    """
+    ocr_image = models.ForeignKey(OCRImage, on_delete=models.CASCADE, related_name="segments")
+    order = models.PositiveIntegerField()
+    # Bounding box of the region inside the uploaded image. Snipped images have no box, the
+    # snipped region itself is stored as the OCR image's fully_segmented_image.
+    x = models.PositiveIntegerField(null=True, blank=True)
+    y = models.PositiveIntegerField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    ocr_type = models.CharField(max_length=8, choices=OCR_TYPE_CHOICES, default="text")
+    text = models.TextField(blank=True)
+    engine_version = models.CharField(max_length=100, blank=True)
+    elapsed_ms = models.FloatField(default=0)
+
+    updated = models.DateTimeField(auto_now=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """
+            Return a string representation of the OCR segment.
+        """
+        return f"{self.ocr_image} - #{self.order} ({self.ocr_type})"
+
+    @property
+    def box(self):
+        """
+            Get the bounding box of the segment.
+
+            Returns:
+                tuple: (x, y, width, height) of the region, or None for snipped images.
+        """
+        if self.x is None:
+            return None
+        return self.x, self.y, self.width, self.height
+
+    class Meta:
+        ordering = ("order",)
+        constraints = [
+            models.UniqueConstraint(fields=["ocr_image", "order"], name="unique_ocr_segment_order"),
+        ]
+
+
+class StoredBlob(models.Model):
+    """
+        Model representing a media file stored once under the hash of its content, and the number of file fields
+        referencing it.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+
+    updated = models.DateTimeField(auto_now=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """
+            Return a string representation of the stored blob.
+        """
+        return f"{self.name} ({self.refcount} references)"
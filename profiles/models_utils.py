@@ -1,3 +1,6 @@
+from django.db.models import Sum
+
+
 def get_list_of_profiles_by_user(users):
     """
         Get a list of profiles associated with the given list of users.
@@ -28,8 +31,7 @@ def get_likes_received_count(posts):
         Returns:
             int: Total count of likes received by the provided posts.
     """
-    total_liked = 0
-    for post in posts:
-        total_liked += post.liked.all().count()
+    # One aggregate over the stored like counters instead of a count query per post
+    total_liked = posts.aggregate(total_liked=Sum("like_count"))["total_liked"]
 
-    return total_liked
+    return total_liked or 0
@@ -0,0 +1,164 @@
+import re
+
+from django.db import NotSupportedError, connection
+from django.utils.html import escape
+
+from .models import OCRImage
+
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+
+
+def get_search_table_names():
+    """
+        Get the names of the OCR image table and the objects of its full-text index.
+
+        Returns:
+            dict: The table, FTS5 table and GIN index names.
+    """
+    table = OCRImage._meta.db_table
+    return {
+        "table": table,
+        "fts": f"{table}_fts",
+        "index": f"{table}_search_idx",
+    }
+
+
+def install_search_index(using_connection):
+    """
+        Create the full-text search index over OCRImage.title and OCRImage.ocr_text if it does not exist yet.
+
+        On PostgreSQL this adds a generated, weighted tsvector column with a GIN index, on SQLite an external content
+        FTS5 table kept in sync by triggers. Both are maintained by the database itself, so bulk updates and raw
+        queries keep the index current as well.
+
+        Args:
+            using_connection (BaseDatabaseWrapper): The database connection to install the index on.
+    """
+    names = get_search_table_names()
+
+    with using_connection.cursor() as cursor:
+        if using_connection.vendor == "postgresql":
+            cursor.execute(
+                f"ALTER TABLE {names['table']} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+                f"setweight(to_tsvector('english', coalesce(ocr_text, '')), 'B')"
+                f") STORED",
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {names['index']} ON {names['table']} USING gin (search_vector)",
+            )
+
+        elif using_connection.vendor == "sqlite":
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [names["fts"]])
+            if cursor.fetchone():
+                return
+
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {names['fts']} USING fts5("
+                f"title, ocr_text, content='{names['table']}', content_rowid='id')",
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {names['fts']}_ai AFTER INSERT ON {names['table']} BEGIN "
+                f"INSERT INTO {names['fts']}(rowid, title, ocr_text) VALUES (new.id, new.title, new.ocr_text); "
+                f"END",
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {names['fts']}_ad AFTER DELETE ON {names['table']} BEGIN "
+                f"INSERT INTO {names['fts']}({names['fts']}, rowid, title, ocr_text) "
+                f"VALUES ('delete', old.id, old.title, old.ocr_text); "
+                f"END",
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {names['fts']}_au AFTER UPDATE OF title, ocr_text ON {names['table']} BEGIN "
+                f"INSERT INTO {names['fts']}({names['fts']}, rowid, title, ocr_text) "
+                f"VALUES ('delete', old.id, old.title, old.ocr_text); "
+                f"INSERT INTO {names['fts']}(rowid, title, ocr_text) VALUES (new.id, new.title, new.ocr_text); "
+                f"END",
+            )
+            # Index the rows that existed before the FTS table was created
+            cursor.execute(f"INSERT INTO {names['fts']}({names['fts']}) VALUES ('rebuild')")
+
+
+def highlight_snippet(snippet):
+    """
+        Escape a snippet returned by the database and turn the highlight markers into <mark> tags.
+
+        Args:
+            snippet (str): The snippet containing HIGHLIGHT_START/HIGHLIGHT_STOP markers.
+
+        Returns:
+            str: HTML-safe snippet with the matched terms wrapped in <mark> tags.
+    """
+    return (
+        escape(snippet or "")
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_STOP, "</mark>")
+    )
+
+
+def search_ocr_images(profile, query, page=1, per_page=20):
+    """
+        Search the OCR images of a profile by title and OCR text using the full-text index.
+
+        Args:
+            profile (Profile): The profile whose OCR images are searched.
+            query (str): The search query as typed by the user.
+            page (int): The 1-based page number.
+            per_page (int): The number of hits per page.
+
+        Returns:
+            tuple: A list of hit dictionaries (id, title, rank, snippet) ordered by relevance and a boolean telling
+                whether there is a next page.
+    """
+    names = get_search_table_names()
+    offset = (page - 1) * per_page
+
+    if connection.vendor == "postgresql":
+        sql = (
+            f"SELECT hits.id, hits.title, hits.rank, "
+            f"ts_headline('english', hits.ocr_text, websearch_to_tsquery('english', %s), %s) "
+            f"FROM ("
+            f"SELECT o.id, o.title, o.ocr_text, ts_rank(o.search_vector, q) AS rank "
+            f"FROM {names['table']} o, websearch_to_tsquery('english', %s) q "
+            f"WHERE o.profile_id = %s AND o.search_vector @@ q "
+            f"ORDER BY rank DESC, o.id DESC LIMIT %s OFFSET %s"
+            f") hits ORDER BY hits.rank DESC, hits.id DESC"
+        )
+        headline_options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=20, MinWords=5"
+        params = [query, headline_options, query, profile.pk, per_page + 1, offset]
+
+    elif connection.vendor == "sqlite":
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return [], False
+        # Quote every term so FTS5 query syntax typed by the user is matched literally
+        fts_query = " ".join(f'"{term}"' for term in terms)
+        sql = (
+            f"SELECT o.id, o.title, bm25({names['fts']}, 10.0, 1.0) AS rank, "
+            f"snippet({names['fts']}, 1, char(2), char(3), '…', 16) "
+            f"FROM {names['fts']} JOIN {names['table']} o ON o.id = {names['fts']}.rowid "
+            f"WHERE {names['fts']} MATCH %s AND o.profile_id = %s "
+            f"ORDER BY rank, o.id DESC LIMIT %s OFFSET %s"
+        )
+        params = [fts_query, profile.pk, per_page + 1, offset]
+
+    else:
+        raise NotSupportedError(f"Full-text search is not supported on {connection.vendor}")
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    hits = [
+        {
+            "id": pk,
+            "title": title,
+            "rank": rank,
+            "snippet": highlight_snippet(snippet),
+        }
+        for pk, title, rank, snippet in rows[:per_page]
+    ]
+
+    return hits, len(rows) > per_page
@@ -1,8 +1,13 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_delete
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 
-from .models import Profile, Relationship
+from leopardnotes.storage import get_replaced_files, release_files
+
+from .derivatives import AVATAR_SIZES, OCR_IMAGE_SIZES, schedule_derivatives
+from .models import OCRImage, Profile, Relationship
+from .search import install_search_index
 
 
 @receiver(post_save, sender=User)
@@ -69,3 +74,117 @@ def pre_delete_remove_from_friends(sender, instance, **kwargs):
 
     relship_sender_profile.save()
     relship_receiver_profile.save()
+
+
+@receiver(post_save, sender=OCRImage)
+def post_save_generate_ocr_image_derivatives(sender, instance, created, **kwargs):
+    """
+        Render the thumbnail and preview derivatives of a newly uploaded OCR image.
+
+        Args:
+            sender (Model): The sender model class (OCRImage).
+            instance (OCRImage): The OCRImage instance being saved.
+            created (bool): Indicates whether the instance was newly created.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    if created:
+        schedule_derivatives(instance.uploaded_image, OCR_IMAGE_SIZES)
+        schedule_derivatives(instance.fully_segmented_image, OCR_IMAGE_SIZES)
+
+
+@receiver(post_save, sender=Profile)
+def post_save_generate_avatar_derivatives(sender, instance, update_fields, **kwargs):
+    """
+        Render the avatar derivatives of a profile whose avatar has none yet, e.g. after a new avatar was uploaded.
+
+        Args:
+            sender (Model): The sender model class (Profile).
+            instance (Profile): The Profile instance being saved.
+            update_fields (frozenset): The fields saved, None if all fields were saved.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    if update_fields is None or "avatar" in update_fields:
+        schedule_derivatives(instance.avatar, AVATAR_SIZES, overwrite=False)
+
+
+# File fields whose content-addressed files are reference counted, see leopardnotes/storage.py
+STORED_FILE_FIELDS = {
+    OCRImage: ("uploaded_image", "fully_segmented_image"),
+    Profile: ("avatar",),
+}
+
+
+@receiver(pre_save, sender=OCRImage)
+@receiver(pre_save, sender=Profile)
+def pre_save_find_replaced_files(sender, instance, update_fields, **kwargs):
+    """
+        Remember the stored files that saving an OCR image or a profile replaces, they are released once it is saved.
+
+        Args:
+            sender (Model): The sender model class (OCRImage or Profile).
+            instance (Model): The instance being saved.
+            update_fields (frozenset): The fields saved, None if all fields are saved.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    instance._replaced_files = get_replaced_files(instance, STORED_FILE_FIELDS[sender], update_fields)
+
+
+@receiver(post_save, sender=OCRImage)
+@receiver(post_save, sender=Profile)
+def post_save_release_replaced_files(sender, instance, **kwargs):
+    """
+        Release the stored files replaced by saving an OCR image or a profile, once the save is committed.
+
+        Args:
+            sender (Model): The sender model class (OCRImage or Profile).
+            instance (Model): The instance saved.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    release_files(getattr(instance, "_replaced_files", ()))
+    instance._replaced_files = []
+
+
+@receiver(post_delete, sender=OCRImage)
+@receiver(post_delete, sender=Profile)
+def post_delete_release_files(sender, instance, **kwargs):
+    """
+        Release the stored files of a deleted OCR image or profile, once the delete is committed.
+
+        Args:
+            sender (Model): The sender model class (OCRImage or Profile).
+            instance (Model): The deleted instance.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    release_files(getattr(instance, field_name) for field_name in STORED_FILE_FIELDS[sender])
+
+
+@receiver(post_migrate)
+def post_migrate_install_search_index(sender, using, **kwargs):
+    """
+        Install the OCR image full-text search index after the profiles app has been migrated.
+
+        Args:
+            sender (AppConfig): The app config of the migrated app.
+            using (str): The alias of the migrated database.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            None
+    """
+    if sender.name == "profiles":
+        install_search_index(connections[using])
@@ -0,0 +1,28 @@
+from django import template
+
+from profiles.derivatives import DERIVATIVE_SIZES, get_derivative_url
+
+register = template.Library()
+
+
+@register.filter
+def derivative_url(field_file, size):
+    """
+        Get the URL of a resized derivative of an image, e.g. {{ ocr_image.uploaded_image|derivative_url:"thumb" }}.
+    """
+    return get_derivative_url(field_file, size)
+
+
+@register.simple_tag
+def derivative_srcset(field_file, *sizes):
+    """
+        Build a srcset attribute value from derivatives of an image, e.g.
+        {% derivative_srcset ocr_image.uploaded_image "thumb" "preview" %}.
+    """
+    if not field_file:
+        return ""
+
+    return ", ".join(
+        f"{get_derivative_url(field_file, size)} {DERIVATIVE_SIZES[size][0]}w"
+        for size in sizes
+    )
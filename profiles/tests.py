@@ -0,0 +1,53 @@
+from django.test import TestCase
+
+from leopardnotes.testing import TemporaryMediaMixin, make_image_file, make_posts, make_profiles, query_budget
+from profiles.models import Message, OCRImage
+
+
+class ProfileQueryBudgetTests(TemporaryMediaMixin, TestCase):
+    """
+        Check that the profile pages run a constant number of queries as profiles, posts and messages grow.
+    """
+
+    def setUp(self):
+        self.profile = make_profiles(1, prefix="viewer")[0]
+        self.client.force_login(self.profile.user)
+
+    @query_budget("profiles:profile-detail-view")
+    def test_profile_detail_view_queries(self, size):
+        other = make_profiles(1, prefix="author")[0]
+        make_posts(other, size, likers=make_profiles(3, prefix="liker"))
+        return {"slug": other.slug}
+
+    @query_budget("profiles:my-profile-view")
+    def test_my_profile_view_queries(self, size):
+        make_posts(self.profile, size, likers=make_profiles(3, prefix="liker"))
+
+    @query_budget("profiles:all-profiles-view")
+    def test_all_profiles_view_queries(self, size):
+        for other in make_profiles(size, prefix="member"):
+            self.profile.following.add(other.user)
+
+    @query_budget("profiles:chat-message-view")
+    def test_chat_message_view_queries(self, size):
+        other = make_profiles(1, prefix="friend")[0]
+        self.profile.friends.add(other.user)
+        other.friends.add(self.profile.user)
+        Message.objects.bulk_create(
+            Message(sender=sender, receiver=receiver, content=f"Message {number}")
+            for number in range(size)
+            for sender, receiver in ((self.profile, other), (other, self.profile))
+        )
+        return {"slug": other.slug}
+
+    @query_budget("ocr-view-results")
+    def test_ocr_results_view_queries(self, size):
+        OCRImage.objects.bulk_create(
+            OCRImage(
+                profile=self.profile,
+                title=f"Note {number}",
+                ocr_text=f"Text of note {number}",
+                uploaded_image=make_image_file("note.png"),
+            )
+            for number in range(size)
+        )
@@ -7,7 +7,7 @@ from django.views.generic import DetailView, ListView
 
 from posts.forms import CommentCreateModelForm
 from posts.models import Post
-from posts.views_utils import add_comment_if_submitted
+from posts.views_utils import POSTS_PAGE_SIZE, add_comment_if_submitted, prepare_post_cards
 
 from .forms import MessageModelForm
 from .models import Message, Profile, Relationship, OCRImage
@@ -15,6 +15,7 @@ from .views_utils import (
     check_if_friends,
     follow_unfollow,
     get_friends_of_user,
+    get_keyset_page,
     get_profile_by_pk,
     get_profile_form_by_request_method,
     get_received_invites,
@@ -41,7 +42,9 @@ def my_profile_view(request):
 
     form = get_profile_form_by_request_method(request, profile)
 
-    posts = profile.posts.all()
+    posts, next_cursor = get_keyset_page(
+        Post.objects.get_profile_posts(profile), request.GET.get("after"), POSTS_PAGE_SIZE,
+    )
 
     c_form = CommentCreateModelForm()
 
@@ -62,7 +65,9 @@ def my_profile_view(request):
     context = {
         "profile": profile,
         "form": form,
-        "posts": posts,
+        "posts": prepare_post_cards(posts, profile),
+        "next_cursor": next_cursor,
+        "request_user_profile": profile,
         "c_form": c_form,
     }
 
@@ -366,7 +371,11 @@ class ProfileDetailView(LoginRequiredMixin, DetailView):
         context["profile"] = self.get_object()
         context["request_user_profile"] = profile
 
-        context["posts"] = self.get_object().posts.all()
+        context["posts"], context["next_cursor"] = get_keyset_page(
+            Post.objects.get_profile_posts(context["profile"]), self.request.GET.get("after"), POSTS_PAGE_SIZE,
+        )
+        prepare_post_cards(context["posts"], profile)
+        context["c_form"] = self.form_class()
 
         return context
 
@@ -388,7 +397,7 @@ class ProfileListView(LoginRequiredMixin, ListView):
             Returns:
                 QuerySet: All profiles.
         """
-        qs = Profile.objects.all()
+        qs = Profile.objects.select_related("user").prefetch_related("friends")
         return qs
 
     def get_context_data(self, **kwargs):
@@ -400,15 +409,16 @@ class ProfileListView(LoginRequiredMixin, ListView):
         """
         context = super().get_context_data(**kwargs)
 
-        profile = Profile.objects.get(user=self.request.user)
-        following = profile.following.all
+        profile = get_request_user_profile(self.request.user)
+        # Evaluated once, the template checks every listed profile against it
+        following = list(profile.following.all())
 
         invited_users, incoming_invite_users = get_relationship_users(profile)
 
         context["invited_users"] = invited_users
         context["incoming_invite_users"] = incoming_invite_users
         context["following"] = following
-        context["profiles"] = self.get_queryset()
+        context["profiles"] = context["object_list"]
 
         return context
 
@@ -472,7 +482,7 @@ class ChatMessageView(LoginRequiredMixin, ListView):
 
         if form.is_valid():
             instance = form.save(commit=False)
-            instance.sender = Profile.objects.get(user=self.request.user)
+            instance.sender = get_request_user_profile(self.request.user)
             instance.receiver = self.get_object()
 
             # Check if an OCRImage is selected and attach its ID to the message
@@ -486,14 +496,15 @@ class ChatMessageView(LoginRequiredMixin, ListView):
 
     def get_object(self):
         """
-            Retrieve the target profile object.
+            Retrieve the target profile object, looked up once per request.
 
             Returns:
                 Profile: The target profile.
         """
-        slug = self.kwargs.get("slug")
-        profile = Profile.objects.get(slug=slug)
-        return profile
+        if not hasattr(self, "target_profile"):
+            slug = self.kwargs.get("slug")
+            self.target_profile = Profile.objects.select_related("user").get(slug=slug)
+        return self.target_profile
 
     def get_queryset(self):
         """
@@ -502,7 +513,7 @@ class ChatMessageView(LoginRequiredMixin, ListView):
             Returns:
                 list: Ordered messages.
         """
-        profile = Profile.objects.get(user=self.request.user)
+        profile = get_request_user_profile(self.request.user)
 
         sent = Message.objects.filter(
             sender=profile,
@@ -530,7 +541,7 @@ class ChatMessageView(LoginRequiredMixin, ListView):
         context = super().get_context_data(**kwargs)
         context["received"] = get_received_messages(
             self.get_object(),
-            Profile.objects.get(user=self.request.user),
+            get_request_user_profile(self.request.user),
         )
         context["are_friends"] = check_if_friends(
             self.get_object(),
@@ -538,9 +549,9 @@ class ChatMessageView(LoginRequiredMixin, ListView):
         )
         context["profile"] = self.get_object()
         context["form"] = self.form_class
-        context["qs"] = self.get_queryset()
+        context["qs"] = context["object_list"]
 
         # Include OCRImages of the current user in the context
-        context["ocr_images"] = OCRImage.objects.filter(profile=self.request.user.profile)
+        context["ocr_images"] = OCRImage.objects.filter(profile=get_request_user_profile(self.request.user))
 
         return context
@@ -1,4 +1,8 @@
+import base64
+
+from django.db.models import Q
 from django.shortcuts import redirect
+from django.utils.dateparse import parse_datetime
 
 from .forms import ProfileModelForm
 from .models import Message, Profile, Relationship
@@ -8,14 +12,16 @@ def get_request_user_profile(request_user):
     """
         Retrieve the user's profile associated with the given request user.
 
+        The profile is cached on the user object, so the views, the context processors and the templates of one
+        request share a single lookup.
+
         Args:
             request_user (User): The user for whom to retrieve the profile.
 
         Returns:
             Profile: The user's profile.
     """
-    user = Profile.objects.get(user=request_user)
-    return user
+    return request_user.profile
 
 
 def get_profile_form_by_request_method(request, profile):
@@ -165,11 +171,11 @@ def get_relationship_users(profile):
         Returns:
             tuple: A tuple containing two lists - invited_users and incoming_invite_users.
     """
-    relship_sent = Relationship.objects.filter(sender=profile, status="sent")
+    relship_sent = Relationship.objects.filter(sender=profile, status="sent").select_related("receiver__user")
     relship_received = Relationship.objects.filter(
         receiver=profile,
         status="sent",
-    )
+    ).select_related("sender__user")
 
     invited_users = [i.receiver.user for i in relship_sent]
     incoming_invite_users = [i.sender.user for i in relship_received]
@@ -190,3 +196,74 @@ def get_received_messages(sender, receiver):
     """
     messages = Message.objects.filter(sender=sender, receiver=receiver)
     return messages.values_list("content", flat=True)
+
+
+def encode_keyset_cursor(obj):
+    """
+        Encode the (created, id) position of an object as an opaque pagination cursor.
+
+        Args:
+            obj (Model): An instance with 'created' and 'pk' attributes.
+
+        Returns:
+            str: The URL-safe cursor.
+    """
+    position = f"{obj.created.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_keyset_cursor(cursor):
+    """
+        Decode a pagination cursor created by encode_keyset_cursor.
+
+        Args:
+            cursor (str): The cursor taken from the request, may be empty.
+
+        Returns:
+            tuple: The (created, pk) position, or None if the cursor is empty or invalid.
+    """
+    if not cursor:
+        return None
+
+    try:
+        created, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        created = parse_datetime(created)
+        pk = int(pk)
+    except ValueError:
+        return None
+
+    if created is None:
+        return None
+    return created, pk
+
+
+def get_keyset_page(queryset, cursor, page_size):
+    """
+        Get one page of a queryset ordered from newest to oldest using keyset pagination on (created, id).
+
+        Unlike OFFSET pagination every page is a range scan starting right after the cursor position, so the cost of
+        a page does not grow with the number of rows before it.
+
+        Args:
+            queryset (QuerySet): The queryset to paginate, its model needs a 'created' field.
+            cursor (str): The cursor of the previous page, empty for the first page.
+            page_size (int): The number of objects per page.
+
+        Returns:
+            tuple: A list with the objects of the page and the cursor of the next page (None on the last page).
+    """
+    queryset = queryset.order_by("-created", "-pk")
+
+    position = decode_keyset_cursor(cursor)
+    if position:
+        created, pk = position
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, pk__lt=pk))
+
+    objects = list(queryset[:page_size + 1])
+
+    next_cursor = None
+    if len(objects) > page_size:
+        objects = objects[:page_size]
+        next_cursor = encode_keyset_cursor(objects[-1])
+
+    return objects, next_cursor
@@ -1,9 +1,80 @@
+// Add a delete button to the viewer's own comments, the server renders comments the same for every viewer
+function renderCommentDeleteButtons() {
+    const viewer = String($("#post-list").data("viewer-profile"))
+    const csrf = $("input[name=csrfmiddlewaretoken]").first().val()
+
+    $(".comment-delete:empty").each(function () {
+        if (String($(this).data("profile")) !== viewer) {
+            return
+        }
+        const form = $('<form method="POST"></form>').attr("action", $(this).data("url"))
+        form.append($('<input type="hidden" name="csrfmiddlewaretoken">').val(csrf))
+        form.append('<button type="submit" class="delete-cmt-btn">Delete</button>')
+        $(this).append(form)
+    })
+}
+
 // Focus input form
 $( document ).ready(function() {
-    $(".cmt_btn").click(function () {
+    renderCommentDeleteButtons()
+
+    $(document).on("click", ".cmt_btn", function () {
       // Get form id from button
       formId = $(this).attr("class").split(/\s+/)[1]
       // Focus input from form
       $(`.form${formId}`)[0][2].focus()
     });
 })
+
+// Load older comments of a post above the ones already shown
+$(document).on("click", ".older-comments", function (e) {
+    e.preventDefault()
+    const button = $(this)
+    if (button.hasClass("loading")) {
+        return
+    }
+    button.addClass("loading")
+
+    $.ajax({
+        type: 'GET',
+        url: button.data("url"),
+        data: {'after': button.data("cursor")},
+        success: function(response) {
+            button.siblings(".comment-list").prepend(response['html'])
+            renderCommentDeleteButtons()
+            if (response['next_cursor']) {
+                button.data("cursor", response['next_cursor'])
+            } else {
+                button.remove()
+            }
+        },
+        error: function(response) {
+            console.log('error', response)
+        },
+        complete: function() {
+            button.removeClass("loading")
+        }
+    })
+})
+
+// Add a comment without reloading the page, only the new comment is rendered by the server
+$(document).on("submit", ".comment-form", function (e) {
+    e.preventDefault()
+    const form = $(this)
+    const post_id = form.find("input[name=post_id]").val()
+
+    $.ajax({
+        type: 'POST',
+        url: form.data("url"),
+        data: form.serialize(),
+        success: function(response) {
+            form.prev(".comment-box").find(".comment-list").append(response['html'])
+            renderCommentDeleteButtons()
+            $(`.cmt_btn.${post_id} p`).text(response['comment_count'])
+            form[0].reset()
+        },
+        error: function(response) {
+            console.log('error', response)
+        }
+    })
+})
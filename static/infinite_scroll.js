@@ -0,0 +1,58 @@
+// Load the next page of posts when the "Load more posts" link scrolls into view
+$( document ).ready(function() {
+    const more = $("#post-list-more")
+    if (!more.length) {
+        return
+    }
+
+    let loading = false
+
+    function loadNextPage() {
+        if (loading || !more.data("cursor")) {
+            return
+        }
+        loading = true
+        more.addClass("loading")
+
+        $.ajax({
+            type: 'GET',
+            url: more.data("page-url"),
+            data: {'after': more.data("cursor")},
+            success: function(response) {
+                $("#post-list").append(response['html'])
+                if (typeof renderCommentDeleteButtons === "function") {
+                    renderCommentDeleteButtons()
+                }
+                if (response['next_cursor']) {
+                    more.data("cursor", response['next_cursor'])
+                    more.attr("href", `?after=${encodeURIComponent(response['next_cursor'])}`)
+                } else {
+                    more.data("cursor", "")
+                    more.remove()
+                }
+            },
+            error: function(response) {
+                console.log('error', response)
+            },
+            complete: function() {
+                loading = false
+                more.removeClass("loading")
+            }
+        })
+    }
+
+    // Without IntersectionObserver the link falls back to a plain page load
+    if ("IntersectionObserver" in window) {
+        const observer = new IntersectionObserver(function(entries) {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadNextPage()
+            }
+        }, {rootMargin: "400px"})
+        observer.observe(more[0])
+
+        more.click(function(e) {
+            e.preventDefault()
+            loadNextPage()
+        })
+    }
+})
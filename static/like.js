@@ -1,14 +1,13 @@
-// Like post without reloading page
-$('.like-form').submit(function(e){
+// Like post without reloading page, delegated so posts added by infinite scroll are handled too
+$(document).on('submit', '.like-form', function(e){
   e.preventDefault()
 
   const post_id = $(this).attr('id')
 
   const url = $(this).attr('action')
 
-  let res;
-  const likes = $(`.like-count${post_id}`).text()
-  const trimCount = parseInt(likes)
+  // Send the intended state rather than a toggle, a double click then likes the post only once
+  const action = $(`.like-btn${post_id}`).hasClass('negative') ? 'unlike' : 'like'
 
   $.ajax({
       type: 'POST',
@@ -16,23 +15,53 @@ $('.like-form').submit(function(e){
       data: {
           'csrfmiddlewaretoken': $('input[name=csrfmiddlewaretoken]').val(),
           'post_id':post_id,
+          'action': action,
       },
       success: function(response) {
         console.log(response)
           if(response['like_added']) {
               $(`.like-btn${post_id}`).removeClass('black')
               $(`.like-btn${post_id}`).addClass('negative')
-              res = trimCount + 1
           } else {
               $(`.like-btn${post_id}`).removeClass('negative')
               $(`.like-btn${post_id}`).addClass('black')
-              res = trimCount - 1
           }
 
-          $(`.like-count${post_id}`).text(res)
+          $(`.like-count${post_id}`).text(response['total_likes'])
       },
       error: function(response) {
           console.log('error', response)
       }
   })
 })
+
+// Refresh the like buttons and counts of every post on the page in one request
+function refreshLikeStates() {
+  const url = $('#post-list').data('like-state-url')
+  const post_ids = $('.like-form').map(function() { return $(this).attr('id') }).get()
+  if (!url || !post_ids.length) {
+    return
+  }
+
+  $.ajax({
+      type: 'GET',
+      url: url,
+      data: {'ids': post_ids.join(',')},
+      success: function(response) {
+          $.each(response['posts'], function(post_id, state) {
+              $(`.like-btn${post_id}`).toggleClass('negative', state['liked']).toggleClass('black', !state['liked'])
+              $(`.like-count${post_id}`).text(state['like_count'])
+          })
+      },
+      error: function(response) {
+          console.log('error', response)
+      }
+  })
+}
+
+// Pages restored from the back-forward cache show the like state of when they were left
+$(window).on('pageshow', function(e) {
+  if (e.originalEvent.persisted) {
+    refreshLikeStates()
+  }
+})
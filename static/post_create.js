@@ -0,0 +1,22 @@
+// Add a post without reloading the feed, only the new post card is rendered by the server
+$(document).on('submit', '.post-create-form', function(e){
+  e.preventDefault()
+
+  const form = $(this)
+
+  $.ajax({
+      type: 'POST',
+      url: form.data('url'),
+      // FormData carries the image file as well
+      data: new FormData(this),
+      processData: false,
+      contentType: false,
+      success: function(response) {
+          $('#post-list').prepend(response['html'])
+          form[0].reset()
+      },
+      error: function(response) {
+          console.log('error', response)
+      }
+  })
+})